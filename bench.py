@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks de DarkTxt-finder sobre un corpus sintético reproducible.
+
+Cada etapa (listado, escaneo, escritura, carga del CSV de PMs, inferencia de PM)
+corre en su propio proceso para medir el pico de RSS y el arranque por separado.
+Los resultados se guardan en JSON junto con el commit, para comparar entre commits:
+
+  python3 bench.py                                   # corpus por defecto, todas las etapas
+  python3 bench.py --archivos 400 --mb 1 --densidad 0.02 --n-dominios 20000
+  python3 bench.py --etapas process_file,escribir_resultados
+  python3 bench.py --comparar bench_resultados/a.json bench_resultados/b.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    import resource  # no existe en Windows: ahí no se mide el RSS
+    _HAS_RESOURCE = True
+except ImportError:
+    _HAS_RESOURCE = False
+
+REPO = Path(__file__).resolve().parent
+MB = 1024 * 1024
+
+ETAPAS = ["recorrer_archivos", "process_file", "process_file_mmap", "escribir_resultados",
+          "cargar_pm_map", "infer_pm_from_lines"]
+
+_PALABRAS = ["alpha", "bravo", "cargo", "delta", "ecopay", "fintech", "globo", "hotel", "intra",
+             "jupiter", "kappa", "lumen", "metro", "nova", "orbit", "pixel", "quanta", "rivera"]
+_TLDS = ["com", "net", "org", "io", "es", "com.mx", "co.uk", "dev"]
+_FORMATOS_HIT = [
+    "https://{sub}{dom}/login:{user}:{pw}",
+    "{user}@{dom}:{pw}",
+    "{dom}:{user}:{pw}",
+    "http://{sub}{dom}/{path} {user} {pw}",
+]
+_FORMATOS_RUIDO = [
+    "{user}@{dom}:{pw}",
+    "https://{dom}/{path}:{user}:{pw}",
+    "{user};{pw};{path}",
+]
+
+
+# --- generador de corpus ---
+def _dominio(i: int) -> str:
+    return f"{_PALABRAS[i % len(_PALABRAS)]}{i}.{_TLDS[i % len(_TLDS)]}"
+
+def generar_corpus(destino: Path, archivos: int, mb: float, largo: int, densidad: float,
+                   n_dominios: int, dispersion: float = 0.0, semilla: int = 1) -> Dict[str, object]:
+    """
+    Genera (o reutiliza si ya existe con los mismos parámetros) un corpus determinista:
+      - `archivos` archivos de ~`mb` MB en subcarpetas (con `dispersion` > 0 los tamaños
+        siguen una lognormal de esa sigma),
+      - líneas de largo medio `largo` (lognormal, sigma 0.5),
+      - una fracción `densidad` de líneas con algún dominio de la lista,
+      - dominios.txt con `n_dominios` dominios y pm.csv (dominio,pm).
+    """
+    params = {"archivos": archivos, "mb": mb, "largo": largo, "densidad": densidad,
+              "n_dominios": n_dominios, "dispersion": dispersion, "semilla": semilla}
+    meta_path = destino / "corpus.json"
+    if meta_path.exists():
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("parametros") == params:
+            return meta
+    if destino.exists():
+        shutil.rmtree(destino)
+    db = destino / "db"
+    db.mkdir(parents=True)
+
+    rnd = random.Random(semilla)
+    dominios = [_dominio(i) for i in range(n_dominios)]
+    ruido = [f"nohit{i}.{_TLDS[i % len(_TLDS)]}" for i in range(500)]
+    relleno = "".join(rnd.choice(string.ascii_letters + string.digits) for _ in range(1 << 16))
+    total_lineas = total_bytes = total_hits = 0
+
+    for fi in range(archivos):
+        objetivo = mb * MB * (rnd.lognormvariate(0, dispersion) if dispersion > 0 else 1.0)
+        partes: List[str] = []
+        escritos = 0
+        while escritos < objetivo:
+            n = max(8, int(rnd.lognormvariate(0, 0.5) * largo))
+            r = rnd.random()
+            campos = {
+                "sub": rnd.choice(["", "www.", "mail.", "sso."]),
+                "user": f"user{rnd.randrange(100000)}",
+                "pw": relleno[rnd.randrange(60000):][:rnd.randint(6, 16)],
+                "path": relleno[rnd.randrange(60000):][:rnd.randint(1, 20)],
+            }
+            if r < densidad:
+                campos["dom"] = rnd.choice(dominios)
+                linea = rnd.choice(_FORMATOS_HIT).format(**campos)
+                total_hits += 1
+            else:
+                campos["dom"] = rnd.choice(ruido)
+                linea = rnd.choice(_FORMATOS_RUIDO).format(**campos)
+            if len(linea) < n:
+                i = rnd.randrange(60000)
+                linea += ":" + relleno[i:i + n - len(linea)]
+            partes.append(linea)
+            escritos += len(linea) + 1
+        sub = db / f"grupo{fi // 50:03d}"
+        sub.mkdir(exist_ok=True)
+        datos = ("\n".join(partes) + "\n").encode("utf-8")
+        (sub / f"dump{fi:05d}.{('txt', 'csv', 'log')[fi % 3]}").write_bytes(datos)
+        total_lineas += len(partes)
+        total_bytes += len(datos)
+
+    (destino / "dominios.txt").write_text("\n".join(dominios) + "\n", encoding="utf-8")
+    with (destino / "pm.csv").open("w", encoding="utf-8") as f:
+        f.write("dominio,pm\n")
+        for i, d in enumerate(dominios):
+            f.write(f"{d},pm{i % 50}@corp.test\n")
+
+    meta = {"parametros": params, "lineas": total_lineas, "bytes": total_bytes, "hits": total_hits}
+    meta_path.write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    return meta
+
+
+# --- etapas (se ejecutan en un proceso hijo) ---
+def _rss_pico_mb() -> Optional[float]:
+    if not _HAS_RESOURCE:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / MB if sys.platform == "darwin" else pico / 1024
+
+def _mejor(fn, repeticiones: int) -> float:
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+def _ejecutar_etapa(etapa: str, corpus: Path, repeticiones: int) -> Dict[str, object]:
+    t0 = time.perf_counter()
+    import main as M
+    arranque = time.perf_counter() - t0
+
+    meta = json.loads((corpus / "corpus.json").read_text(encoding="utf-8"))
+    db = corpus / "db"
+    exts = ["txt", "csv", "log"]
+    dominios = M.leer_dominios(corpus / "dominios.txt")
+    res: Dict[str, object] = {"arranque_s": arranque}
+
+    def archivos() -> List[str]:
+        return sorted(p for p, _ in M.recorrer_archivos(db, exts))
+
+    def escanear(motor: str) -> List[tuple]:
+        out = []
+        fn = M._process_file_mmap if motor == "mmap" else M._process_file
+        for p in rutas:
+            out.extend(fn(p))
+        return out
+
+    if etapa == "recorrer_archivos":
+        n = [0]
+
+        def listar():
+            n[0] = sum(1 for _ in M.recorrer_archivos(db, exts))
+        res["segundos"] = _mejor(listar, repeticiones)
+        res["items"] = n[0]
+        res["bytes"] = meta["bytes"]
+
+    elif etapa in ("process_file", "process_file_mmap"):
+        motor = "mmap" if etapa.endswith("mmap") else "texto"
+        rutas = archivos()
+        t1 = time.perf_counter()
+        M._init_worker(dominios, motor)
+        res["preparacion_s"] = time.perf_counter() - t1
+        hits = [0]
+
+        def escaneo():
+            hits[0] = len(escanear(motor))
+        res["segundos"] = _mejor(escaneo, repeticiones)
+        res["lineas"] = meta["lineas"]
+        res["bytes"] = meta["bytes"]
+        res["items"] = hits[0]
+
+    elif etapa == "escribir_resultados":
+        rutas = archivos()
+        M._init_worker(dominios, "texto")
+        agg: Dict[str, List[str]] = {}
+        for d, line in escanear("texto"):
+            agg.setdefault(d, []).append(line)
+        pm_map = M.cargar_pm_map(corpus / "pm.csv")
+        tmp = Path(tempfile.mkdtemp(prefix="darktxt_bench_"))
+        try:
+            res["segundos"] = _mejor(lambda: M.escribir_resultados(agg, tmp, False, pm_map), repeticiones)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        res["lineas"] = sum(len(v) for v in agg.values())
+        res["bytes"] = sum(len(l) + 1 for v in agg.values() for l in v)
+        res["items"] = len(agg)
+
+    elif etapa == "cargar_pm_map":
+        ruta = corpus / "pm.csv"
+        n = [0]
+
+        def cargar():
+            n[0] = len(M.cargar_pm_map(ruta))
+        res["segundos"] = _mejor(cargar, repeticiones)
+        res["lineas"] = len(dominios) + 1
+        res["bytes"] = ruta.stat().st_size
+        res["items"] = n[0]
+
+    elif etapa == "infer_pm_from_lines":
+        rutas = archivos()
+        M._init_worker(dominios, "texto")
+        agg = {}
+        for d, line in escanear("texto"):
+            agg.setdefault(d, []).append(line)
+        pm_map = M.cargar_pm_map(corpus / "pm.csv")
+        inferidos = [0]
+
+        def inferir():
+            inferidos[0] = sum(1 for lines in agg.values() if M._infer_pm_from_lines(lines, pm_map))
+        res["segundos"] = _mejor(inferir, repeticiones)
+        res["lineas"] = sum(len(v) for v in agg.values())
+        res["bytes"] = sum(len(l) + 1 for v in agg.values() for l in v)
+        res["items"] = inferidos[0]
+
+    else:
+        raise SystemExit(f"[X] Etapa desconocida: {etapa}")
+
+    seg = max(res["segundos"], 1e-9)
+    if "lineas" in res:
+        res["lineas_s"] = res["lineas"] / seg
+    if "bytes" in res:
+        res["bytes_s"] = res["bytes"] / seg
+    res["rss_pico_mb"] = _rss_pico_mb()
+    return res
+
+
+# --- orquestación y reporte ---
+def _commit() -> str:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO,
+                             capture_output=True, text=True, check=True).stdout.strip()
+        sucio = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO,
+                               capture_output=True, text=True).stdout.strip()
+        return sha + ("-dirty" if sucio else "")
+    except Exception:
+        return "desconocido"
+
+def _correr_hijo(etapa: str, corpus: Path, repeticiones: int) -> Dict[str, object]:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+        salida = tmp.name
+    try:
+        t0 = time.perf_counter()
+        proc = subprocess.run([sys.executable, str(Path(__file__).resolve()), "--_etapa", etapa,
+                               "--corpus", str(corpus), "--repeticiones", str(repeticiones), "--_salida", salida],
+                              cwd=REPO, capture_output=True, text=True)
+        total = time.perf_counter() - t0
+        if proc.returncode != 0:
+            return {"error": (proc.stderr or proc.stdout).strip().splitlines()[-1:]}
+        res = json.loads(Path(salida).read_text(encoding="utf-8"))
+        res["proceso_s"] = total
+        return res
+    finally:
+        os.unlink(salida)
+
+def _arranque_cli() -> float:
+    """Tiempo de `python main.py --help` (intérprete + imports + argparse)."""
+    t0 = time.perf_counter()
+    subprocess.run([sys.executable, str(REPO / "main.py"), "--help"], cwd=REPO, capture_output=True)
+    return time.perf_counter() - t0
+
+def _fmt(n: Optional[float], unidad: str = "") -> str:
+    if n is None:
+        return "-"
+    for lim, suf in ((1e9, "G"), (1e6, "M"), (1e3, "k")):
+        if n >= lim:
+            return f"{n / lim:.2f}{suf}{unidad}"
+    return f"{n:.2f}{unidad}"
+
+def _fmt_rss(mb: Optional[float], ancho: int, unidad: str) -> str:
+    """RSS pico alineado a `ancho` (con su unidad); '-' donde no se pudo medir."""
+    return f"{'-':>{ancho + len(unidad)}}" if mb is None else f"{mb:>{ancho}.1f}{unidad}"
+
+def imprimir_tabla(resultado: Dict[str, object]) -> None:
+    print(f"\ncommit {resultado['commit']}  ·  python {resultado['python']}  ·  "
+          f"arranque CLI {resultado['arranque_cli_s']:.3f}s")
+    print(f"{'etapa':<22}{'segundos':>10}{'líneas/s':>12}{'bytes/s':>12}{'RSS pico':>11}{'import':>9}")
+    for etapa, r in resultado["etapas"].items():
+        if "error" in r:
+            print(f"{etapa:<22}  ERROR: {' '.join(r['error'])}")
+            continue
+        print(f"{etapa:<22}{r['segundos']:>10.3f}{_fmt(r.get('lineas_s')):>12}{_fmt(r.get('bytes_s'), 'B'):>12}"
+              f"{_fmt_rss(r['rss_pico_mb'], 9, 'MB')}{r['arranque_s']:>8.3f}s")
+
+def comparar(a_path: Path, b_path: Path, umbral: float) -> int:
+    """Compara dos resultados; devuelve 1 si alguna etapa empeoró más que `umbral` (%)."""
+    a = json.loads(a_path.read_text(encoding="utf-8"))
+    b = json.loads(b_path.read_text(encoding="utf-8"))
+    if a.get("parametros") != b.get("parametros"):
+        print("[!] Los corpus tienen parámetros distintos; la comparación puede no ser válida.")
+    print(f"{a['commit']} → {b['commit']}")
+    print(f"{'etapa':<22}{'seg A':>9}{'seg B':>9}{'Δ tiempo':>10}{'RSS A':>9}{'RSS B':>9}")
+    regresion = False
+    for etapa in a["etapas"]:
+        ra, rb = a["etapas"][etapa], b["etapas"].get(etapa)
+        if not rb or "error" in ra or "error" in rb:
+            continue
+        delta = (rb["segundos"] - ra["segundos"]) / max(ra["segundos"], 1e-9) * 100
+        marca = "  ⚠️" if delta > umbral else ""
+        regresion |= delta > umbral
+        print(f"{etapa:<22}{ra['segundos']:>9.3f}{rb['segundos']:>9.3f}{delta:>+9.1f}%"
+              f"{_fmt_rss(ra['rss_pico_mb'], 8, 'M')}{_fmt_rss(rb['rss_pico_mb'], 8, 'M')}{marca}")
+    return 1 if regresion else 0
+
+def parse_args() -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Benchmarks de DarkTxt-finder con corpus sintético")
+    ap.add_argument("--corpus", type=str, default=str(Path.home() / ".cache" / "darktxt" / "bench"),
+                    help="Carpeta del corpus generado (se reutiliza si los parámetros coinciden)")
+    ap.add_argument("--archivos", type=int, default=60, help="Nº de archivos del corpus")
+    ap.add_argument("--mb", type=float, default=1.0, help="Tamaño medio de cada archivo (MB)")
+    ap.add_argument("--dispersion", type=float, default=0.0,
+                    help="Sigma lognormal de los tamaños de archivo (0 = todos iguales)")
+    ap.add_argument("--largo", type=int, default=60, help="Largo medio de línea (caracteres)")
+    ap.add_argument("--densidad", type=float, default=0.05, help="Fracción de líneas con hit")
+    ap.add_argument("--n-dominios", type=int, default=1000, help="Tamaño de la lista de dominios")
+    ap.add_argument("--semilla", type=int, default=1, help="Semilla del generador")
+    ap.add_argument("--etapas", type=str, default=",".join(ETAPAS),
+                    help="Etapas a medir (coma-separadas). Por defecto: todas")
+    ap.add_argument("--repeticiones", type=int, default=3, help="Repeticiones por etapa (se queda la mejor)")
+    ap.add_argument("--salida", type=str, default=str(REPO / "bench_resultados"),
+                    help="Carpeta donde guardar el JSON de resultados")
+    ap.add_argument("--comparar", nargs=2, metavar=("A.json", "B.json"),
+                    help="Comparar dos resultados guardados (sale con 1 si hay regresión)")
+    ap.add_argument("--umbral", type=float, default=10.0,
+                    help="%% de empeoramiento a partir del cual --comparar marca regresión")
+    ap.add_argument("--_etapa", type=str, help=argparse.SUPPRESS)
+    ap.add_argument("--_salida", type=str, help=argparse.SUPPRESS)
+    return ap.parse_args()
+
+def main() -> None:
+    args = parse_args()
+    if args._etapa:
+        res = _ejecutar_etapa(args._etapa, Path(args.corpus), max(args.repeticiones, 1))
+        Path(args._salida).write_text(json.dumps(res), encoding="utf-8")
+        return
+    if args.comparar:
+        sys.exit(comparar(Path(args.comparar[0]), Path(args.comparar[1]), args.umbral))
+
+    etapas = [e.strip() for e in args.etapas.split(",") if e.strip()]
+    desconocidas = [e for e in etapas if e not in ETAPAS]
+    if desconocidas:
+        print(f"[X] Etapas desconocidas: {', '.join(desconocidas)} (disponibles: {', '.join(ETAPAS)})")
+        sys.exit(1)
+
+    corpus = Path(args.corpus).expanduser()
+    t0 = time.perf_counter()
+    meta = generar_corpus(corpus, args.archivos, args.mb, args.largo, args.densidad,
+                          args.n_dominios, args.dispersion, args.semilla)
+    print(f"→ Corpus: {meta['lineas']} líneas, {meta['bytes'] / MB:.1f} MB, {meta['hits']} hits "
+          f"({time.perf_counter() - t0:.1f}s) en {corpus}")
+
+    resultado = {
+        "commit": _commit(),
+        "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "cpus": os.cpu_count(),
+        "parametros": meta["parametros"],
+        "corpus": {k: meta[k] for k in ("lineas", "bytes", "hits")},
+        "arranque_cli_s": _arranque_cli(),
+        "etapas": {},
+    }
+    for etapa in etapas:
+        print(f"   {etapa} ...", flush=True)
+        resultado["etapas"][etapa] = _correr_hijo(etapa, corpus, max(args.repeticiones, 1))
+
+    imprimir_tabla(resultado)
+    salida = Path(args.salida).expanduser()
+    salida.mkdir(parents=True, exist_ok=True)
+    huella = hashlib.sha256(json.dumps(meta["parametros"], sort_keys=True).encode()).hexdigest()[:8]
+    ruta = salida / f"bench-{resultado['commit']}-{huella}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    ruta.write_text(json.dumps(resultado, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"\n📂 Resultados guardados en: {ruta}")
+
+if __name__ == "__main__":
+    main()
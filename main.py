@@ -2,13 +2,40 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import array
+import bisect
+import bz2
+import codecs
+import gc
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import lzma
+import mmap
+import operator
 import os
 import sys
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Iterable, Iterator, List, Tuple, Optional
 import multiprocessing as mp
 import unicodedata
 import csv
+import functools
+import pickle
+import queue
+import re
+import shutil
+import signal
+import sqlite3
+import struct
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib.parse import urlparse
 
 try:
@@ -23,11 +50,26 @@ try:
 except Exception:
     _HAS_TQDM = False
 
+try:
+    import resource  # no existe en Windows
+    _HAS_RESOURCE = True
+except Exception:
+    _HAS_RESOURCE = False
+
+try:
+    import zstandard  # pip install zstandard (sólo para dumps .zst)
+    _HAS_ZSTD = True
+except Exception:
+    _HAS_ZSTD = False
+
 from colorama import Fore, Style, init as colorama_init
 colorama_init(autoreset=True)
 
 DEF_EXTS = ["txt","csv","log","json","sql","tsv","xml","yml","yaml","ndjson"]
 
+# dumps comprimidos que se descomprimen al vuelo en los workers
+EXTS_COMPRIMIDAS = ("gz", "bz2", "xz", "zst")
+
 IGNORE_DIRNAMES = {
     # macOS / sistema
     ".Spotlight-V100", ".Trashes", ".Trash", ".fseventsd", ".TemporaryItems",
@@ -101,38 +143,1300 @@ def mostrar_banner():
 
 _G_DOMINIOS: List[str] = []
 _G_AUTOMATON = None
+_G_MOTOR = "texto"
+_G_DEDUP: Optional[str] = None  # None, "dominio" o "global"
+_G_PM = None                     # ArbolPM para inferir el PM de las líneas en el worker
+_G_PM_INFERIR: Optional[set] = None  # dominios sin PM propio (hay que inferirlo de sus líneas)
+_G_IDX: Dict[str, int] = {}      # dominio -> índice en _G_DOMINIOS
+_G_SPILL_DIR: Optional[str] = None  # carpeta de los archivos de spill de los workers
+_G_SPILL = None                  # archivo de spill abierto por este worker
+_G_SPILL_N = 0                   # nº de archivos de spill que abrió este worker
+
+# tarea de escaneo: (ruta, inicio, fin) en bytes; fin=None = hasta el final del archivo
+Tarea = Tuple[str, int, Optional[int]]
+# resultado de una tarea: (tarea, hits (dominio, línea), estadísticas de la tarea,
+# PM inferido por índice de hit -sólo los hits que hacen falta para elegir el PM-);
+# si _usar_referencias, los hits son Referencias y el PM viene ya por dominio (_inferir_pm_refs)
+ResultadoTarea = Tuple[Tarea, List[Tuple[str, str]], Dict[str, int], Dict[int, str]]
+# hits como referencias: {índice del dominio: array("Q") con el par (offset, bytes) de cada línea},
+# en orden de aparición; el texto se lee del archivo de datos recién al escribir (ver LectorSpill)
+Referencias = Dict[int, array.array]
+# archivo de datos de una región de referencias, con el tamaño y mtime_ns que vio el worker
+OrigenReferencias = Tuple[str, int, int]
+# región de un archivo de spill: (archivo, offset, bytes, spill anterior del worker ya terminado o None,
+# origen si los bloques son referencias (offset, bytes) en vez de texto o None)
+RefSpill = Tuple[Optional[str], int, int, Optional[str], Optional[OrigenReferencias]]
+# lo que vuelve al padre por el pipe: (tarea, región con sus hits, estadísticas,
+# PM inferido por dominio como [(nº de línea dentro del bloque del dominio, pm)])
+ResumenTarea = Tuple[Tarea, RefSpill, Dict[str, int], Dict[str, List[Tuple[int, str]]]]
+
+# tamaño de bloque que el motor mmap entrega de una vez al automaton
+_BLOQUE_MMAP = 64 * 1024 * 1024
+# bloque de lectura para dumps comprimidos en el motor mmap
+_BLOQUE_STREAM = 16 * 1024 * 1024
+
+# Contador de secuencias UTF-8 inválidas: se comporta igual que errors="ignore"
+# pero cuenta cuántas veces se descartaron bytes (por proceso).
+_G_ERRORES_DECOD = 0
+
+def _contar_error_decod(exc: UnicodeDecodeError):
+    global _G_ERRORES_DECOD
+    _G_ERRORES_DECOD += 1
+    return "", exc.end
+
+codecs.register_error("darktxt_contar", _contar_error_decod)
+
+def _clave_automaton(dominio: str, motor: str) -> str:
+    """
+    Clave con la que se registra el dominio en el automaton.
+    El motor mmap busca sobre bytes vistos como latin-1 (1 byte = 1 carácter),
+    así que el dominio se registra con esa misma vista de su UTF-8.
+    """
+    if motor == "mmap":
+        return dominio.encode("utf-8").decode("latin-1")
+    return dominio
 
-def _init_worker(domains: List[str]):
-    global _G_DOMINIOS, _G_AUTOMATON
-    _G_DOMINIOS = domains
-
+def construir_automaton(dominios: List[str], motor: str = "texto"):
+    """Construye el automaton Aho-Corasick de la lista de dominios para el motor dado."""
     automaton = ahocorasick.Automaton(
         store=ahocorasick.STORE_ANY,
         key_type=ahocorasick.KEY_STRING
     )
-    for idx, d in enumerate(_G_DOMINIOS):
-        automaton.add_word(d, (idx, d))  # value: (idx, dominio)
+    for idx, d in enumerate(dominios):
+        automaton.add_word(_clave_automaton(d, motor), (idx, d))  # value: (idx, dominio)
     automaton.make_automaton()
-    _G_AUTOMATON = automaton
+    return automaton
+
+# versión del formato del cache de automatons; subirla invalida los caches viejos
+_VERSION_CACHE_AUTOMATON = 1
+
+def _version_ahocorasick() -> str:
+    try:
+        from importlib.metadata import version
+        return version("pyahocorasick")
+    except Exception:
+        return "?"
+
+def clave_cache_automaton(dominios: List[str], motor: str) -> str:
+    """hash_dominios más lo que cambia el archivo serializado (formato del cache y versión de pyahocorasick)."""
+    base = f"v{_VERSION_CACHE_AUTOMATON}|{_version_ahocorasick()}|{hash_dominios(dominios, motor)}"
+    return hashlib.sha256(base.encode("utf-8")).hexdigest()
+
+class _SoloDatos(pickle.Unpickler):
+    """Unpickler que no resuelve ningún global: sólo tuplas, números y strings (los valores del automaton)."""
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"el cache de automaton referencia {module}.{name}")
+
+def _valor_automaton(datos: bytes):
+    return _SoloDatos(io.BytesIO(datos)).load()
+
+def _cache_confiable(ruta: Path) -> bool:
+    """
+    El archivo y su carpeta son del usuario actual y nadie más puede escribirlos: el cache
+    lo parsea pyahocorasick en C, así que no se carga uno que otro usuario haya podido dejar.
+    """
+    if not hasattr(os, "getuid"):
+        return True
+    for st in (ruta.stat(), ruta.parent.stat()):
+        if st.st_uid != os.getuid() or st.st_mode & 0o022:
+            return False
+    return True
+
+# tope del cache de automatons: los más viejos (por último uso) se borran al guardar uno nuevo
+_MAX_DIAS_CACHE = 30
+
+def _podar_cache_automaton(cache_dir: Path, max_bytes: int, conservar: Path) -> None:
+    """Borra los automatons sin usar en _MAX_DIAS_CACHE días y luego los más viejos hasta caber en max_bytes."""
+    limite = time.time() - _MAX_DIAS_CACHE * 86400
+    entradas = []
+    for ruta in cache_dir.glob("automaton-*"):
+        try:
+            st = ruta.stat()
+        except OSError:
+            continue
+        # los .tmp huérfanos (una ejecución que murió guardando) también caducan, a la hora
+        if ruta.suffix == ".tmp":
+            if st.st_mtime < time.time() - 3600:
+                ruta.unlink(missing_ok=True)
+            continue
+        entradas.append((st.st_mtime, st.st_size, ruta))
+    total = sum(tam for _, tam, _ in entradas)
+    for mtime, tam, ruta in sorted(entradas):
+        if ruta == conservar or (mtime >= limite and total <= max_bytes):
+            continue
+        try:
+            ruta.unlink()
+            total -= tam
+        except OSError:
+            pass
+
+def obtener_automaton(dominios: List[str], motor: str, cache_dir: Optional[Path] = None,
+                      cache_max: int = 1024 * 1024 * 1024):
+    """
+    Devuelve (automaton, ruta_cache). Si hay cache en disco para esta lista y motor
+    se carga de ahí; si no, se construye y se guarda para la próxima ejecución.
+    Sin cache_dir se construye siempre y ruta_cache es None.
+    Al guardar uno nuevo se poda el cache para que no pase de `cache_max` bytes.
+    """
+    if cache_dir is None:
+        return construir_automaton(dominios, motor), None
+
+    ruta = cache_dir / f"automaton-{clave_cache_automaton(dominios, motor)}.bin"
+    if ruta.is_file():
+        if not _cache_confiable(ruta):
+            sys.stderr.write(f"[!] Cache de automaton ignorado ({ruta}): es de otro usuario o "
+                             f"otros pueden escribirlo. Reconstruyendo.\n")
+            return construir_automaton(dominios, motor), None
+        try:
+            automaton = ahocorasick.load(str(ruta), _valor_automaton)
+            os.utime(ruta)  # último uso, para podar por antigüedad
+            return automaton, str(ruta)
+        except Exception as e:
+            sys.stderr.write(f"[!] Cache de automaton inválido ({ruta}): {e}. Reconstruyendo.\n")
+
+    automaton = construir_automaton(dominios, motor)
+    try:
+        cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp = ruta.with_name(ruta.name + f".{os.getpid()}.tmp")
+        automaton.save(str(tmp), pickle.dumps)
+        os.replace(tmp, ruta)  # atómico: nunca queda un cache a medio escribir
+        _podar_cache_automaton(cache_dir, cache_max, ruta)
+    except Exception as e:
+        sys.stderr.write(f"[!] No se pudo guardar el cache de automaton en {cache_dir}: {e}\n")
+        return automaton, None
+    return automaton, str(ruta)
 
-def _process_file(path: str) -> List[Tuple[str, str]]:
+def _init_worker(domains: List[str], motor: str = "texto", automaton_path: Optional[str] = None,
+                 dedup: Optional[str] = None, pm=None, pm_inferir: Optional[set] = None,
+                 spill_dir: Optional[str] = None):
+    """
+    Prepara el worker. Con 'fork' el automaton ya viene heredado del padre
+    (copy-on-write); con 'spawn' se carga del archivo serializado por el padre.
+    Sólo si no hay ninguno de los dos se construye aquí.
+    Con `pm` (ArbolPM) y `pm_inferir` el worker infiere el PM de las líneas de esos dominios.
+    `spill_dir` es donde _procesar_lote deja los hits (ver _volcar_spill).
+    """
+    global _G_DOMINIOS, _G_AUTOMATON, _G_MOTOR, _G_DEDUP, _G_PM, _G_PM_INFERIR, _G_IDX, _G_SPILL_DIR
+    # Ctrl-C lo gestiona sólo el padre (guarda checkpoint y termina el pool)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _G_DOMINIOS = domains
+    _G_MOTOR = motor
+    _G_DEDUP = dedup
+    _G_PM = pm
+    _G_PM_INFERIR = pm_inferir if pm is not None else None
+    _G_IDX = {d: i for i, d in enumerate(domains)}
+    _G_SPILL_DIR = spill_dir
+
+    if _G_AUTOMATON is not None:
+        return
+    if automaton_path:
+        _G_AUTOMATON = ahocorasick.load(automaton_path, _valor_automaton)
+    else:
+        _G_AUTOMATON = construir_automaton(domains, motor)
+
+def _usar_fork() -> bool:
+    """
+    'fork' sólo en Linux. En macOS existe pero no es seguro con hilos ni con las
+    librerías del sistema (por eso allí el método por defecto es 'spawn').
+    """
+    return sys.platform.startswith("linux") and "fork" in mp.get_all_start_methods()
+
+def _contexto_pool():
+    """Contexto de multiprocessing para los pools: 'fork' donde _usar_fork(), si no el del sistema."""
+    return mp.get_context("fork") if _usar_fork() else mp.get_context()
+
+def _preparar_pool(dominios: List[str], motor: str, automaton, tmp_dir: str,
+                   automaton_path: Optional[str] = None, dedup: Optional[str] = None,
+                   pm=None, pm_inferir: Optional[set] = None):
+    """
+    Decide cómo compartir el automaton ya construido con los workers.
+    Con 'fork' se hereda copy-on-write: una sola copia en RAM para todos (se congela
+    el GC; el llamador hace gc.unfreeze() al cerrar el pool). Con 'spawn' (Windows,
+    macOS) no hay nada compartido: cada worker carga su propio automaton del archivo,
+    así que la memoria crece con --jobs. Si ya existe serializado en disco (cache) se
+    reutiliza ese archivo.
+    El ArbolPM se hereda con 'fork' y viaja serializado en los initargs con 'spawn'.
+    Los workers dejan sus hits en archivos de spill dentro de tmp_dir.
+    Devuelve (contexto multiprocessing, initargs para _init_worker).
+    """
+    global _G_DOMINIOS, _G_AUTOMATON, _G_MOTOR
+    if _usar_fork():
+        # los hijos heredan el automaton del padre sin copiarlo ni reconstruirlo
+        _G_DOMINIOS, _G_AUTOMATON, _G_MOTOR = dominios, automaton, motor
+        gc.freeze()  # evita que el GC toque (y duplique) páginas compartidas
+        return _contexto_pool(), (dominios, motor, None, dedup, pm, pm_inferir, tmp_dir)
+
+    if not automaton_path:
+        automaton_path = os.path.join(tmp_dir, "automaton.bin")
+        automaton.save(automaton_path, pickle.dumps)
+    return mp.get_context(), (dominios, motor, automaton_path, dedup, pm, pm_inferir, tmp_dir)
+
+def codec_de(path: str) -> Optional[str]:
+    """Extensión de compresión del archivo ('gz', 'bz2', 'xz', 'zst') o None si es plano."""
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return ext if ext in EXTS_COMPRIMIDAS else None
+
+def _abrir_descomprimido(p: Path, codec: str):
+    """Stream binario con el contenido descomprimido."""
+    if codec == "gz":
+        return gzip.open(p, "rb")
+    if codec == "bz2":
+        return bz2.open(p, "rb")
+    if codec == "xz":
+        return lzma.open(p, "rb")
+    if not _HAS_ZSTD:
+        raise RuntimeError("falta el paquete 'zstandard' (pip install zstandard)")
+    f = p.open("rb")
+    try:
+        return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=True)
+    except BaseException:
+        f.close()
+        raise
+
+class _LectorRango(io.RawIOBase):
+    """
+    Lector binario que cuenta lo leído y no entrega más de `restante` bytes
+    del archivo subyacente (restante=None = sin límite).
+    """
+
+    def __init__(self, f, restante: Optional[int] = None):
+        self._f = f
+        self._restante = restante
+        self.leidos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = len(b) if self._restante is None else min(len(b), self._restante)
+        if n <= 0:
+            return 0
+        data = self._f.read(n)
+        b[:len(data)] = data
+        self.leidos += len(data)
+        if self._restante is not None:
+            self._restante -= len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._f.close()
+        super().close()
+
+def _abrir_texto(p: Path, ini: int = 0, fin: Optional[int] = None):
+    """
+    Abre el archivo (o el rango [ini, fin) en bytes) en modo texto UTF-8.
+    Devuelve (archivo de texto, lector que cuenta los bytes leídos o None).
+    """
+    codec = codec_de(str(p))
+    if codec:
+        raw = _LectorRango(_abrir_descomprimido(p, codec))
+    elif ini == 0 and fin is None:
+        return p.open("r", encoding="utf-8", errors="darktxt_contar"), None
+    else:
+        f = p.open("rb")
+        f.seek(ini)
+        restante = (fin - ini) if fin is not None else (os.fstat(f.fileno()).st_size - ini)
+        raw = _LectorRango(f, restante)
+    return io.TextIOWrapper(io.BufferedReader(raw), encoding="utf-8", errors="darktxt_contar"), raw
+
+def _bytes_en_disco(p: Path, ini: int, fin: Optional[int]) -> int:
+    try:
+        size = p.stat().st_size
+    except OSError:
+        return 0
+    return max((size if fin is None else min(fin, size)) - ini, 0)
+
+def _process_file(path: str, ini: int = 0, fin: Optional[int] = None,
+                  stats: Optional[Dict[str, int]] = None) -> List[Tuple[str, str]]:
     out: List[Tuple[str, str]] = []
     p = Path(path)
+    lector = None
+    errores = _G_ERRORES_DECOD
+    fallos = 0
+    hasta = None
+    i = 0
     try:
-        with p.open("r", encoding="utf-8", errors="ignore") as f:
+        f, lector = _abrir_texto(p, ini, fin)
+        with f:
             for i, raw in enumerate(f, start=1):
                 line = raw.rstrip("\n")
                 low = line.lower()
                 hits = set()
                 for _, val in _G_AUTOMATON.iter(low):
-                    hits.add(val[1])
+                    hits.add(val)
                 if hits:
-                    for d in hits:
+                    # en orden de dominio (idx): con --dedup global gana siempre el mismo
+                    for _, d in sorted(hits):
                         out.append((d, line))
+            if not codec_de(path):
+                hasta = f.buffer.raw.tell() if lector is None else ini + lector.leidos
+    except Exception as e:
+        fallos = 1
+        sys.stderr.write(f"[!] No se pudo leer {p}: {e}\n")
+    if stats is not None:
+        stats["bytes_disco"] = _bytes_en_disco(p, ini, fin)
+        stats["bytes_datos"] = lector.leidos if lector is not None else stats["bytes_disco"]
+        stats["lineas"] = i
+        stats["errores_decod"] = _G_ERRORES_DECOD - errores
+        stats["errores_lectura"] = fallos
+        stats["leido_hasta"] = hasta
+    return out
+
+def _limites_linea(texto: str, pos: int) -> Tuple[int, int]:
+    """
+    Inicio y fin (exclusivo) de la línea que contiene `pos`.
+    Corta en '\n' y '\r' igual que el modo texto (saltos universales).
+    """
+    # el '\r' sólo se busca dentro del tramo ya acotado por los '\n': sin eso, en un
+    # archivo sin '\r' cada hit recorría el bloque entero
+    ini_n = texto.rfind("\n", 0, pos)
+    ini = max(ini_n, texto.rfind("\r", ini_n + 1, pos)) + 1
+    fin_n = texto.find("\n", pos)
+    if fin_n < 0:
+        fin_n = len(texto)
+    fin_r = texto.find("\r", pos, fin_n)
+    return ini, fin_n if fin_r < 0 else fin_r
+
+def _contar_lineas(buf: bytes) -> int:
+    """Líneas del bloque con la misma regla que el modo texto ('\n', '\r\n' y '\r')."""
+    n = buf.count(b"\n") + buf.count(b"\r") - buf.count(b"\r\n")
+    if buf and buf[-1] not in (10, 13):
+        n += 1
+    return n
+
+def _escanear_bytes(buf: bytes, out, base: Optional[int] = None) -> int:
+    """
+    Pasa el automaton sobre un bloque de líneas completas en bytes.
+    Sólo se pliegan mayúsculas ASCII y sólo se decodifica la línea donde cae un hit.
+    Con `base` (offset del bloque en el archivo) no se decodifica nada: `out` son
+    Referencias y recibe el par (offset, bytes) de la línea en la columna de cada dominio.
+    Devuelve el número de líneas del bloque.
+    """
+    texto = buf.lower().decode("latin-1")
+    fin_linea = -1
+    ini_linea = 0
+    hits = None
+    for pos, val in _G_AUTOMATON.iter(texto):
+        if pos >= fin_linea:
+            if hits:
+                _anotar_hits(buf, ini_linea, fin_linea, hits, out, base)
+            ini_linea, fin_linea = _limites_linea(texto, pos)
+            hits = set()
+        hits.add(val)  # (idx, dominio)
+    if hits:
+        _anotar_hits(buf, ini_linea, fin_linea, hits, out, base)
+    return _contar_lineas(buf)
+
+def _anotar_hits(buf: bytes, ini: int, fin: int, hits: set, out, base: Optional[int]) -> None:
+    """Anota la línea [ini, fin) en cada dominio de `hits`, en orden de idx (ver _process_file)."""
+    if base is not None:
+        for idx, _ in sorted(hits):
+            col = out.get(idx)
+            if col is None:
+                col = out[idx] = array.array("Q")
+            col.extend((base + ini, fin - ini))
+        return
+    line = buf[ini:fin].decode("utf-8", errors="darktxt_contar")
+    for _, d in sorted(hits):
+        out.append((d, line))
+
+def _escanear_stream_bytes(f, out: List[Tuple[str, str]]) -> Tuple[int, int]:
+    """Motor por bytes sobre un stream (dumps comprimidos): bloques cortados en '\n'. Devuelve (bytes, líneas)."""
+    leidos = lineas = 0
+    resto = b""
+    while True:
+        bloque = f.read(_BLOQUE_STREAM)
+        if not bloque:
+            break
+        leidos += len(bloque)
+        buf = resto + bloque if resto else bloque
+        corte = buf.rfind(b"\n")
+        if corte < 0:
+            resto = buf
+            continue
+        lineas += _escanear_bytes(buf[:corte + 1], out)
+        resto = buf[corte + 1:]
+    if resto:
+        lineas += _escanear_bytes(resto, out)
+    return leidos, lineas
+
+def _process_file_mmap(path: str, ini: int = 0, fin: Optional[int] = None,
+                       stats: Optional[Dict[str, int]] = None, refs: bool = False):
+    """
+    Variante de _process_file que mapea el archivo en memoria y busca sobre bytes.
+    Produce las mismas líneas que el modo texto para dominios ASCII.
+    Los dumps comprimidos no se pueden mapear: se descomprimen en streaming.
+    Los errores de decodificación sólo se cuentan en las líneas con hits (el resto no se decodifica).
+    Con `refs` (sólo archivos planos) devuelve las referencias de los hits en vez de las líneas.
+    """
+    out = {} if refs else []
+    p = Path(path)
+    datos = None
+    lineas = 0
+    errores = _G_ERRORES_DECOD
+    fallos = 0
+    hasta = None
+    try:
+        codec = codec_de(path)
+        if codec:
+            with _abrir_descomprimido(p, codec) as f:
+                datos, lineas = _escanear_stream_bytes(f, out)
+        else:
+            with p.open("rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                limite = size if fin is None else min(fin, size)
+                if limite > ini:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        if hasattr(mm, "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                            mm.madvise(mmap.MADV_SEQUENTIAL)
+                        pos = ini
+                        while pos < limite:
+                            corte_fin = min(pos + _BLOQUE_MMAP, limite)
+                            if corte_fin < limite:
+                                # cortar el bloque en un salto de línea para no partir líneas
+                                corte = mm.rfind(b"\n", pos, corte_fin)
+                                if corte < 0:
+                                    corte = mm.find(b"\n", corte_fin, limite)
+                                corte_fin = limite if corte < 0 else corte + 1
+                            lineas += _escanear_bytes(mm[pos:corte_fin], out, pos if refs else None)
+                            pos = corte_fin
+                hasta = max(limite, ini)
     except Exception as e:
+        fallos = 1
         sys.stderr.write(f"[!] No se pudo leer {p}: {e}\n")
+    if stats is not None:
+        stats["bytes_disco"] = _bytes_en_disco(p, ini, fin)
+        stats["bytes_datos"] = datos if datos is not None else stats["bytes_disco"]
+        stats["lineas"] = lineas
+        stats["errores_decod"] = _G_ERRORES_DECOD - errores
+        stats["errores_lectura"] = fallos
+        stats["leido_hasta"] = hasta
     return out
 
+def _rss_pico() -> int:
+    """Pico de memoria residente del proceso en bytes (0 si no se puede medir)."""
+    if not _HAS_RESOURCE:
+        return 0
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico if sys.platform == "darwin" else pico * 1024
+
+def _procesar_tarea(tarea: Tarea, refs: bool = True) -> ResultadoTarea:
+    """
+    Punto de entrada de los workers: escanea un archivo o un rango con el motor elegido.
+    Con refs=False los hits vuelven siempre como texto (reescaneo de una tarea cuyas
+    referencias el padre no pudo resolver).
+    """
+    path, ini, fin = tarea
+    stats = {"duplicados": 0, "comprimido": int(codec_de(path) is not None), "pid": os.getpid()}
+    t0, cpu0 = time.perf_counter(), time.process_time()
+    refs = refs and _usar_referencias(path)
+    if _G_MOTOR == "mmap":
+        out = _process_file_mmap(path, ini, fin, stats, refs)
+    else:
+        out = _process_file(path, ini, fin, stats)
+    stats["seg"] = time.perf_counter() - t0
+    stats["cpu"] = time.process_time() - cpu0
+    stats["hits"] = sum(len(col) for col in out.values()) // 2 if refs else len(out)
+    stats["rss_pico"] = _rss_pico()
+    if refs:
+        pms = _inferir_pm_refs(path, out) if _G_PM_INFERIR and out else {}
+        return tarea, out, stats, pms
+    if _G_DEDUP and out:
+        # primera pasada de dedup dentro de la tarea: menos datos por el pipe
+        n = len(out)
+        out = _dedup_local(out, _G_DEDUP)
+        stats["duplicados"] = n - len(out)
+    pms = _inferir_pm_hits(out) if _G_PM_INFERIR and out else {}
+    return tarea, out, stats, pms
+
+def _usar_referencias(path: str) -> bool:
+    """
+    Los hits viajan como referencias (offset, bytes) cuando el padre puede releer la línea
+    tal cual: motor mmap sobre un archivo plano. El dedup en el worker necesita el texto.
+    """
+    return _G_MOTOR == "mmap" and not _G_DEDUP and codec_de(path) is None
+
+def _inferir_pm_refs(path: str, refs: Referencias) -> Dict[str, List[Tuple[int, str]]]:
+    """
+    Como _inferir_pm_hits para hits por referencia, pero ya por (dominio, nº de línea en su
+    bloque): sólo se leen las líneas hasta dar con la primera con PM de cada dominio.
+    """
+    pm_bloques: Dict[str, List[Tuple[int, str]]] = {}
+    buscar = _G_PM.buscar_cacheado
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for idx, col in refs.items():
+            d = _G_DOMINIOS[idx]
+            if d not in _G_PM_INFERIR:
+                continue
+            for j in range(0, len(col), 2):
+                host = _host_de_linea(mm[col[j]:col[j] + col[j + 1]].decode("utf-8", errors="ignore"))
+                pm = buscar(host) if host else None
+                if pm:
+                    pm_bloques[d] = [(j // 2, pm)]
+                    break
+    return pm_bloques
+
+def _inferir_pm_hits(out: List[Tuple[str, str]]) -> Dict[int, str]:
+    """
+    PM inferido del host de cada línea de los dominios sin PM propio.
+    Al padre le basta la primera línea con PM de cada dominio en la tarea (es la que
+    ganaría al escribir), salvo con --dedup global: ahí el padre puede descartar esa
+    línea y hace falta la siguiente, así que se devuelven todas.
+    """
+    pms: Dict[int, str] = {}
+    resueltos = set()
+    todas = _G_DEDUP == "global"
+    buscar = _G_PM.buscar_cacheado
+    for i, (d, line) in enumerate(out):
+        if d not in _G_PM_INFERIR or (d in resueltos and not todas):
+            continue
+        host = _host_de_linea(line)
+        if host:
+            pm = buscar(host)
+            if pm:
+                pms[i] = pm
+                resueltos.add(d)
+    return pms
+
+# registro del spill: índice del dominio, nº de líneas y bytes del bloque que le sigue
+# (las líneas del dominio en la tarea, en orden, unidas con '\n' y en UTF-8, o en una
+# región de referencias, un array("Q") con el par (offset, bytes) de cada línea)
+_REG_SPILL = struct.Struct("<IIQ")
+_SPILL_MAX = 64 * 1024 * 1024  # al pasar de este tamaño el worker empieza otro archivo de spill
+
+def _volcar_spill(out, pms, origen: Optional[OrigenReferencias] = None) -> Tuple[RefSpill, Dict[str, List[Tuple[int, str]]]]:
+    """
+    Escribe los hits de una tarea en el archivo de spill del worker, un bloque por dominio,
+    y devuelve la región escrita y los PM inferidos por (dominio, nº de línea en su bloque).
+    Con `origen` los hits son Referencias a líneas de ese archivo (ver _escanear_bytes) y
+    `pms` ya viene por dominio (_inferir_pm_refs).
+    Cuando el archivo pasa de _SPILL_MAX se empieza otro; el anterior viaja en la
+    región para que el padre lo borre (ya leyó todo lo que había en él).
+    """
+    global _G_SPILL, _G_SPILL_N
+    if not out:
+        return (None, 0, 0, None, None), {}
+    cerrado = None
+    if _G_SPILL is not None and _G_SPILL.tell() >= _SPILL_MAX:
+        cerrado = _G_SPILL.name
+        _G_SPILL.close()
+        _G_SPILL = None
+    if _G_SPILL is None:
+        _G_SPILL_N += 1
+        _G_SPILL = open(os.path.join(_G_SPILL_DIR, f"spill-{os.getpid()}-{_G_SPILL_N}.bin"), "wb")
+
+    f = _G_SPILL
+    ini = f.tell()
+    if origen is not None:
+        for idx, col in out.items():
+            f.write(_REG_SPILL.pack(idx, len(col) // 2, len(col) * col.itemsize))
+            col.tofile(f)
+        f.flush()
+        return (f.name, ini, f.tell() - ini, cerrado, origen), pms
+
+    bloques: Dict[str, List[str]] = {}
+    pm_bloques: Dict[str, List[Tuple[int, str]]] = {}
+    for i, (d, line) in enumerate(out):
+        lineas = bloques.get(d)
+        if lineas is None:
+            lineas = bloques[d] = []
+        if pms and i in pms:
+            pm_bloques.setdefault(d, []).append((len(lineas), pms[i]))
+        lineas.append(line)
+
+    for d, lineas in bloques.items():
+        datos = "\n".join(lineas).encode("utf-8", "surrogatepass")
+        f.write(_REG_SPILL.pack(_G_IDX[d], len(lineas), len(datos)))
+        f.write(datos)
+    f.flush()  # el padre lee la región en cuanto recibe el resumen
+    return (f.name, ini, f.tell() - ini, cerrado, None), pm_bloques
+
+_PID_TMP = "darktxt.pid"  # dueño de una carpeta temporal de escaneo
+
+def _proceso_vivo(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # existe pero es de otro usuario
+    return True
+
+def crear_tmp_escaneo(base: Optional[Path], prefijo: str) -> str:
+    """
+    Crea la carpeta temporal del escaneo (spill, runs de dedup) dentro de `base`
+    (None = la del sistema) y anota en ella el pid del proceso.
+    Antes borra las carpetas con el mismo prefijo que dejaron ejecuciones muertas
+    (kill -9, OOM): su pid ya no existe. Sólo en POSIX (en Windows os.kill no sirve
+    para consultar un proceso, allí quedan hasta que se borren a mano).
+    """
+    raiz = Path(base) if base is not None else Path(tempfile.gettempdir())
+    if os.name == "posix":
+        for vieja in raiz.glob(prefijo + "*"):
+            try:
+                pid = int((vieja / _PID_TMP).read_text())
+            except (OSError, ValueError):
+                pid = None
+            if pid is None:
+                # sin pid: la están creando ahora mismo o es de una versión anterior
+                try:
+                    huerfana = vieja.stat().st_mtime < time.time() - 3600
+                except OSError:
+                    huerfana = False
+                if huerfana:
+                    shutil.rmtree(vieja, ignore_errors=True)
+            elif pid != os.getpid() and not _proceso_vivo(pid):
+                shutil.rmtree(vieja, ignore_errors=True)
+    tmp_dir = tempfile.mkdtemp(prefix=prefijo, dir=str(raiz))
+    Path(tmp_dir, _PID_TMP).write_text(str(os.getpid()))
+    return tmp_dir
+
+def _firma_archivo(path: str) -> Optional[Tuple[int, int]]:
+    """(tamaño, mtime_ns) del archivo, o None si no se puede consultar."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def _procesar_lote(lote: List[Tarea], refs: bool = True) -> List[ResumenTarea]:
+    """
+    Un lote de tareas agrupadas por bytes se procesa en el mismo worker.
+    Los hits van al spill del worker; por el pipe sólo vuelve un resumen por tarea.
+    La firma del archivo se toma antes de escanearlo: si el padre ve otra, las referencias no valen.
+    """
+    resumenes: List[ResumenTarea] = []
+    for t in lote:
+        firma = _firma_archivo(t[0]) if refs else None
+        tarea, out, stats, pms = _procesar_tarea(t, firma is not None)
+        origen = (tarea[0],) + firma if isinstance(out, dict) else None
+        ref, pm_bloques = _volcar_spill(out, pms, origen)
+        resumenes.append((tarea, ref, stats, pm_bloques))
+    return resumenes
+
+class ReferenciasObsoletas(Exception):
+    """El archivo de datos de una región de referencias ya no es el que escaneó el worker."""
+
+class LectorSpill:
+    """
+    Lado del padre de los spills: lee la región de cada tarea y borra los archivos
+    que los workers dan por terminados.
+    """
+
+    def __init__(self, dominios: List[str]):
+        self.dominios = dominios
+        self._abiertos: Dict[str, object] = {}
+
+    def bloques(self, ref: RefSpill, stats: Optional[Dict[str, int]] = None) -> Iterator[Tuple[str, str, int]]:
+        """
+        (dominio, líneas unidas con '\n', nº de líneas) de una región.
+        Si la región trae referencias, las líneas de cada dominio se leen recién ahora del
+        archivo de datos y los errores de decodificación se suman a `stats`. Antes de entregar
+        nada se comprueba que el archivo sigue siendo el mismo (tamaño, mtime) y que todas las
+        referencias caen dentro; si no, lanza ReferenciasObsoletas y la tarea hay que reescanearla.
+        """
+        ruta, ini, n, cerrado, origen = ref
+        if cerrado:
+            self._descartar(cerrado)
+        if not n:
+            return
+        f = self._abiertos.get(ruta)
+        if f is None:
+            f = self._abiertos[ruta] = open(ruta, "rb")
+        f.seek(ini)
+        datos = f.read(n)
+        if origen is None:
+            pos = 0
+            while pos < n:
+                idx, nl, tam = _REG_SPILL.unpack_from(datos, pos)
+                pos += _REG_SPILL.size
+                yield self.dominios[idx], datos[pos:pos + tam].decode("utf-8", "surrogatepass"), nl
+                pos += tam
+            return
+        ruta_origen, tam_origen, mtime_origen = origen
+        try:
+            with open(ruta_origen, "rb") as src:
+                st = os.fstat(src.fileno())
+                if (st.st_size, st.st_mtime_ns) != (tam_origen, mtime_origen):
+                    raise ReferenciasObsoletas(f"{ruta_origen} cambió después de escanearlo")
+                mm = mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise ReferenciasObsoletas(f"no se pudo releer {ruta_origen}: {e}") from e
+        with mm:
+            cols = []
+            pos = 0
+            while pos < n:
+                idx, nl, tam = _REG_SPILL.unpack_from(datos, pos)
+                pos += _REG_SPILL.size
+                col = array.array("Q")
+                col.frombytes(datos[pos:pos + tam])
+                pos += tam
+                if not _referencias_en_rango(col, len(mm)):
+                    raise ReferenciasObsoletas(f"{ruta_origen} es más corto que lo escaneado")
+                cols.append((idx, nl, col))
+            errores = _G_ERRORES_DECOD
+            for idx, _, col in cols:
+                # por tramos acotados: el padre nunca tiene en memoria todo el texto de un dominio
+                for texto, nl in _leer_referencias(mm, col):
+                    yield self.dominios[idx], texto, nl
+        if stats is not None:
+            stats["errores_decod"] += _G_ERRORES_DECOD - errores
+
+    def _descartar(self, ruta: str) -> None:
+        f = self._abiertos.pop(ruta, None)
+        if f is not None:
+            f.close()
+        try:
+            os.unlink(ruta)
+        except FileNotFoundError:
+            pass
+
+    def cerrar(self) -> None:
+        for f in self._abiertos.values():
+            f.close()
+        self._abiertos.clear()
+
+def _referencias_en_rango(col: array.array, tam: int) -> bool:
+    """True si cada par (offset, bytes) de `col` cabe entero en un archivo de `tam` bytes."""
+    return not col or max(map(operator.add, col[0::2], col[1::2])) <= tam
+
+_TRAMO_REFERENCIAS = 1024 * 1024  # bytes del archivo de datos por bloque entregado al escritor
+
+def _leer_referencias(mm, col: array.array) -> Iterator[Tuple[str, int]]:
+    """
+    (texto, nº de líneas) de las líneas (offset, bytes) de `col`, unidas con '\n', en tramos
+    de ~_TRAMO_REFERENCIAS bytes leídos del archivo de datos mapeado en memoria. Las
+    referencias vienen en orden de offset, y las líneas contiguas separadas por un único
+    '\n' se leen con un solo slice (el propio '\n' del archivo hace de separador).
+    Se decodifica igual que el motor mmap en el worker. Las referencias ya se validaron
+    con _referencias_en_rango, así que cada trozo tiene exactamente sus bytes.
+    """
+    partes: List[bytes] = []
+    tam = lineas = 0
+    ini = fin = -1
+    for o, n in zip(col[0::2], col[1::2]):
+        if ini >= 0 and o == fin + 1 and mm[fin] == 10:
+            fin = o + n
+        else:
+            if ini >= 0:
+                partes.append(mm[ini:fin])
+                tam += fin - ini
+                if tam >= _TRAMO_REFERENCIAS:
+                    yield b"\n".join(partes).decode("utf-8", errors="darktxt_contar"), lineas
+                    partes, tam, lineas = [], 0, 0
+            ini, fin = o, o + n
+        lineas += 1
+    if ini >= 0:
+        partes.append(mm[ini:fin])
+    if partes:
+        yield b"\n".join(partes).decode("utf-8", errors="darktxt_contar"), lineas
+
+def _dedup_local(out: List[Tuple[str, str]], alcance: str) -> List[Tuple[str, str]]:
+    """Quita duplicados de una lista de hits conservando el orden (exacto, acotado a la tarea)."""
+    vistos = set()
+    limpio: List[Tuple[str, str]] = []
+    for d, line in out:
+        clave = line if alcance == "global" else (d, line)
+        if clave in vistos:
+            continue
+        vistos.add(clave)
+        limpio.append((d, line))
+    return limpio
+
+def dividir_en_rangos(path: str, tam_rango: int, desde: int = 0, size: Optional[int] = None) -> List[Tarea]:
+    """
+    Parte un archivo grande (a partir del byte `desde`) en rangos de ~tam_rango bytes
+    alineados a '\n', de modo que cada línea cae entera en un único rango.
+    Los comprimidos no admiten acceso aleatorio: siempre van enteros.
+    """
+    if codec_de(path):
+        return [(path, 0, None)]
+    if size is None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return [(path, desde, None)]
+    if tam_rango <= 0 or size - desde <= tam_rango:
+        return [(path, desde, None)]
+
+    cortes = [desde]
+    with open(path, "rb") as f:
+        objetivo = desde + tam_rango
+        while objetivo < size:
+            f.seek(objetivo - 1)
+            f.readline()  # avanza hasta justo después del siguiente '\n'
+            corte = f.tell()
+            if corte >= size:
+                break
+            if corte > cortes[-1]:
+                cortes.append(corte)
+            objetivo = max(corte, objetivo) + tam_rango
+    cortes.append(size)
+    return [(path, a, b) for a, b in zip(cortes, cortes[1:])]
+
+# --- planificación por tamaño ---
+_LOTE_MIN = 1024 * 1024      # bytes mínimos por lote (agrupa archivos diminutos)
+_LOTE_MAX_TAREAS = 1000      # tope de tareas por lote, aunque sean muy pequeñas
+_PESO_COMPRIMIDO = 4         # un byte comprimido cuesta ~4 descomprimidos al escanear
+
+def peso_tarea(tarea: Tarea, size: int) -> int:
+    """Bytes estimados que escaneará la tarea (size = tamaño del archivo en disco)."""
+    path, ini, fin = tarea
+    n = (size if fin is None else fin) - ini
+    return n * _PESO_COMPRIMIDO if codec_de(path) else n
+
+def _lotes_de_ventana(items: List[Tuple[Tarea, int]], jobs: int, lote_max: int) -> Iterator[List[Tarea]]:
+    items.sort(key=lambda x: x[1], reverse=True)
+    total = sum(b for _, b in items)
+    objetivo = min(max(total // (max(jobs, 1) * 4), _LOTE_MIN), lote_max)
+    lote: List[Tarea] = []
+    acum = 0
+    for tarea, b in items:
+        lote.append(tarea)
+        acum += b
+        if acum >= objetivo or len(lote) >= _LOTE_MAX_TAREAS:
+            yield lote
+            lote, acum = [], 0
+    if lote:
+        yield lote
+
+def planificar_lotes(
+    tareas: Iterable[Tuple[Tarea, int]],
+    jobs: int,
+    lote_max: int = 256 * 1024 * 1024,
+    ventana_max: int = 4096,
+) -> Iterator[List[Tarea]]:
+    """
+    Agrupa (tarea, bytes) en lotes de tamaño parecido en bytes y los entrega del más
+    grande al más pequeño dentro de cada ventana de tareas. La ventana empieza pequeña
+    para que el escaneo arranque pronto y crece hasta `ventana_max` mientras se lista.
+    El objetivo de bytes por lote se adapta al volumen de cada ventana (~4 lotes por worker).
+    """
+    ventana = max(jobs * 4, 16)
+    buf: List[Tuple[Tarea, int]] = []
+    for item in tareas:
+        buf.append(item)
+        if len(buf) >= ventana:
+            yield from _lotes_de_ventana(buf, jobs, lote_max)
+            buf = []
+            ventana = min(ventana * 2, max(ventana_max, 1))
+    if buf:
+        yield from _lotes_de_ventana(buf, jobs, lote_max)
+
+# --- escaneo incremental (manifiesto de archivos ya escaneados) ---
+NOMBRE_MANIFIESTO = ".darktxt_manifest.json"
+_TAM_COLA = 4096  # bytes finales que se guardan hasheados para detectar archivos que sólo crecieron
+
+def hash_dominios(dominios: List[str], motor: str) -> str:
+    """Identifica la lista de dominios (y el motor) con la que se generaron unos resultados."""
+    h = hashlib.sha256(f"{motor}\n".encode("utf-8"))
+    for d in dominios:
+        h.update(d.encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+def _hash_cola(path: str, size: int) -> Optional[str]:
+    """Hash de los últimos bytes antes de `size`, o None si no termina en '\n'."""
+    if size <= 0:
+        return None
+    with open(path, "rb") as f:
+        f.seek(max(size - _TAM_COLA, 0))
+        cola = f.read(min(size, _TAM_COLA))
+    if not cola.endswith(b"\n"):
+        return None
+    return hashlib.sha256(cola).hexdigest()
+
+class ManifiestoEscaneo:
+    """
+    Registro persistente de archivos escaneados (ruta → tamaño, mtime, inodo), atado al
+    hash de la lista de dominios. Permite re-escanear sólo lo nuevo o modificado; si un
+    archivo sólo creció por el final, se escanea únicamente la parte añadida.
+    """
+
+    def __init__(self, ruta: Path, clave: str):
+        self.ruta = ruta
+        self.clave = clave
+        self.archivos: Dict[str, Dict[str, object]] = {}
+        self.valido = False  # True si había un manifiesto previo para esta misma lista
+        self._stats: Dict[str, os.stat_result] = {}  # stat tomado al planificar
+
+    def cargar(self) -> None:
+        try:
+            with self.ruta.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            sys.stderr.write(f"[!] Manifiesto ilegible ({self.ruta}): {e}. Se escanea todo.\n")
+            return
+        if data.get("clave") == self.clave:
+            self.archivos = data.get("archivos", {})
+            self.valido = True
+
+    def pendiente(self, a: str, st: Optional[os.stat_result] = None) -> Optional[int]:
+        """Byte desde el que hay que escanear el archivo, o None si no cambió."""
+        if st is None:
+            try:
+                st = os.stat(a)
+            except OSError:
+                return None
+        self._stats[a] = st
+        previo = self.archivos.get(os.path.abspath(a))
+        if previo is None:
+            return 0
+        if (st.st_size == previo["size"] and st.st_mtime_ns == previo["mtime_ns"]
+                and st.st_ino == previo["ino"]):
+            return None
+        viejo = previo["size"]
+        if (not codec_de(a) and st.st_ino == previo["ino"] and st.st_size > viejo and previo.get("cola")
+                and _hash_cola(a, viejo) == previo["cola"]):
+            return viejo  # sólo se añadieron líneas al final
+        return 0
+
+    def pendientes(self, archivos: List[str]) -> List[Tuple[str, int]]:
+        """(ruta, byte desde el que escanear) de los archivos nuevos o cambiados."""
+        out: List[Tuple[str, int]] = []
+        for a in archivos:
+            desde = self.pendiente(a)
+            if desde is not None:
+                out.append((a, desde))
+        return out
+
+    def registrar(self, path: str, hasta: Optional[int] = None) -> None:
+        """
+        Marca el archivo como escaneado con el estado que tenía al planificar.
+        `hasta` es el byte donde terminó realmente el escaneo (el archivo pudo crecer mientras
+        tanto): se guarda ese tamaño para que la próxima vez se escanee desde ahí.
+        """
+        try:
+            st = self._stats.get(path) or os.stat(path)
+            if hasta is not None and hasta != st.st_size:
+                ahora = os.stat(path)
+                if ahora.st_size == hasta:
+                    st = ahora  # lo leído es el archivo tal como quedó: también vale su mtime
+            size = st.st_size if hasta is None else hasta
+            cola = _hash_cola(path, size)
+        except OSError:
+            return
+        self.archivos[os.path.abspath(path)] = {"size": size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino, "cola": cola}
+
+    def podar(self) -> int:
+        """Quita las entradas de archivos que ya no existen. Devuelve cuántas quitó."""
+        viejos = [a for a in self.archivos if not os.path.exists(a)]
+        for a in viejos:
+            del self.archivos[a]
+        return len(viejos)
+
+    def guardar(self) -> None:
+        tmp = self.ruta.with_name(self.ruta.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump({"clave": self.clave, "archivos": self.archivos}, f)
+        os.replace(tmp, self.ruta)
+
+# --- checkpoints para reanudar escaneos largos ---
+NOMBRE_CHECKPOINT = ".darktxt_checkpoint.json"
+NOMBRE_DIARIO = ".darktxt_checkpoint.diario"
+NOMBRE_FILTRO = ".darktxt_checkpoint.dedup"
+_LOTE_FILTRO = 64 * 1024  # digests por lectura al reponer el filtro de --dedup
+
+class PuntoControl:
+    """
+    Checkpoint en la carpeta Export: tareas terminadas + estado del escritor.
+    Junto a él, un diario con la primera apertura de cada archivo de salida para poder
+    deshacer lo escrito después del último checkpoint al reanudar, y con --dedup el
+    registro de los digests que fue aceptando el filtro (ver abrir_filtro).
+    """
+
+    def __init__(self, out_dir: Path, clave: str):
+        self.ruta = out_dir / NOMBRE_CHECKPOINT
+        self.ruta_diario = out_dir / NOMBRE_DIARIO
+        self.ruta_filtro = out_dir / NOMBRE_FILTRO
+        self.clave = clave
+
+    def cargar(self) -> Optional[Dict[str, object]]:
+        try:
+            with self.ruta.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            sys.stderr.write(f"[!] Checkpoint ilegible ({self.ruta}): {e}\n")
+            return None
+        if data.get("clave") != self.clave:
+            sys.stderr.write("[!] El checkpoint es de otra búsqueda (dominios/carpeta/opciones); se ignora.\n")
+            return None
+        return data
+
+    def leer_diario(self) -> List[Tuple[str, int]]:
+        entradas: List[Tuple[str, int]] = []
+        try:
+            with self.ruta_diario.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        d, antes = json.loads(line)
+                    except ValueError:
+                        break  # última línea a medio escribir
+                    entradas.append((d, antes))
+        except FileNotFoundError:
+            pass
+        return entradas
+
+    def abrir_filtro(self, filtro, hasta: int) -> None:
+        """
+        Repone en `filtro` (recién creado) los digests del registro hasta el byte `hasta`
+        del checkpoint (0 = empezar de cero), descarta lo anotado después y deja el
+        registro abierto para que el filtro siga anotando ahí los digests nuevos.
+        """
+        tam = FiltroDuplicadosExacto._TAM
+        with self.ruta_filtro.open("a+b") as f:
+            f.seek(0, os.SEEK_END)
+            hasta = min(hasta, f.tell()) // tam * tam
+            f.truncate(hasta)
+            f.seek(0)
+            while True:
+                datos = f.read(_LOTE_FILTRO * tam)
+                if not datos:
+                    break
+                filtro.reponer(datos)
+        filtro.registro = self.ruta_filtro.open("ab")
+
+    def guardar(self, hechas: List[Tarea], escritor: "EscritorResultados", extra: Dict[str, object],
+                filtro=None) -> None:
+        escritor.vaciar()
+        data = {"clave": self.clave, "hechas": hechas, "escritor": escritor.estado()}
+        if filtro is not None and filtro.registro is not None:
+            # los digests de todo lo que ya está escrito, a salvo antes que el checkpoint que los cuenta
+            filtro.registro.flush()
+            os.fsync(filtro.registro.fileno())
+            data["dedup_hasta"] = filtro.registro.tell()
+        data.update(extra)
+        tmp = self.ruta.with_name(self.ruta.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.ruta)
+
+    def limpiar(self) -> None:
+        self.ruta.unlink(missing_ok=True)
+        self.ruta_diario.unlink(missing_ok=True)
+        self.ruta_filtro.unlink(missing_ok=True)
+
+# --- instrumentación del escaneo ---
+_CAMPOS_INFORME = ("bytes_disco", "bytes_datos", "lineas", "hits", "errores_decod", "errores_lectura", "seg", "cpu")
+
+def _sumar_fila(filas: Dict[str, Dict[str, float]], path: str, fila: Dict[str, float]) -> None:
+    acum = filas.get(path)
+    if acum is None:
+        filas[path] = dict(fila)
+        return
+    for c, v in fila.items():
+        acum[c] = acum.get(c, 0) + v
+
+class InformeEscaneo:
+    """
+    Acumula las estadísticas de cada tarea: totales, por worker (pid) y los archivos
+    más lentos (los rangos de un mismo archivo se suman). Se vuelca a JSON con --reporte.
+    """
+
+    def __init__(self, top: int = 20):
+        self.top = top
+        self.inicio = time.time()
+        self.totales: Dict[str, float] = dict.fromkeys(_CAMPOS_INFORME, 0)
+        self.totales["tareas"] = 0
+        self.workers: Dict[int, Dict[str, float]] = {}
+        # heap mínimo de tamaño `top` de archivos enteros; el contador desempata (nunca se comparan dicts)
+        self._lentos: List[Tuple[float, int, str, Dict[str, float]]] = []
+        self._n = 0
+        self._partidos: Dict[str, Dict[str, float]] = {}  # archivos partidos en rangos
+
+    def _al_top(self, path: str, fila: Dict[str, float]) -> None:
+        self._n += 1
+        item = (fila["seg"], self._n, path, fila)
+        if len(self._lentos) < self.top:
+            heapq.heappush(self._lentos, item)
+        elif item[0] > self._lentos[0][0]:
+            heapq.heapreplace(self._lentos, item)
+
+    def registrar(self, tarea: Tarea, stats: Dict[str, float]) -> None:
+        path, ini, fin = tarea
+        fila = {c: stats.get(c, 0) for c in _CAMPOS_INFORME}
+        self.totales["tareas"] += 1
+        w = self.workers.setdefault(stats.get("pid", 0), dict.fromkeys(_CAMPOS_INFORME, 0))
+        w["tareas"] = w.get("tareas", 0) + 1
+        w["rss_pico"] = max(w.get("rss_pico", 0), stats.get("rss_pico", 0))
+        for c, v in fila.items():
+            self.totales[c] += v
+            w[c] += v
+        if ini == 0 and fin is None:
+            fila["rangos"] = 1
+            self._al_top(path, fila)
+        else:
+            acum = self._partidos.setdefault(path, dict.fromkeys(_CAMPOS_INFORME, 0))
+            acum["rangos"] = acum.get("rangos", 0) + 1
+            for c, v in fila.items():
+                acum[c] += v
+
+    def datos(self, bytes_planificados: int, listado_terminado: bool) -> Dict[str, object]:
+        duracion = max(time.time() - self.inicio, 1e-9)
+        hechos = self.totales["bytes_disco"]
+        ritmo = hechos / duracion
+        pendiente = max(bytes_planificados - hechos, 0)
+        # los partidos se suman en una copia: siguen acumulando rangos hasta el final
+        por_archivo: Dict[str, Dict[str, float]] = {}
+        for _, _, path, fila in self._lentos:
+            _sumar_fila(por_archivo, path, fila)
+        for path, fila in self._partidos.items():
+            _sumar_fila(por_archivo, path, fila)
+        lentos = heapq.nlargest(self.top, por_archivo.items(), key=lambda kv: kv[1]["seg"])
+
+        def con_ritmo(fila: Dict[str, float], seg: float) -> Dict[str, float]:
+            d = dict(fila)
+            d["mb_s"] = fila["bytes_disco"] / 1048576 / max(seg, 1e-9)
+            return d
+
+        return {
+            "inicio": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.inicio)),
+            "duracion_s": duracion,
+            "totales": dict(self.totales),
+            "throughput": {
+                "bytes_s": ritmo,
+                "bytes_datos_s": self.totales["bytes_datos"] / duracion,
+                "lineas_s": self.totales["lineas"] / duracion,
+                "hits_s": self.totales["hits"] / duracion,
+            },
+            "progreso": {
+                "bytes_planificados": bytes_planificados,
+                "bytes_hechos": hechos,
+                "listado_terminado": listado_terminado,
+                # con el listado en curso el total aún crece: el ETA es una cota inferior
+                "eta_s": (pendiente / ritmo) if ritmo > 0 else None,
+            },
+            "workers": [
+                dict(con_ritmo(w, w["seg"]), pid=pid, ocupacion=w["seg"] / duracion)
+                for pid, w in sorted(self.workers.items())
+            ],
+            "lentos": [dict(con_ritmo(fila, fila["seg"]), archivo=path) for path, fila in lentos],
+        }
+
+    def guardar(self, ruta: Path, bytes_planificados: int, listado_terminado: bool) -> None:
+        tmp = ruta.with_name(ruta.name + ".tmp")
+        with tmp.open("w", encoding="utf-8") as f:
+            json.dump(self.datos(bytes_planificados, listado_terminado), f, indent=2, ensure_ascii=False)
+        os.replace(tmp, ruta)
+
+# --- métricas para monitoreo (formato de texto de Prometheus) ---
+def metricas_prometheus(informe: InformeEscaneo, tareas_planificadas: int, bytes_planificados: int,
+                        listado_terminado: bool, duplicados: int, hits_s: float) -> str:
+    """Texto de exposición de Prometheus con el estado actual del escaneo."""
+    t = informe.totales
+    lineas: List[str] = []
+
+    def metrica(nombre: str, tipo: str, ayuda: str, valores: List[Tuple[str, float]]) -> None:
+        lineas.append(f"# HELP darktxt_{nombre} {ayuda}")
+        lineas.append(f"# TYPE darktxt_{nombre} {tipo}")
+        for etiquetas, v in valores:
+            lineas.append(f"darktxt_{nombre}{etiquetas} {v:.3f}" if isinstance(v, float) else f"darktxt_{nombre}{etiquetas} {v}")
+
+    metrica("tareas_hechas_total", "counter", "Tareas (archivos o rangos) terminadas.", [("", t["tareas"])])
+    metrica("tareas_planificadas", "gauge", "Tareas descubiertas por el listado hasta ahora.", [("", tareas_planificadas)])
+    metrica("cola_tareas", "gauge", "Tareas listadas que aún no terminaron (en cola o en curso).",
+            [("", max(tareas_planificadas - t["tareas"], 0))])
+    metrica("bytes_hechos_total", "counter", "Bytes en disco ya escaneados.", [("", t["bytes_disco"])])
+    metrica("bytes_descomprimidos_total", "counter", "Bytes escaneados tras descomprimir.", [("", t["bytes_datos"])])
+    metrica("bytes_planificados", "gauge", "Bytes en disco de las tareas listadas hasta ahora.", [("", bytes_planificados)])
+    metrica("lineas_total", "counter", "Líneas escaneadas.", [("", t["lineas"])])
+    metrica("hits_total", "counter", "Líneas con coincidencias (antes de deduplicar).", [("", t["hits"])])
+    metrica("hits_por_segundo", "gauge", "Hits por segundo desde la última actualización.", [("", float(hits_s))])
+    metrica("duplicados_total", "counter", "Líneas descartadas por --dedup.", [("", duplicados)])
+    metrica("errores_total", "counter", "Errores por tipo.",
+            [('{tipo="decodificacion"}', t["errores_decod"]), ('{tipo="lectura"}', t["errores_lectura"])])
+    metrica("worker_rss_pico_bytes", "gauge", "Pico de memoria residente de cada worker.",
+            [(f'{{pid="{pid}"}}', w.get("rss_pico", 0)) for pid, w in sorted(informe.workers.items())])
+    metrica("worker_tareas_total", "counter", "Tareas terminadas por cada worker.",
+            [(f'{{pid="{pid}"}}', w["tareas"]) for pid, w in sorted(informe.workers.items())])
+    metrica("listado_terminado", "gauge", "1 cuando el listado de archivos terminó.", [("", int(listado_terminado))])
+    metrica("inicio_timestamp_seconds", "gauge", "Inicio del escaneo (epoch).", [("", float(informe.inicio))])
+    metrica("actualizacion_timestamp_seconds", "gauge", "Última actualización de estas métricas (epoch).",
+            [("", float(time.time()))])
+    return "\n".join(lineas) + "\n"
+
+class ExportadorMetricas:
+    """
+    Publica el texto de métricas en un archivo (para el textfile collector de
+    node_exporter; se reemplaza de forma atómica) y/o en http://127.0.0.1:<puerto>/metrics.
+    """
+
+    def __init__(self, ruta: Optional[Path] = None, puerto: Optional[int] = None):
+        self.ruta = ruta
+        self.texto = ""
+        self._servidor = None
+        if puerto:
+            exportador = self
+
+            class _Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    cuerpo = exportador.texto.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(cuerpo)))
+                    self.end_headers()
+                    self.wfile.write(cuerpo)
+
+                def log_message(self, *args) -> None:
+                    pass
+
+            self._servidor = ThreadingHTTPServer(("127.0.0.1", puerto), _Handler)
+            self._servidor.daemon_threads = True
+            threading.Thread(target=self._servidor.serve_forever, name="metricas", daemon=True).start()
+
+    def publicar(self, texto: str) -> None:
+        self.texto = texto
+        if self.ruta:
+            tmp = self.ruta.with_name(self.ruta.name + ".tmp")
+            tmp.write_text(texto, encoding="utf-8")
+            os.replace(tmp, self.ruta)
+
+    def cerrar(self) -> None:
+        if self._servidor:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+
+class _InterrupcionDiferida:
+    """
+    Mientras `critica` es True, Ctrl-C se aplaza hasta salir de la sección, para que
+    el checkpoint nunca vea una tarea a medio volcar en el escritor.
+    """
+
+    def __init__(self):
+        self.critica = False
+        self.pendiente = False
+        self._previo = None
+
+    def __enter__(self):
+        self._previo = signal.signal(signal.SIGINT, self._manejador)
+        return self
+
+    def __exit__(self, *exc):
+        signal.signal(signal.SIGINT, self._previo)
+        return False
+
+    def _manejador(self, signum, frame):
+        if self.critica:
+            self.pendiente = True
+        else:
+            raise KeyboardInterrupt
+
+    def salir_critica(self) -> None:
+        self.critica = False
+        if self.pendiente:
+            self.pendiente = False
+            raise KeyboardInterrupt
+
 # --- helpers de IO y utilidades ---
 def leer_dominios(path_lista: Path) -> List[str]:
     dominios = []
@@ -150,53 +1454,117 @@ def leer_dominios(path_lista: Path) -> List[str]:
             limpios.append(d)
     return limpios
 
-def _is_ignored_path(p: Path) -> bool:
-    """True si el archivo/directorio debe ignorarse por temporal/sistema."""
-    name = p.name
-
-    for part in p.parts:
-        if part in IGNORE_DIRNAMES:
+def _es_nombre_ignorado(name: str) -> bool:
+    """True si el nombre de archivo es de un temporal/sistema."""
+    if name in IGNORE_FILENAMES:
+        return True
+    for pref in IGNORE_FILE_PREFIXES:
+        if name.startswith(pref):
             return True
-
-    if p.is_file():
-        if name in IGNORE_FILENAMES:
+    for suf in IGNORE_FILE_SUFFIXES:
+        if name.endswith(suf):
+            return True
+    low = name.lower()
+    for ext in IGNORE_FILE_EXTS:
+        if low.endswith(ext):
             return True
-        for pref in IGNORE_FILE_PREFIXES:
-            if name.startswith(pref):
-                return True
-        for suf in IGNORE_FILE_SUFFIXES:
-            if name.endswith(suf):
-                return True
-        low = name.lower()
-        for ext in IGNORE_FILE_EXTS:
-            if low.endswith(ext):
-                return True
-
     return False
 
-def listar_archivos(raiz: Path, exts: List[str], ignore_trash: bool = True) -> List[str]:
+def _ext_efectiva(name: str, s_exts: set) -> str:
+    """Extensión con la que se filtra: dump.sql.gz → 'sql' (salvo que se pida 'gz' explícitamente)."""
+    base, ext = os.path.splitext(name)
+    ext = ext.lower().lstrip(".")
+    if ext in EXTS_COMPRIMIDAS and ext not in s_exts:
+        ext = os.path.splitext(base)[1].lower().lstrip(".")
+    return ext
+
+def recorrer_archivos(
+    raiz: Path,
+    exts: List[str],
+    ignore_trash: bool = True,
+    hilos: int = 8,
+    contadores: Optional[Dict[str, int]] = None,
+) -> Iterator[Tuple[str, os.stat_result]]:
+    """
+    Recorre `raiz` con os.scandir en varios hilos y va entregando (ruta, stat) de los
+    archivos a medida que aparecen, sin esperar a listar todo el árbol.
+    Los directorios de IGNORE_DIRNAMES se podan: no se entra en ellos.
+    `contadores` recibe 'ignorados' y 'sin_zstd'.
+    """
     s_exts = set(e.lower().lstrip(".") for e in exts)
-    archivos: List[str] = []
-    ignorados = 0
-
-    for p in raiz.rglob("*"):
+    if contadores is None:
+        contadores = {}
+    contadores.setdefault("ignorados", 0)
+    contadores.setdefault("sin_zstd", 0)
+
+    dirs: "queue.Queue[Optional[str]]" = queue.Queue()
+    salida: "queue.Queue[Optional[list]]" = queue.Queue(maxsize=256)
+    lock = threading.Lock()
+    pendientes = [1]  # directorios descubiertos y aún sin terminar
+    dirs.put(str(raiz))
+
+    def leer_directorio(d: str) -> None:
+        lote = []
+        subdirs = []
+        ignorados = sin_zstd = 0
         try:
-            if p.is_dir() and ignore_trash and p.name in IGNORE_DIRNAMES:
-                continue
-
-            if p.is_file():
-                if ignore_trash and _is_ignored_path(p):
-                    ignorados += 1
-                    continue
-
-                if not s_exts or p.suffix.lower().lstrip(".") in s_exts:
-                    archivos.append(str(p))
-        except Exception:
+            with os.scandir(d) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            if not (ignore_trash and e.name in IGNORE_DIRNAMES):
+                                subdirs.append(e.path)
+                            continue
+                        if not e.is_file():
+                            continue
+                        if ignore_trash and _es_nombre_ignorado(e.name):
+                            ignorados += 1
+                            continue
+                        ext = _ext_efectiva(e.name, s_exts)
+                        if s_exts and ext not in s_exts:
+                            continue
+                        if codec_de(e.name) == "zst" and not _HAS_ZSTD:
+                            sin_zstd += 1
+                            continue
+                        lote.append((e.path, e.stat()))
+                    except OSError:
+                        ignorados += 1
+        except OSError:
             ignorados += 1
-            continue
 
-    print(f"   (Ignorados {ignorados} temporales/sistema)")
-    return archivos
+        with lock:
+            pendientes[0] += len(subdirs)
+            contadores["ignorados"] += ignorados
+            contadores["sin_zstd"] += sin_zstd
+        for sd in subdirs:
+            dirs.put(sd)
+        if lote:
+            salida.put(lote)
+        with lock:
+            pendientes[0] -= 1
+            terminado = pendientes[0] == 0
+        if terminado:
+            salida.put(None)
+
+    def trabajador() -> None:
+        while True:
+            d = dirs.get()
+            if d is None:
+                return
+            leer_directorio(d)
+
+    # hilos daemon: si el consumidor abandona, no bloquean la salida del proceso
+    for _ in range(max(hilos, 1)):
+        threading.Thread(target=trabajador, daemon=True).start()
+    try:
+        while True:
+            lote = salida.get()
+            if lote is None:
+                break
+            yield from lote
+    finally:
+        for _ in range(max(hilos, 1)):
+            dirs.put(None)
 
 def normalizar_dominio(valor: str) -> str:
     """
@@ -320,6 +1688,41 @@ def cargar_pm_map(pm_csv_path: Path) -> Dict[str, str]:
 
     return pm_map
 
+# Camino rápido de _domain_from_urlish: sólo hosts ASCII sencillos; lo demás pasa por urlparse.
+_LENTO = object()
+_RE_ESQUEMA = re.compile(r"[A-Za-z][A-Za-z0-9+.-]*")
+_RE_HOST_SIMPLE = re.compile(r"[a-z0-9._-]*")
+
+def _host_rapido(s: str):
+    """
+    Hostname normalizado de `s` (sin espacios) con las mismas reglas que
+    urlparse('http://' + s).hostname + normalizar_dominio, o _LENTO si el caso
+    no es trivial (caracteres raros, IPv6, '%', esquema inválido...).
+    """
+    i = s.find(":")
+    if i >= 0 and s.startswith("//", i + 1):
+        if not _RE_ESQUEMA.fullmatch(s, 0, i):
+            return _LENTO
+        resto = s[i + 3:]
+    elif "://" in s:
+        return _LENTO
+    else:
+        resto = s
+    fin = len(resto)
+    for c in "/?#":
+        j = resto.find(c, 0, fin)
+        if j >= 0:
+            fin = j
+    netloc = resto[:fin]
+    if not netloc.isascii() or "[" in netloc or "]" in netloc:
+        return _LENTO
+    host = netloc.rpartition("@")[2].partition(":")[0].lower()
+    if not _RE_HOST_SIMPLE.fullmatch(host):
+        return _LENTO
+    if not host:
+        return None
+    return host[4:] if host.startswith("www.") else host
+
 def _domain_from_urlish(urlish: str) -> Optional[str]:
     """
     Extrae hostname de algo tipo URL. Si no tiene esquema, intenta con http://
@@ -329,6 +1732,9 @@ def _domain_from_urlish(urlish: str) -> Optional[str]:
     if not s:
         return None
     s = s.split()[0]
+    host = _host_rapido(s)
+    if host is not _LENTO:
+        return host
     if "://" not in s:
         s_test = "http://" + s
     else:
@@ -341,10 +1747,118 @@ def _domain_from_urlish(urlish: str) -> Optional[str]:
         return None
     return None
 
+class ArbolPM:
+    """
+    pm_map compilado en un trie de etiquetas invertidas (com -> example -> mail).
+    La búsqueda recorre las etiquetas del dominio una sola vez, sin reconstruir sufijos,
+    y devuelve lo mismo que _find_suffix_match sobre el dict: gana el sufijo más largo
+    (de al menos 2 etiquetas, o el dominio entero) y en cada nivel la clave exacta antes
+    que su variante 'www.'.
+    Los nodos son dicts etiqueta -> hijo; el PM del propio nodo va bajo la clave None
+    y un nodo sin hijos se guarda directamente como el string del PM.
+    """
+    __slots__ = ("_raiz", "claves", "max_cache", "_cache")
+
+    def __init__(self, pm_map: Optional[Dict[str, str]] = None, max_cache: int = 100_000):
+        self._raiz: Dict[Optional[str], object] = {}
+        self.claves = 0
+        self.max_cache = max_cache
+        self._cache: "OrderedDict[str, Optional[str]]" = OrderedDict()  # host -> PM (LRU)
+        for clave, pm in (pm_map or {}).items():
+            self.agregar(clave, pm)
+
+    def __getstate__(self):
+        # el cache es local a cada proceso: no viaja al serializar
+        return self._raiz, self.claves, self.max_cache
+
+    def __setstate__(self, estado) -> None:
+        self._raiz, self.claves, self.max_cache = estado
+        self._cache = OrderedDict()
+
+    def agregar(self, clave: str, pm: str) -> None:
+        etiquetas = clave.split(".")
+        nodo = self._raiz
+        for et in reversed(etiquetas[1:]):
+            hijo = nodo.get(et)
+            if hijo is None:
+                hijo = nodo[et] = {}
+            elif type(hijo) is str:
+                hijo = nodo[et] = {None: hijo}
+            nodo = hijo
+        hoja = nodo.get(etiquetas[0])
+        if type(hoja) is dict:
+            if None not in hoja:
+                self.claves += 1
+            hoja[None] = pm
+        else:
+            self.claves += hoja is None
+            nodo[etiquetas[0]] = pm
+
+    def __len__(self) -> int:
+        return self.claves
+
+    def buscar_normalizado(self, d: str) -> Optional[str]:
+        """Como buscar(), para un dominio ya pasado por normalizar_dominio."""
+        etiquetas = d.split(".")
+        n = len(etiquetas)
+        minimo = 1 if n == 1 else 2
+        nodo = self._raiz
+        mejor = None
+        prof = 0
+        for et in reversed(etiquetas):
+            hijo = nodo.get(et)
+            if hijo is None:
+                break
+            prof += 1
+            if type(hijo) is str:
+                if prof >= minimo:
+                    mejor = hijo
+                break
+            nodo = hijo
+            if prof >= minimo:
+                v = nodo.get(None)
+                if v is None:
+                    www = nodo.get("www")
+                    v = www if type(www) is str or www is None else www.get(None)
+                if v is not None:
+                    mejor = v
+        return mejor
+
+    def buscar(self, dominio: str) -> Optional[str]:
+        """PM del dominio (exacto o por sufijo), o None."""
+        d = normalizar_dominio(dominio)
+        return self.buscar_normalizado(d) if d else None
+
+    def buscar_cacheado(self, host: str) -> Optional[str]:
+        """buscar() con un cache LRU acotado; pensado para los hosts que se repiten línea a línea."""
+        cache = self._cache
+        pm = cache.get(host, _LENTO)
+        if pm is not _LENTO:
+            cache.move_to_end(host)
+            return pm
+        pm = self.buscar(host)
+        cache[host] = pm
+        if len(cache) > self.max_cache:
+            cache.popitem(last=False)
+        return pm
+
+    def buscar_muchos(self, dominios: Iterable[str]) -> List[Optional[str]]:
+        """buscar() para una lista de dominios; los repetidos se resuelven una sola vez."""
+        vistos: Dict[str, Optional[str]] = {}
+        out: List[Optional[str]] = []
+        for dominio in dominios:
+            if dominio not in vistos:
+                vistos[dominio] = self.buscar(dominio)
+            out.append(vistos[dominio])
+        return out
+
 def _find_suffix_match(domain: str, pm_map: Dict[str, str]) -> Optional[str]:
     """
     Coincidencia exacta o por sufijo en pm_map. Soporta equivalencias con/ sin 'www.'.
+    Con un ArbolPM la búsqueda es una sola pasada por el trie.
     """
+    if isinstance(pm_map, ArbolPM):
+        return pm_map.buscar(domain)
     d = normalizar_dominio(domain)
     if not d:
         return None
@@ -363,23 +1877,631 @@ def _find_suffix_match(domain: str, pm_map: Dict[str, str]) -> Optional[str]:
             return pm_map["www." + cand]
     return None
 
+def _host_de_linea(line: str) -> Optional[str]:
+    """
+    Host de una línea url:user:pass / host:user:pass / user@host:pass: el del primer
+    campo (sin ':...' si no es una URL) o, si no hay, el de lo que va antes del primer ':'.
+    """
+    partes = line.split(None, 1)
+    candidate = partes[0] if partes else ""
+    host = _domain_from_urlish(candidate if "://" in candidate else candidate.partition(":")[0])
+    if not host:
+        host = _domain_from_urlish(line.partition(":")[0].strip())
+    return host
+
 def _infer_pm_from_lines(lines: List[str], pm_map: Dict[str, str]) -> Optional[str]:
     """
     Intenta inferir el PM observando los hostnames reales en las líneas (url:user:pass)
     y mapeándolos contra pm_map (exacto o por sufijo). Devuelve el primer PM consistente.
     """
+    if isinstance(pm_map, ArbolPM):
+        buscar = pm_map.buscar_cacheado
+    else:
+        def buscar(host: str) -> Optional[str]:
+            return _find_suffix_match(host, pm_map)
     for line in lines:
-        candidate = line.split()[0] if line.strip() else ""
-        host = _domain_from_urlish(candidate.split(":")[0] if "://" not in candidate and ":" in candidate else candidate)
-        if not host:
-            first_field = line.split(":", 1)[0].strip()
-            host = _domain_from_urlish(first_field)
+        host = _host_de_linea(line)
         if host:
-            pm = _find_suffix_match(host, pm_map)
+            pm = buscar(host)
             if pm:
                 return pm
     return None
 
+LAYOUTS = ("plano", "hash")
+
+def ruta_resultado(out_dir: Path, dominio: str, layout: str = "plano") -> Path:
+    """
+    Archivo de resultados de un dominio: Export/<dominio>.txt ('plano') o
+    Export/ab/cd/<dominio>.txt ('hash', con ab/cd sacados del hash del nombre) para
+    repartir millones de archivos en 65536 subcarpetas.
+    """
+    safe = dominio.replace("/", "_")
+    if layout == "hash":
+        h = hashlib.blake2b(safe.encode("utf-8", errors="surrogatepass"), digest_size=2).hexdigest()
+        return out_dir / h[:2] / h[2:] / f"{safe}.txt"
+    return out_dir / f"{safe}.txt"
+
+def limite_abiertos(pedido: int, reserva: int = 64) -> int:
+    """Recorta `pedido` al límite de descriptores del proceso (RLIMIT_NOFILE) menos una reserva."""
+    if not _HAS_RESOURCE:
+        return pedido
+    blando, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if blando == resource.RLIM_INFINITY:
+        return pedido
+    return max(1, min(pedido, blando - reserva))
+
+class EscritorResultados:
+    """
+    Escribe Export/<dominio>.txt a medida que llegan los hits, sin acumular todo en memoria.
+    - Buffers por dominio con un tope global de bytes (buffer_max).
+    - Como mucho `max_abiertos` archivos abiertos a la vez (LRU de handles en modo append).
+    - layout='hash' reparte los archivos en subcarpetas Export/ab/cd/ (ver ruta_resultado).
+    El contenido final es el mismo que el de escribir_resultados con todo en memoria.
+    Con anexar=True los archivos que ya existen se continúan en lugar de reemplazarse.
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        pm_map: Optional[Dict[str, str]] = None,
+        infer_pm_from_urls: bool = True,
+        buffer_max: int = 64 * 1024 * 1024,
+        max_abiertos: int = 256,
+        anexar: bool = False,
+        pm_en_workers: bool = False,
+        layout: str = "plano",
+    ):
+        self.out_dir = out_dir
+        self.anexar = anexar
+        self.layout = layout
+        self.pm_en_workers = pm_en_workers
+        self.pm_map = pm_map if isinstance(pm_map, ArbolPM) else ArbolPM(pm_map)
+        self.infer_pm_from_urls = infer_pm_from_urls
+        self.buffer_max = max(buffer_max, 1)
+        self.max_abiertos = max(max_abiertos, 1)
+
+        self.conteo: Dict[str, int] = {}
+        self._buffers: Dict[str, List[str]] = {}
+        self._buffer_bytes = 0
+        self._bytes_dominio: Dict[str, int] = {}   # lo que ocupa el buffer de cada dominio
+        self._abiertos: "OrderedDict[str, object]" = OrderedDict()
+        self._creados: set = set()                 # dominios cuyo archivo ya tiene cabecera
+        self._pm: Dict[str, Optional[str]] = {}    # PM resuelto (o None) por dominio
+        self._pm_linea: Dict[str, str] = {}        # primer PM inferido por los workers, por dominio
+        self._pm_tardio: set = set()               # PM inferido después de escribir la cabecera
+        self._tam: Dict[str, int] = {}             # bytes escritos al cerrar cada handle
+        self.diario = None                         # archivo donde anotar la 1ª apertura de cada dominio
+        self._carpetas: set = {self.out_dir}       # subcarpetas que ya existen (layout 'hash')
+
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+
+    def _ruta(self, dominio: str) -> Path:
+        return ruta_resultado(self.out_dir, dominio, self.layout)
+
+    def _crear(self, dominio: str):
+        """Abre el archivo del dominio para escribirlo desde cero (creando su subcarpeta)."""
+        ruta = self._ruta(dominio)
+        if ruta.parent not in self._carpetas:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            self._carpetas.add(ruta.parent)
+        return ruta.open("w", encoding="utf-8")
+
+    def _cabecera(self, dominio: str, pm_info: Optional[str]) -> str:
+        cab = f"# Resultados para: {dominio}\n"
+        if pm_info:
+            cab += f"# PM asignado: {pm_info}\n"
+        return cab
+
+    def _adoptar_existente(self, dominio: str) -> bool:
+        """
+        En modo anexar, toma como propio un archivo de una ejecución anterior
+        (recuperando el PM de su cabecera). Los que sólo dicen '(Sin coincidencias)' se reemplazan.
+        """
+        ruta = self._ruta(dominio)
+        try:
+            with ruta.open("r", encoding="utf-8") as f:
+                cabecera = f.readline()
+                segunda = f.readline()
+                tercera = f.readline() if segunda.startswith("# PM asignado: ") else segunda
+                resto = f.readline()
+        except FileNotFoundError:
+            return False
+        if not cabecera.startswith("# Resultados para: "):
+            return False
+        if tercera == "(Sin coincidencias)\n" and not resto:
+            return False
+        if segunda.startswith("# PM asignado: "):
+            self._pm[dominio] = segunda[len("# PM asignado: "):].rstrip("\n")
+        self._creados.add(dominio)
+        return True
+
+    def _handle(self, dominio: str):
+        f = self._abiertos.get(dominio)
+        if f is not None:
+            self._abiertos.move_to_end(dominio)
+            return f
+        if len(self._abiertos) >= self.max_abiertos:
+            d_viejo, viejo = self._abiertos.popitem(last=False)
+            self._tam[d_viejo] = viejo.tell()
+            viejo.close()
+        if dominio not in self._creados:
+            if self.anexar:
+                self._adoptar_existente(dominio)
+            self._anotar_diario(dominio)
+        if dominio in self._creados:
+            f = self._ruta(dominio).open("a", encoding="utf-8")
+        else:
+            f = self._crear(dominio)
+            f.write(self._cabecera(dominio, self._pm.get(dominio)))
+            self._creados.add(dominio)
+        self._abiertos[dominio] = f
+        return f
+
+    def _anotar_diario(self, dominio: str) -> None:
+        """Anota el tamaño previo (-1 = archivo nuevo) antes de tocar el archivo por primera vez."""
+        if self.diario is None:
+            return
+        antes = self._ruta(dominio).stat().st_size if dominio in self._creados else -1
+        self.diario.write(json.dumps([dominio, antes]) + "\n")
+        self.diario.flush()
+
+    def vaciar(self) -> None:
+        """Escribe todos los buffers y hace flush de los handles abiertos."""
+        for d in list(self._buffers):
+            self._vaciar(d)
+        for f in self._abiertos.values():
+            f.flush()
+
+    def estado(self) -> Dict[str, object]:
+        """Foto del escritor para un checkpoint (llamar después de vaciar())."""
+        tamanos = dict(self._tam)
+        for d, f in self._abiertos.items():
+            tamanos[d] = f.tell()
+        return {
+            "tamanos": tamanos,
+            "pm": self._pm,
+            "pm_tardio": sorted(self._pm_tardio),
+            "conteo": self.conteo,
+        }
+
+    def restaurar(self, estado: Dict[str, object], diario: List[Tuple[str, int]]) -> None:
+        """
+        Deja los archivos de salida exactamente como estaban en el checkpoint:
+        recorta lo escrito después y deshace los archivos creados o tocados después.
+        """
+        tamanos: Dict[str, int] = estado["tamanos"]
+        for d, antes in diario:
+            if d in tamanos:
+                continue
+            ruta = self._ruta(d)
+            if antes < 0:
+                ruta.unlink(missing_ok=True)
+            elif ruta.exists():
+                os.truncate(ruta, antes)
+        for d, tam in tamanos.items():
+            os.truncate(self._ruta(d), tam)
+        self._creados = set(tamanos)
+        self._tam = dict(tamanos)
+        self._pm = dict(estado["pm"])
+        self._pm_tardio = set(estado["pm_tardio"])
+        self.conteo = dict(estado["conteo"])
+
+    def _resolver_pm(self, dominio: str, lines: List[str]) -> None:
+        """Igual que escribir_resultados: PM por dominio y, si no hay, el del primer host con PM."""
+        if dominio not in self._pm:
+            self._pm[dominio] = _find_suffix_match(dominio, self.pm_map)
+        if self._pm[dominio] is None and self.infer_pm_from_urls and lines:
+            if self.pm_en_workers:
+                pm_info = self._pm_linea.get(dominio)
+            else:
+                pm_info = _infer_pm_from_lines(lines, self.pm_map)
+            if pm_info:
+                self._pm[dominio] = pm_info
+                if dominio in self._creados:
+                    self._pm_tardio.add(dominio)
+
+    def _vaciar(self, dominio: str) -> None:
+        lines = self._buffers.pop(dominio, None)
+        if not lines:
+            return
+        self._resolver_pm(dominio, lines)
+        f = self._handle(dominio)
+        f.write("\n".join(lines) + "\n")
+        self._buffer_bytes -= self._bytes_dominio.pop(dominio)
+
+    def agregar(self, dominio: str, line: str, pm: Optional[str] = None, archivo: Optional[str] = None) -> None:
+        """
+        Añade un hit; `pm` es el PM que el worker infirió de la línea (pm_en_workers=True).
+        `archivo` (origen del hit) no se guarda en el formato texto.
+        """
+        self.agregar_bloque(dominio, line, 1, pm, archivo)
+
+    def agregar_bloque(self, dominio: str, bloque: str, n: int, pm: Optional[str] = None,
+                       archivo: Optional[str] = None) -> None:
+        """
+        Añade n hits de un dominio ya unidos con '\n' (un bloque del spill de un worker).
+        El PM de un bloque sólo puede venir de `pm`: no se infiere de sus líneas aquí.
+        """
+        if pm and dominio not in self._pm_linea:
+            self._pm_linea[dominio] = pm
+        self._buffers.setdefault(dominio, []).append(bloque)
+        self.conteo[dominio] = self.conteo.get(dominio, 0) + n
+        self._bytes_dominio[dominio] = self._bytes_dominio.get(dominio, 0) + len(bloque) + 1
+        self._buffer_bytes += len(bloque) + 1
+        if self._buffer_bytes > self.buffer_max:
+            # vaciar primero los buffers más grandes hasta bajar a la mitad del tope
+            for d in sorted(self._bytes_dominio, key=self._bytes_dominio.get, reverse=True):
+                self._vaciar(d)
+                if self._buffer_bytes <= self.buffer_max // 2:
+                    break
+
+    def _reescribir_cabecera(self, dominio: str) -> None:
+        """El PM apareció después de escribir la cabecera: se regenera el archivo con él."""
+        ruta = self._ruta(dominio)
+        tmp = ruta.with_name(ruta.name + ".tmp")
+        with ruta.open("r", encoding="utf-8") as src, tmp.open("w", encoding="utf-8") as dst:
+            src.readline()  # cabecera vieja (sin PM)
+            dst.write(self._cabecera(dominio, self._pm.get(dominio)))
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp, ruta)
+
+    def cerrar(self, dominios: Iterable[str] = (), crear_archivo_vacio: bool = False) -> None:
+        """Vacía lo pendiente, crea los archivos sin coincidencias si se pidió y cierra todo."""
+        for d in list(self._buffers):
+            self._vaciar(d)
+        for f in self._abiertos.values():
+            f.close()
+        self._abiertos.clear()
+
+        for d in self._pm_tardio:
+            self._reescribir_cabecera(d)
+        self._pm_tardio.clear()
+
+        if crear_archivo_vacio:
+            for d in dominios:
+                if d in self._creados or (self.anexar and self._ruta(d).exists()):
+                    continue
+                with self._crear(d) as f:
+                    f.write(self._cabecera(d, _find_suffix_match(d, self.pm_map)))
+                    f.write("(Sin coincidencias)\n")
+                self._creados.add(d)
+
+# --- resultados en SQLite (--out-format sqlite) ---
+NOMBRE_RESULTADOS_SQLITE = "resultados.sqlite"
+_VERSION_RESULTADOS = 1
+
+def _abrir_resultados(ruta: Path) -> sqlite3.Connection:
+    """Abre (creando el esquema si hace falta) la base de resultados."""
+    con = sqlite3.connect(str(ruta))
+    con.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA cache_size=-65536;
+        CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor TEXT);
+        CREATE TABLE IF NOT EXISTS ejecuciones (id INTEGER PRIMARY KEY, inicio INTEGER, fin INTEGER,
+                                                db TEXT, incremental INTEGER);
+        CREATE TABLE IF NOT EXISTS dominios (id INTEGER PRIMARY KEY, dominio TEXT UNIQUE);
+        CREATE TABLE IF NOT EXISTS archivos (id INTEGER PRIMARY KEY, ruta TEXT UNIQUE);
+        CREATE TABLE IF NOT EXISTS hits (ejecucion INTEGER, dominio INTEGER, archivo INTEGER, linea TEXT);
+        CREATE INDEX IF NOT EXISTS idx_hits_dominio ON hits(dominio, ejecucion);
+        CREATE TABLE IF NOT EXISTS resumen (ejecucion INTEGER, dominio INTEGER, pm TEXT, hits INTEGER,
+                                            PRIMARY KEY (dominio, ejecucion));
+    """)
+    con.execute("INSERT OR IGNORE INTO meta VALUES ('version', ?)", (str(_VERSION_RESULTADOS),))
+    version = con.execute("SELECT valor FROM meta WHERE clave = 'version'").fetchone()[0]
+    if version != str(_VERSION_RESULTADOS):
+        con.close()
+        raise RuntimeError(f"versión de {ruta} incompatible ({version})")
+    con.commit()
+    return con
+
+class EscritorSQLite:
+    """
+    Alternativa a EscritorResultados que guarda los hits en un SQLite:
+    hits(ejecucion, dominio, archivo, linea) indexada por dominio, y una fila de
+    resumen(ejecucion, dominio, pm, hits) por dominio al cerrar.
+    Los hits se insertan por lotes, una transacción por lote (tope: buffer_max bytes).
+    Cada escaneo es una ejecución nueva; con incremental=True la ejecución se suma a
+    las anteriores en lugar de reemplazarlas (ver ejecuciones_vigentes).
+    """
+
+    def __init__(
+        self,
+        ruta: Path,
+        pm_map: Optional[Dict[str, str]] = None,
+        infer_pm_from_urls: bool = True,
+        buffer_max: int = 64 * 1024 * 1024,
+        incremental: bool = False,
+        db: str = "",
+        pm_en_workers: bool = False,
+    ):
+        self.ruta = ruta
+        self.pm_map = pm_map if isinstance(pm_map, ArbolPM) else ArbolPM(pm_map)
+        self.infer_pm_from_urls = infer_pm_from_urls
+        self.buffer_max = max(buffer_max, 1)
+        self.incremental = incremental
+        self.db = db
+        self.pm_en_workers = pm_en_workers
+
+        self.conteo: Dict[str, int] = {}
+        self.ejecucion: Optional[int] = None
+        self._filas: List[Tuple[int, int, str]] = []
+        self._buffer_bytes = 0
+        self._ids_dominio: Dict[str, int] = {}
+        self._ids_archivo: Dict[str, int] = {}
+        self._pm_linea: Dict[str, str] = {}        # primer PM inferido de las líneas, por dominio
+        self.diario = None                         # sin uso: lo deshecho se borra por rowid
+
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        self.con = _abrir_resultados(ruta)
+
+    def _iniciar(self) -> int:
+        if self.ejecucion is None:
+            cur = self.con.execute("INSERT INTO ejecuciones (inicio, db, incremental) VALUES (?,?,?)",
+                                   (int(time.time()), self.db, int(self.incremental)))
+            self.ejecucion = cur.lastrowid
+            self.con.commit()
+        return self.ejecucion
+
+    def _id(self, tabla: str, columna: str, valor: str, cache: Dict[str, int]) -> int:
+        i = cache.get(valor)
+        if i is None:
+            self.con.execute(f"INSERT OR IGNORE INTO {tabla} ({columna}) VALUES (?)", (valor,))
+            i = cache[valor] = self.con.execute(f"SELECT id FROM {tabla} WHERE {columna} = ?", (valor,)).fetchone()[0]
+        return i
+
+    def _id_archivo(self, archivo: Optional[str]) -> int:
+        """Id del archivo de origen; la ruta se guarda absoluta (las de las tareas son relativas al cwd)."""
+        i = self._ids_archivo.get(archivo)
+        if i is None:
+            i = self._ids_archivo[archivo] = self._id("archivos", "ruta",
+                                                      os.path.abspath(archivo) if archivo else "", {})
+        return i
+
+    def agregar(self, dominio: str, line: str, pm: Optional[str] = None, archivo: Optional[str] = None) -> None:
+        """Añade un hit de `archivo`; `pm` es el PM que el worker infirió de la línea (pm_en_workers=True)."""
+        if dominio not in self._pm_linea:
+            if pm is None and self.infer_pm_from_urls and not self.pm_en_workers:
+                pm = _infer_pm_from_lines([line], self.pm_map)
+            if pm:
+                self._pm_linea[dominio] = pm
+        self._filas.append((self._id("dominios", "dominio", dominio, self._ids_dominio),
+                            self._id_archivo(archivo), line))
+        self.conteo[dominio] = self.conteo.get(dominio, 0) + 1
+        self._buffer_bytes += len(line) + 1
+        if self._buffer_bytes > self.buffer_max:
+            self.vaciar()
+
+    def agregar_bloque(self, dominio: str, bloque: str, n: int, pm: Optional[str] = None,
+                       archivo: Optional[str] = None) -> None:
+        """Añade n hits de `archivo` ya unidos con '\n' (el PM sólo puede venir de `pm`)."""
+        if pm and dominio not in self._pm_linea:
+            self._pm_linea[dominio] = pm
+        d = self._id("dominios", "dominio", dominio, self._ids_dominio)
+        a = self._id_archivo(archivo)
+        self._filas.extend((d, a, line) for line in bloque.split("\n"))
+        self.conteo[dominio] = self.conteo.get(dominio, 0) + n
+        self._buffer_bytes += len(bloque) + 1
+        if self._buffer_bytes > self.buffer_max:
+            self.vaciar()
+
+    def vaciar(self) -> None:
+        """Inserta los hits pendientes en una sola transacción."""
+        ejecucion = self._iniciar()
+        if self._filas:
+            self.con.executemany("INSERT INTO hits VALUES (?,?,?,?)",
+                                 ((ejecucion, d, a, l) for d, a, l in self._filas))
+            self._filas.clear()
+            self._buffer_bytes = 0
+        self.con.commit()
+
+    def estado(self) -> Dict[str, object]:
+        """Foto del escritor para un checkpoint (llamar después de vaciar())."""
+        ultima = self.con.execute("SELECT max(rowid) FROM hits").fetchone()[0] or 0
+        return {
+            "ejecucion": self.ejecucion,
+            "filas": ultima,
+            "pm_linea": self._pm_linea,
+            "conteo": self.conteo,
+        }
+
+    def restaurar(self, estado: Dict[str, object], diario: List[Tuple[str, int]]) -> None:
+        """Sigue con la ejecución del checkpoint y borra los hits insertados después de él."""
+        self.ejecucion = estado["ejecucion"]
+        self.con.execute("DELETE FROM hits WHERE rowid > ?", (estado["filas"],))
+        self.con.execute("DELETE FROM resumen WHERE ejecucion = ?", (self.ejecucion,))
+        self.con.execute("UPDATE ejecuciones SET fin = NULL WHERE id = ?", (self.ejecucion,))
+        self.con.commit()
+        self._pm_linea = dict(estado["pm_linea"])
+        self.conteo = dict(estado["conteo"])
+
+    def cerrar(self, dominios: Iterable[str] = (), crear_archivo_vacio: bool = False) -> None:
+        """Inserta lo pendiente, escribe el resumen por dominio y marca la ejecución como terminada."""
+        self.vaciar()
+        filas = []
+        for d, n in self.conteo.items():
+            pm = _find_suffix_match(d, self.pm_map)
+            if pm is None and self.infer_pm_from_urls:
+                pm = self._pm_linea.get(d)
+            filas.append((self.ejecucion, self._id("dominios", "dominio", d, self._ids_dominio), pm, n))
+        if crear_archivo_vacio:
+            for d in dominios:
+                if d not in self.conteo:
+                    filas.append((self.ejecucion, self._id("dominios", "dominio", d, self._ids_dominio),
+                                  _find_suffix_match(d, self.pm_map), 0))
+        self.con.executemany("INSERT OR REPLACE INTO resumen VALUES (?,?,?,?)", filas)
+        self.con.execute("UPDATE ejecuciones SET fin = ? WHERE id = ?", (int(time.time()), self.ejecucion))
+        self.con.commit()
+        self.con.close()
+
+# --- deduplicación de líneas con memoria acotada ---
+def _digest_linea(clave: str) -> bytes:
+    return hashlib.blake2b(clave.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+
+def clave_dedup(dominio: str, line: str, alcance: str) -> str:
+    """'dominio': una línea única por dominio; 'global': cada línea sólo en el primer dominio que la tuvo."""
+    if alcance == "global":
+        return line
+    return dominio + "\x00" + line
+
+class FiltroDuplicadosExacto:
+    """
+    Dedup exacto (hash de 128 bits) con memoria acotada. Los hashes viven en un set;
+    al llenarse el presupuesto se vuelcan ordenados a disco y se consultan por búsqueda binaria.
+    Los runs se mezclan por niveles: cada _MAX_RUNS runs del mismo nivel pasan a ser uno del
+    siguiente, así cada hash se reescribe O(log n) veces y las consultas miran pocos runs.
+    """
+    _TAM = 16
+    _BYTES_POR_ENTRADA = 100  # coste aproximado de un digest de 16 bytes dentro de un set
+    _MAX_RUNS = 8
+
+    def __init__(self, mem_max: int, tmp_dir: str):
+        self._max_en_memoria = max(mem_max // self._BYTES_POR_ENTRADA, 1024)
+        self._tmp_dir = tmp_dir
+        self._memoria: set = set()
+        self._runs: List[Tuple[object, mmap.mmap, int, int]] = []  # (archivo, mmap, nº de hashes, nivel)
+        self._n_volcados = 0
+        self.duplicados = 0
+        self.registro = None  # archivo donde anotar cada digest nuevo (checkpoint, ver PuntoControl)
+
+    def _en_run(self, mm: mmap.mmap, n: int, h: bytes) -> bool:
+        lo, hi = 0, n
+        tam = self._TAM
+        while lo < hi:
+            mid = (lo + hi) // 2
+            v = mm[mid * tam:(mid + 1) * tam]
+            if v == h:
+                return True
+            if v < h:
+                lo = mid + 1
+            else:
+                hi = mid
+        return False
+
+    def _abrir_run(self, ruta: str, nivel: int) -> None:
+        f = open(ruta, "rb")
+        n = os.fstat(f.fileno()).st_size // self._TAM
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._runs.append((f, mm, n, nivel))
+
+    def _nueva_ruta(self) -> str:
+        self._n_volcados += 1
+        return os.path.join(self._tmp_dir, f"dedup-{self._n_volcados}.bin")
+
+    def _volcar(self) -> None:
+        ruta = self._nueva_ruta()
+        with open(ruta, "wb") as f:
+            f.write(b"".join(sorted(self._memoria)))
+        self._memoria.clear()
+        self._abrir_run(ruta, 0)
+        # los runs van de más viejo (nivel alto) a más nuevo: sólo se mezclan los últimos
+        while len(self._runs) >= self._MAX_RUNS and \
+                len({nivel for *_, nivel in self._runs[-self._MAX_RUNS:]}) == 1:
+            self._fusionar_runs(len(self._runs) - self._MAX_RUNS)
+
+    def _fusionar_runs(self, desde: int) -> None:
+        """Mezcla los runs desde `desde` (todos del mismo nivel) en uno del nivel siguiente."""
+        tam = self._TAM
+
+        def leer(mm: mmap.mmap, n: int):
+            for i in range(n):
+                yield mm[i * tam:(i + 1) * tam]
+
+        ruta = self._nueva_ruta()
+        with open(ruta, "wb") as out:
+            for h in heapq.merge(*(leer(mm, n) for _, mm, n, _ in self._runs[desde:])):
+                out.write(h)
+        nivel = self._runs[desde][3] + 1
+        viejos, self._runs = self._runs[desde:], self._runs[:desde]
+        for f, mm, _, _ in viejos:
+            mm.close()
+            f.close()
+            os.remove(f.name)
+        self._abrir_run(ruta, nivel)
+
+    def visto(self, clave: str) -> bool:
+        """True si la clave ya se vio (y cuenta el duplicado); si no, la registra."""
+        h = _digest_linea(clave)
+        if h in self._memoria or any(self._en_run(mm, n, h) for _, mm, n, _ in self._runs):
+            self.duplicados += 1
+            return True
+        self._agregar(h)
+        if self.registro is not None:
+            self.registro.write(h)
+        return False
+
+    def _agregar(self, h: bytes) -> None:
+        self._memoria.add(h)
+        if len(self._memoria) >= self._max_en_memoria:
+            self._volcar()
+
+    def reponer(self, datos: bytes) -> None:
+        """Registra digests de un checkpoint (concatenados, únicos) sin contarlos ni anotarlos."""
+        tam = self._TAM
+        for i in range(0, len(datos), tam):
+            self._agregar(datos[i:i + tam])
+
+    def cerrar(self) -> None:
+        if self.registro is not None:
+            self.registro.close()
+            self.registro = None
+        for f, mm, _, _ in self._runs:
+            mm.close()
+            f.close()
+        self._runs.clear()
+        self._memoria.clear()
+
+class FiltroDuplicadosBloom:
+    """
+    Dedup probabilístico: filtro de Bloom de tamaño fijo (mem_max bytes).
+    Nunca deja pasar un duplicado, pero puede descartar por error alguna línea única.
+    """
+
+    def __init__(self, mem_max: int, k: int = 7):
+        self._bits = bytearray(max(mem_max, 1024))
+        self._m = len(self._bits) * 8
+        self._k = k
+        self.duplicados = 0
+        self.registro = None  # archivo donde anotar cada digest nuevo (checkpoint, ver PuntoControl)
+
+    def visto(self, clave: str) -> bool:
+        h = _digest_linea(clave)
+        if self._marcar(h):
+            if self.registro is not None:
+                self.registro.write(h)
+            return False
+        self.duplicados += 1
+        return True
+
+    def _marcar(self, h: bytes) -> bool:
+        """Pone los k bits del digest; True si alguno estaba apagado (digest nuevo)."""
+        a = int.from_bytes(h[:8], "little")
+        b = int.from_bytes(h[8:], "little") | 1
+        nuevo = False
+        bits = self._bits
+        for i in range(self._k):
+            pos = (a + i * b) % self._m
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                nuevo = True
+        return nuevo
+
+    def reponer(self, datos: bytes) -> None:
+        """Registra digests de un checkpoint (concatenados) sin contarlos ni anotarlos."""
+        for i in range(0, len(datos), 16):
+            self._marcar(datos[i:i + 16])
+
+    def cerrar(self) -> None:
+        if self.registro is not None:
+            self.registro.close()
+            self.registro = None
+
+def crear_filtro_duplicados(modo: str, mem_max: int, tmp_dir: str):
+    if modo == "bloom":
+        return FiltroDuplicadosBloom(mem_max)
+    return FiltroDuplicadosExacto(mem_max, tmp_dir)
+
 def escribir_resultados(
     agg: Dict[str, List[str]],
     out_dir: Path,
@@ -387,28 +2509,769 @@ def escribir_resultados(
     pm_map: Optional[Dict[str, str]] = None,
     infer_pm_from_urls: bool = True
 ):
-    pm_map = pm_map or {}
-    out_dir.mkdir(parents=True, exist_ok=True)
+    escritor = EscritorResultados(out_dir, pm_map, infer_pm_from_urls)
     for dominio, lines in agg.items():
-        safe = dominio.replace("/", "_")
-        out_path = out_dir / f"{safe}.txt"
-        if not lines and not crear_archivo_vacio:
+        for line in lines:
+            escritor.agregar(dominio, line)
+    escritor.cerrar(agg.keys(), crear_archivo_vacio)
+
+# --- índice persistente del corpus ---
+# Cada línea se tokeniza en tramos máximos de [a-z0-9._-] que contienen un punto
+# (hostnames, dominios de emails, hosts de URLs). Un término con forma de dominio
+# sólo puede aparecer dentro de uno de esos tramos, así que buscarlo como subcadena
+# en el vocabulario de tokens da las mismas líneas que el escaneo Aho-Corasick.
+_VERSION_INDICE = 1
+_RANGO_INDICE = 64 * 1024 * 1024   # rangos más chicos que al escanear: la tabla de tokens vive en memoria
+_RE_TOKEN = re.compile(r"[a-z0-9._-]+")
+_CHARS_TOKEN = frozenset("abcdefghijklmnopqrstuvwxyz0123456789._-")
+
+def tokens_linea(low: str) -> set:
+    """Tokens indexables de una línea ya pasada a minúsculas."""
+    return {t for t in _RE_TOKEN.findall(low) if "." in t}
+
+def termino_indexable(termino: str) -> bool:
+    """True si el término se puede responder desde el índice (forma de dominio)."""
+    return "." in termino and all(c in _CHARS_TOKEN for c in termino)
+
+def _lineas_binarias(path: str, ini: int = 0, fin: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """(offset, bytes) de cada línea terminada en '\n'; en comprimidos, offset en el contenido descomprimido."""
+    codec = codec_de(path)
+    if codec:
+        f = io.BufferedReader(_LectorRango(_abrir_descomprimido(Path(path), codec)))
+    else:
+        raw = open(path, "rb")
+        raw.seek(ini)
+        restante = (fin - ini) if fin is not None else None
+        f = io.BufferedReader(_LectorRango(raw, restante))
+    off = ini
+    with f:
+        for chunk in f:
+            yield off, chunk
+            off += len(chunk)
+
+def _decodificar_lineas(chunk: bytes) -> List[str]:
+    """Decodifica igual que el motor 'texto' (UTF-8 ignorando errores, saltos universales)."""
+    return [l.rstrip("\n") for l in io.TextIOWrapper(io.BytesIO(chunk), encoding="utf-8", errors="ignore")]
+
+def hosts_linea(low: str) -> set:
+    """
+    Hostnames de una línea ya en minúsculas: tokens con punto que no son la parte
+    local de un email (lo que va antes de '@'), sin puntos sueltos en los extremos.
+    """
+    hosts = set()
+    for m in _RE_TOKEN.finditer(low):
+        t = m.group()
+        if "." not in t or low.startswith("@", m.end()):
             continue
+        t = t.strip(".")
+        if t and "." in t and ".." not in t:
+            hosts.add(t)
+    return hosts
+
+def _indexar_tarea(tarea: Tarea, extractor=tokens_linea) -> Tuple[Tarea, Dict[str, List[int]]]:
+    """Worker del índice: token -> offsets de las líneas del rango que lo contienen."""
+    path, ini, fin = tarea
+    postings: Dict[str, List[int]] = {}
+    try:
+        for off, chunk in _lineas_binarias(path, ini, fin):
+            toks = set()
+            for line in _decodificar_lineas(chunk):
+                toks |= extractor(line.lower())
+            for t in toks:
+                postings.setdefault(t, []).append(off)
+    except Exception as e:
+        sys.stderr.write(f"[!] No se pudo indexar {path}: {e}\n")
+    return tarea, postings
 
-        with out_path.open("w", encoding="utf-8") as f:
-            f.write(f"# Resultados para: {dominio}\n")
+def _init_worker_indice():
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
 
-            pm_info = _find_suffix_match(dominio, pm_map)
-            if not pm_info and infer_pm_from_urls and lines:
-                pm_info = _infer_pm_from_lines(lines, pm_map)
+def _postings_corpus(db_root: Path, exts: List[str], jobs: int, extractor, archivos: List[Tuple[int, str, int, int]],
+                     contadores: Dict[str, int], ignore_trash: bool = True, hilos: int = 8,
+                     mostrar_progreso: bool = True, desc: str = "Indexando") -> Iterator[Tuple[int, Dict[str, List[int]]]]:
+    """
+    Recorre el corpus con el pool y entrega (id de archivo, token -> offsets) por rango.
+    `archivos` se va llenando con (id, ruta, size, mtime_ns) de cada archivo listado.
+    """
+    ids_archivo: Dict[str, int] = {}
 
-            if pm_info:
-                f.write(f"# PM asignado: {pm_info}\n")
+    def generar_tareas() -> Iterator[Tarea]:
+        for path, st in recorrer_archivos(db_root, exts, ignore_trash, hilos, contadores):
+            path = os.path.abspath(path)
+            ids_archivo[path] = len(ids_archivo) + 1
+            archivos.append((ids_archivo[path], path, st.st_size, st.st_mtime_ns))
+            yield from dividir_en_rangos(path, _RANGO_INDICE, 0, st.st_size)
 
-            if not lines:
-                f.write("(Sin coincidencias)\n")
-            else:
-                f.write("\n".join(lines) + "\n")
+    pbar = tqdm(total=0, unit="tarea", desc=desc, smoothing=0.1) if (_HAS_TQDM and mostrar_progreso) else None
+    ctx = _contexto_pool()
+    try:
+        with ctx.Pool(processes=jobs, initializer=_init_worker_indice) as pool:
+            trabajo = functools.partial(_indexar_tarea, extractor=extractor)
+            for tarea, postings in pool.imap_unordered(trabajo, generar_tareas(), chunksize=1):
+                yield ids_archivo[tarea[0]], postings
+                if pbar is not None:
+                    pbar.update(1)
+    finally:
+        if pbar is not None:
+            pbar.close()
+
+def _sin_cambios(path: str, size: int, mtime_ns: int) -> bool:
+    """True si el archivo sigue igual que cuando se indexó."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == size and st.st_mtime_ns == mtime_ns
+
+_MEM_POR_TOKEN = 150  # coste aproximado de un token (str + int) en el dict de ids
+
+def construir_indice(ruta: Path, db_root: Path, exts: List[str], jobs: int,
+                     ignore_trash: bool = True, hilos: int = 8, mostrar_progreso: bool = True,
+                     mem_max: int = 512 * 1024 * 1024) -> Dict[str, int]:
+    """
+    Recorre el corpus y guarda el índice en un SQLite (se construye en un archivo
+    temporal y se renombra al terminar, así una interrupción no deja un índice a medias).
+    El vocabulario (token -> id) vive en un SQLite auxiliar en disco; en memoria sólo se
+    guarda una caché de ids que se vacía al llegar a `mem_max`.
+    """
+    tmp = ruta.with_name(ruta.name + ".tmp")
+    tmp_vocab = ruta.with_name(ruta.name + ".vocab.tmp")
+    for t in (tmp, tmp_vocab):
+        t.unlink(missing_ok=True)
+    con = sqlite3.connect(str(tmp))
+    con.executescript("""
+        PRAGMA journal_mode=OFF;
+        PRAGMA synchronous=OFF;
+        CREATE TABLE meta (clave TEXT PRIMARY KEY, valor TEXT);
+        CREATE TABLE archivos (id INTEGER PRIMARY KEY, ruta TEXT UNIQUE, size INTEGER, mtime_ns INTEGER);
+        CREATE TABLE tokens (id INTEGER PRIMARY KEY, token TEXT);
+        CREATE TABLE apariciones (token INTEGER, archivo INTEGER, offset INTEGER);
+    """)
+    con.execute("ATTACH DATABASE ? AS vocab", (str(tmp_vocab),))
+    con.executescript("""
+        PRAGMA vocab.journal_mode=OFF;
+        PRAGMA vocab.synchronous=OFF;
+        CREATE TABLE vocab.ids (id INTEGER PRIMARY KEY, token TEXT UNIQUE);
+    """)
+    ids_token: Dict[str, int] = {}
+    max_cache = max(mem_max // _MEM_POR_TOKEN, 1024)
+    archivos: List[Tuple[int, str, int, int]] = []
+    contadores: Dict[str, int] = {}
+    stats = {"apariciones": 0}
+    try:
+        for fid, postings in _postings_corpus(db_root, exts, jobs, tokens_linea, archivos, contadores,
+                                              ignore_trash, hilos, mostrar_progreso):
+            nuevos = [tok for tok in postings if tok not in ids_token]
+            if nuevos:
+                if len(ids_token) + len(nuevos) > max_cache:
+                    # al vaciar la caché también se pierden los ids de los tokens de esta
+                    # tarea que ya estaban en ella: se vuelven a pedir todos
+                    ids_token.clear()
+                    nuevos = list(postings)
+                con.executemany("INSERT OR IGNORE INTO vocab.ids (token) VALUES (?)", ((t,) for t in nuevos))
+                for i in range(0, len(nuevos), 500):
+                    parte = nuevos[i:i + 500]
+                    q = f"SELECT token, id FROM vocab.ids WHERE token IN ({','.join('?' * len(parte))})"
+                    ids_token.update(con.execute(q, parte))
+            filas = []
+            for tok, offs in postings.items():
+                tid = ids_token[tok]
+                filas.extend((tid, fid, o) for o in offs)
+            con.executemany("INSERT INTO apariciones VALUES (?,?,?)", filas)
+            stats["apariciones"] += len(filas)
+        ids_token.clear()
+        con.execute("INSERT INTO tokens SELECT id, token FROM vocab.ids ORDER BY id")
+        stats["tokens"] = con.execute("SELECT count(*) FROM tokens").fetchone()[0]
+        con.commit()
+        con.execute("DETACH DATABASE vocab")
+        con.executemany("INSERT INTO archivos VALUES (?,?,?,?)", archivos)
+        con.execute("CREATE INDEX idx_apariciones_token ON apariciones(token)")
+        con.executemany("INSERT INTO meta VALUES (?,?)", [
+            ("version", str(_VERSION_INDICE)), ("db", str(db_root.resolve())),
+            ("ext", ",".join(exts)), ("creado", str(int(time.time()))),
+        ])
+        con.commit()
+        con.close()
+        os.replace(tmp, ruta)
+    except BaseException:
+        con.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        tmp_vocab.unlink(missing_ok=True)
+    stats["archivos"] = len(archivos)
+    stats["ignorados"] = contadores.get("ignorados", 0)
+    return stats
+
+def _leer_lineas_indexadas(path: str, offsets: List[int]) -> Iterator[bytes]:
+    """Relee sólo las líneas indicadas (offsets ordenados)."""
+    if codec_de(path):
+        pendientes = set(offsets)
+        ultimo = offsets[-1]
+        for off, chunk in _lineas_binarias(path):
+            if off in pendientes:
+                yield chunk
+            if off >= ultimo:
+                break
+        return
+    with open(path, "rb") as f:
+        for off in offsets:
+            f.seek(off)
+            yield f.readline()
+
+def consultar_indice(ruta: Path, dominios: List[str], escritor: "EscritorResultados") -> Dict[str, int]:
+    """
+    Responde la lista de términos desde el índice y entrega los hits al escritor.
+    Los archivos que cambiaron desde la indexación se saltan (hay que reconstruir).
+    """
+    con = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+    meta = dict(con.execute("SELECT clave, valor FROM meta"))
+    if meta.get("version") != str(_VERSION_INDICE):
+        raise RuntimeError(f"versión de índice incompatible ({meta.get('version')}); reconstrúyelo")
+    automaton = construir_automaton(dominios, "texto")
+
+    # 1) vocabulario: tokens que contienen algún término
+    candidatos = [tid for tid, tok in con.execute("SELECT id, token FROM tokens")
+                  if next(automaton.iter(tok), None) is not None]
+
+    # 2) líneas (archivo, offset) que contienen esos tokens
+    por_archivo: Dict[int, set] = {}
+    for i in range(0, len(candidatos), 500):
+        parte = candidatos[i:i + 500]
+        q = f"SELECT archivo, offset FROM apariciones WHERE token IN ({','.join('?' * len(parte))})"
+        for fid, off in con.execute(q, parte):
+            por_archivo.setdefault(fid, set()).add(off)
+
+    stats = {"tokens": len(candidatos), "lineas": 0, "cambiados": 0}
+    archivos = {fid: (r, size, mtime) for fid, r, size, mtime in con.execute("SELECT id, ruta, size, mtime_ns FROM archivos")}
+    con.close()
+
+    # 3) releer esas líneas y volver a buscar en ellas, como en el escaneo normal
+    for fid in sorted(por_archivo, key=lambda k: archivos[k][0]):
+        path, size, mtime = archivos[fid]
+        if not _sin_cambios(path, size, mtime):
+            stats["cambiados"] += 1
+            sys.stderr.write(f"[!] {path} cambió desde que se indexó; se omite (reconstruye el índice)\n")
+            continue
+        try:
+            for chunk in _leer_lineas_indexadas(path, sorted(por_archivo[fid])):
+                for line in _decodificar_lineas(chunk):
+                    hits = {val[1] for _, val in automaton.iter(line.lower())}
+                    for d in hits:
+                        escritor.agregar(d, line)
+                    stats["lineas"] += bool(hits)
+        except Exception as e:
+            sys.stderr.write(f"[!] No se pudo leer {path}: {e}\n")
+    return stats
+
+def _args_construir(c: argparse.ArgumentParser) -> None:
+    c.add_argument("--db", type=str, required=True, help="Carpeta raíz con las bases de datos")
+    c.add_argument("--ext", type=str, help=f"Extensiones (coma-separadas). Por defecto: {','.join(DEF_EXTS)}")
+    c.add_argument("--jobs", type=int, default=0, help="Nº de procesos (0 = cpu_count)")
+    c.add_argument("--no-ignore", action="store_true", help="No ignorar archivos temporales/sistema")
+    c.add_argument("--no-progress", action="store_true", help="Desactivar barra de progreso (tqdm)")
+    c.add_argument("--hilos-listado", type=int, default=8, help="Hilos que leen directorios en paralelo")
+    c.add_argument("--mem-mb", type=int, default=512,
+                   help="Memoria (MB) para el vocabulario/los hosts en construcción antes de recurrir a disco")
+
+def _args_consultar(q: argparse.ArgumentParser) -> None:
+    q.add_argument("--dominios", type=str, required=True, help="Archivo de dominios (uno por línea) o término único")
+    q.add_argument("--out", type=str, help="Carpeta de salida (por defecto: carpeta actual)")
+    q.add_argument("--crear-vacios", action="store_true", help="Crear archivos aunque no haya coincidencias")
+    q.add_argument("--pm-csv", type=str, help="CSV (dominio,pm o dominio,url,pm) para etiquetar los leaks")
+    q.add_argument("--no-infer-pm", action="store_true", help="No inferir PM desde hostnames reales")
+    q.add_argument("--layout", choices=LAYOUTS, default="plano",
+                   help="'plano': Export/<dominio>.txt; 'hash': Export/ab/cd/<dominio>.txt")
+
+def main_indice(argv: List[str]) -> None:
+    """python3 main.py indice construir|consultar ..."""
+    ap = argparse.ArgumentParser(prog="main.py indice",
+                                 description="Índice persistente de hostnames/dominios del corpus")
+    sub = ap.add_subparsers(dest="accion", required=True)
+    c = sub.add_parser("construir", help="Tokeniza el corpus una vez y guarda el índice")
+    _args_construir(c)
+    c.add_argument("--indice", type=str, default="darktxt_indice.sqlite", help="Archivo del índice")
+    q = sub.add_parser("consultar", help="Responde una lista de dominios desde el índice")
+    q.add_argument("--indice", type=str, default="darktxt_indice.sqlite", help="Archivo del índice")
+    _args_consultar(q)
+    args = ap.parse_args(argv)
+
+    ruta = Path(args.indice).expanduser()
+    if args.accion == "construir":
+        db_root = Path(args.db).expanduser()
+        extensiones = [e.strip().lstrip(".") for e in args.ext.split(",")] if args.ext else DEF_EXTS
+        jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+        t0 = time.monotonic()
+        stats = construir_indice(ruta, db_root, extensiones, jobs, not args.no_ignore,
+                                 args.hilos_listado, not args.no_progress, max(args.mem_mb, 1) * 1024 * 1024)
+        print(f"\n✅ Índice guardado en {ruta}: {stats['archivos']} archivos, {stats['tokens']} tokens, "
+              f"{stats['apariciones']} apariciones en {time.monotonic() - t0:.1f}s.")
+        if stats["ignorados"]:
+            print(f"   Ignorados (temporales/sistema): {stats['ignorados']}")
+        return
+
+    if not ruta.exists():
+        print(f"[X] No existe el índice {ruta}. Créalo con: python3 main.py indice construir --db ...")
+        sys.exit(1)
+    lista_path = Path(args.dominios).expanduser()
+    dominios = leer_dominios(lista_path) if lista_path.exists() else [args.dominios.lower()]
+    fuera = [d for d in dominios if not termino_indexable(d)]
+    dominios = [d for d in dominios if termino_indexable(d)]
+    if fuera:
+        print(f"[!] {len(fuera)} término(s) sin forma de dominio no se pueden responder desde el índice "
+              f"(usa el escaneo normal): {', '.join(fuera[:5])}{' ...' if len(fuera) > 5 else ''}")
+    if not dominios:
+        print("[X] No hay términos que consultar.")
+        sys.exit(1)
+
+    pm_map = cargar_pm_map(Path(args.pm_csv).expanduser()) if args.pm_csv else {}
+    out_dir = (Path(args.out).expanduser() if args.out else Path.cwd()) / "Export"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    escritor = EscritorResultados(out_dir, pm_map, not args.no_infer_pm, layout=args.layout)
+    t0 = time.monotonic()
+    stats = consultar_indice(ruta, dominios, escritor)
+    escritor.cerrar(dominios, args.crear_vacios)
+
+    total_hits = sum(escritor.conteo.values())
+    con_hits = sum(1 for v in escritor.conteo.values() if v)
+    print(f"\n✅ Completado. {con_hits}/{len(dominios)} términos con coincidencias. Total líneas: {total_hits} "
+          f"({stats['tokens']} tokens del índice, {time.monotonic() - t0:.1f}s).")
+    if stats["cambiados"]:
+        print(f"[!] {stats['cambiados']} archivo(s) cambiaron desde la indexación y se omitieron.")
+    print(f"📂 Archivos guardados en: {out_dir}")
+
+# --- almacén columnar de hostnames invertidos (consultas por sufijo) ---
+# Formato (little-endian, columnas alineadas a 8 bytes):
+#   cabecera | claves (hosts invertidos con '.' final, ordenados) | idx_claves Q[n+1]
+#   | idx_refs Q[n+1] | ref_archivo I[m] | ref_offset Q[m] | archivos (JSON)
+# Las refs de cada host van ordenadas por (archivo, offset de línea).
+_MAGIA_HOSTS = b"DTXHOST1"
+_CABECERA_HOSTS = struct.Struct("<8sQQQQQQQQ")
+
+def invertir_host(host: str) -> str:
+    """'mail.example.com' -> 'com.example.mail.' (el '.' final separa 'example.com' de 'example.company')."""
+    return ".".join(reversed(host.split("."))) + "."
+
+def _alinear(f, n: int = 8) -> int:
+    pos = f.tell()
+    if pos % n:
+        f.write(b"\0" * (n - pos % n))
+    return f.tell()
+
+def _escribir_columna(f, arr: array.array) -> int:
+    off = _alinear(f)
+    if sys.byteorder != "little":
+        arr = array.array(arr.typecode, arr)
+        arr.byteswap()
+    arr.tofile(f)
+    return off
+
+# run de hosts en disco (temporal, orden nativo): por host, cabecera (bytes de la clave, nº de refs),
+# la clave y los offsets (Q) y los ids de archivo (I) ya ordenados; todo alineado a 8 bytes
+_REG_RUN_HOSTS = struct.Struct("=QQ")
+_MEM_POR_HOST = 200  # coste aproximado de un host en memoria (str + dos arrays en el dict)
+_MEM_POR_REF = 12
+
+def _al8(n: int) -> int:
+    return (n + 7) & ~7
+
+def _volcar_run_hosts(refs: Dict[str, Tuple[array.array, array.array]], ruta: str) -> None:
+    """Escribe los hosts acumulados ordenados por clave invertida, cada uno con sus refs ordenadas."""
+    with open(ruta, "wb") as f:
+        for clave, host in sorted((invertir_host(h).encode("utf-8"), h) for h in refs):
+            fids, offs = refs[host]
+            pares = sorted(zip(fids, offs))
+            f.write(_REG_RUN_HOSTS.pack(len(clave), len(pares)))
+            f.write(clave + b"\0" * (_al8(len(clave)) - len(clave)))
+            array.array("Q", [o for _, o in pares]).tofile(f)
+            col = array.array("I", [a for a, _ in pares])
+            col.tofile(f)
+            f.write(b"\0" * (_al8(len(col) * 4) - len(col) * 4))
+
+def _leer_run_hosts(mm: mmap.mmap) -> Iterator[Tuple[bytes, array.array, array.array]]:
+    """(clave, ids de archivo, offsets) de cada host de un run."""
+    pos, fin = 0, len(mm)
+    while pos < fin:
+        n_clave, n = _REG_RUN_HOSTS.unpack_from(mm, pos)
+        pos += _REG_RUN_HOSTS.size
+        clave = mm[pos:pos + n_clave]
+        pos += _al8(n_clave)
+        offs = array.array("Q", mm[pos:pos + 8 * n])
+        pos += 8 * n
+        fids = array.array("I", mm[pos:pos + 4 * n])
+        pos += _al8(4 * n)
+        yield clave, fids, offs
+
+class _ColumnaTemporal:
+    """Columna que se escribe por tramos a un archivo temporal, en little-endian como _escribir_columna."""
+    _TRAMO = 1 << 16
+
+    def __init__(self, tipo: str, ruta: str):
+        self._f = open(ruta, "w+b")
+        self._buf = array.array(tipo)
+        self.n = 0
+
+    def append(self, v: int) -> None:
+        self._buf.append(v)
+        if len(self._buf) >= self._TRAMO:
+            self._vaciar()
+
+    def extend(self, vs) -> None:
+        self._buf.extend(vs)
+        if len(self._buf) >= self._TRAMO:
+            self._vaciar()
+
+    def _vaciar(self) -> None:
+        if sys.byteorder != "little":
+            self._buf.byteswap()
+        self._buf.tofile(self._f)
+        self.n += len(self._buf)
+        self._buf = array.array(self._buf.typecode)
+
+    def copiar_a(self, f) -> int:
+        """Añade la columna a `f` (alineada a 8 bytes) y devuelve su offset."""
+        self._vaciar()
+        off = _alinear(f)
+        self._f.seek(0)
+        shutil.copyfileobj(self._f, f, 1024 * 1024)
+        self._f.close()
+        return off
+
+def construir_hosts(ruta: Path, db_root: Path, exts: List[str], jobs: int,
+                    ignore_trash: bool = True, hilos: int = 8, mostrar_progreso: bool = True,
+                    mem_max: int = 512 * 1024 * 1024) -> Dict[str, int]:
+    """
+    Extrae todos los hostnames del corpus y escribe el almacén columnar.
+    Con memoria acotada: al pasar de `mem_max` los hosts acumulados se vuelcan ordenados
+    a un run en disco, y al final los runs se mezclan (k-way) directamente en el almacén.
+    """
+    runs_dir = tempfile.mkdtemp(prefix=".darktxt_hosts_", dir=str(ruta.parent))
+    runs: List[str] = []
+    refs: Dict[str, Tuple[array.array, array.array]] = {}
+    mem = 0
+    archivos: List[Tuple[int, str, int, int]] = []
+    contadores: Dict[str, int] = {}
+    tmp = ruta.with_name(ruta.name + ".tmp")
+    try:
+        for fid, postings in _postings_corpus(db_root, exts, jobs, hosts_linea, archivos, contadores,
+                                              ignore_trash, hilos, mostrar_progreso, desc="Extrayendo hosts"):
+            for host, offs in postings.items():
+                col = refs.get(host)
+                if col is None:
+                    col = refs[host] = (array.array("I"), array.array("Q"))
+                    mem += _MEM_POR_HOST
+                col[0].extend([fid] * len(offs))
+                col[1].extend(offs)
+                mem += _MEM_POR_REF * len(offs)
+            if mem >= mem_max:
+                runs.append(os.path.join(runs_dir, f"hosts-{len(runs) + 1}.bin"))
+                _volcar_run_hosts(refs, runs[-1])
+                refs.clear()
+                mem = 0
+        if refs or not runs:
+            runs.append(os.path.join(runs_dir, f"hosts-{len(runs) + 1}.bin"))
+            _volcar_run_hosts(refs, runs[-1])
+            refs.clear()
+
+        mms = []
+        for r in runs:
+            with open(r, "rb") as f:
+                mms.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None)
+        idx_claves = _ColumnaTemporal("Q", os.path.join(runs_dir, "idx_claves"))
+        idx_refs = _ColumnaTemporal("Q", os.path.join(runs_dir, "idx_refs"))
+        ref_archivo = _ColumnaTemporal("I", os.path.join(runs_dir, "ref_archivo"))
+        ref_offset = _ColumnaTemporal("Q", os.path.join(runs_dir, "ref_offset"))
+        n_hosts = tam_claves = n_refs = 0
+        idx_claves.append(0)
+        idx_refs.append(0)
+        try:
+            with open(tmp, "wb") as f:
+                f.write(b"\0" * _CABECERA_HOSTS.size)
+                fuentes = [((clave, i, fids, offs) for clave, fids, offs in _leer_run_hosts(mm))
+                           for i, mm in enumerate(mms) if mm is not None]
+                for clave, grupo in itertools.groupby(heapq.merge(*fuentes, key=lambda t: (t[0], t[1])),
+                                                      key=lambda t: t[0]):
+                    f.write(clave)
+                    tam_claves += len(clave)
+                    n_hosts += 1
+                    idx_claves.append(tam_claves)
+                    grupo = list(grupo)
+                    if len(grupo) == 1:
+                        _, _, fids, offs = grupo[0]
+                        ref_archivo.extend(fids)
+                        ref_offset.extend(offs)
+                        n_refs += len(offs)
+                    else:
+                        # el mismo host en varios runs: se intercalan sus refs ya ordenadas
+                        for a, o in heapq.merge(*(zip(fids, offs) for _, _, fids, offs in grupo)):
+                            ref_archivo.append(a)
+                            ref_offset.append(o)
+                            n_refs += 1
+                    idx_refs.append(n_refs)
+                    del grupo
+                off_idx_claves = idx_claves.copiar_a(f)
+                off_idx_refs = idx_refs.copiar_a(f)
+                off_ref_archivo = ref_archivo.copiar_a(f)
+                off_ref_offset = ref_offset.copiar_a(f)
+                off_archivos = _alinear(f)
+                blob = json.dumps({"db": str(db_root.resolve()), "ext": exts,
+                                   "archivos": [[r, size, mtime] for _, r, size, mtime in sorted(archivos)]},
+                                  ensure_ascii=False).encode("utf-8")
+                f.write(blob)
+                f.seek(0)
+                f.write(_CABECERA_HOSTS.pack(_MAGIA_HOSTS, n_hosts, n_refs, off_idx_claves, off_idx_refs,
+                                             off_ref_archivo, off_ref_offset, off_archivos, len(blob)))
+        finally:
+            for mm in mms:
+                if mm is not None:
+                    mm.close()
+        os.replace(tmp, ruta)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    finally:
+        shutil.rmtree(runs_dir, ignore_errors=True)
+    return {"archivos": len(archivos), "hosts": n_hosts, "refs": n_refs,
+            "ignorados": contadores.get("ignorados", 0), "runs": len(runs)}
+
+class AlmacenHosts:
+    """Lectura del almacén columnar vía mmap; búsquedas por sufijo con bisección."""
+
+    def __init__(self, ruta: Path):
+        self._f = open(ruta, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magia, self.n_hosts, self.n_refs, o_ic, o_ir, o_ra, o_ro, o_ar, n_ar) = \
+            _CABECERA_HOSTS.unpack_from(self._mm, 0)
+        if magia != _MAGIA_HOSTS:
+            raise RuntimeError(f"{ruta} no es un almacén de hosts (o es de otra versión); reconstrúyelo")
+        self._ic = self._columna(o_ic, self.n_hosts + 1, "Q")
+        self._ir = self._columna(o_ir, self.n_hosts + 1, "Q")
+        self._ra = self._columna(o_ra, self.n_refs, "I")
+        self._ro = self._columna(o_ro, self.n_refs, "Q")
+        meta = json.loads(self._mm[o_ar:o_ar + n_ar].decode("utf-8"))
+        self.archivos = [tuple(a) for a in meta["archivos"]]  # id de archivo = posición + 1
+        self._base = _CABECERA_HOSTS.size
+
+    def _columna(self, off: int, n: int, tipo: str):
+        tam = array.array(tipo).itemsize
+        if sys.byteorder == "little":
+            return memoryview(self._mm)[off:off + n * tam].cast(tipo)
+        arr = array.array(tipo, self._mm[off:off + n * tam])
+        arr.byteswap()
+        return arr
+
+    def __len__(self) -> int:
+        return self.n_hosts
+
+    def __getitem__(self, i: int) -> bytes:
+        return self._mm[self._base + self._ic[i]:self._base + self._ic[i + 1]]
+
+    def rango_sufijo(self, sufijo: str) -> Tuple[int, int]:
+        """[lo, hi) de hosts iguales a `sufijo` o que terminan en '.' + sufijo."""
+        p = invertir_host(sufijo).encode("utf-8")
+        fin = p[:-1] + bytes([p[-1] + 1])
+        return bisect.bisect_left(self, p), bisect.bisect_left(self, fin)
+
+    def host(self, i: int) -> str:
+        return ".".join(reversed(self[i].decode("utf-8").rstrip(".").split(".")))
+
+    def refs(self, i: int) -> Iterator[Tuple[int, int]]:
+        """(id de archivo, offset de línea) del host i."""
+        for k in range(self._ir[i], self._ir[i + 1]):
+            yield self._ra[k], self._ro[k]
+
+    def cerrar(self) -> None:
+        for col in (self._ic, self._ir, self._ra, self._ro):
+            if isinstance(col, memoryview):
+                col.release()
+        self._mm.close()
+        self._f.close()
+
+def _normalizar_sufijo(termino: str) -> str:
+    """Admite 'example.com', '*.example.com' o '.example.com'."""
+    return normalizar_dominio(termino.lstrip("*").lstrip("."))
+
+def consultar_hosts(almacen: AlmacenHosts, sufijos: List[str], escritor: "EscritorResultados") -> Dict[str, int]:
+    """Escribe en el escritor las líneas con algún host bajo cada sufijo."""
+    por_archivo: Dict[int, Dict[int, set]] = {}
+    stats = {"hosts": 0, "cambiados": 0}
+    for s in sufijos:
+        lo, hi = almacen.rango_sufijo(s)
+        stats["hosts"] += hi - lo
+        for i in range(lo, hi):
+            for fid, off in almacen.refs(i):
+                por_archivo.setdefault(fid, {}).setdefault(off, set()).add(s)
+
+    for fid in sorted(por_archivo, key=lambda k: almacen.archivos[k - 1][0]):
+        path, size, mtime = almacen.archivos[fid - 1]
+        if not _sin_cambios(path, size, mtime):
+            stats["cambiados"] += 1
+            sys.stderr.write(f"[!] {path} cambió desde que se extrajeron los hosts; se omite (reconstruye)\n")
+            continue
+        offs = sorted(por_archivo[fid])
+        try:
+            for off, chunk in zip(offs, _leer_lineas_indexadas(path, offs)):
+                buscados = por_archivo[fid][off]
+                for line in _decodificar_lineas(chunk):
+                    hosts = hosts_linea(line.lower())
+                    for s in buscados:
+                        if any(h == s or h.endswith("." + s) for h in hosts):
+                            escritor.agregar(s, line)
+        except Exception as e:
+            sys.stderr.write(f"[!] No se pudo leer {path}: {e}\n")
+    return stats
+
+def main_hosts(argv: List[str]) -> None:
+    """python3 main.py hosts construir|consultar ..."""
+    ap = argparse.ArgumentParser(prog="main.py hosts",
+                                 description="Almacén columnar de hostnames invertidos para consultas por sufijo")
+    sub = ap.add_subparsers(dest="accion", required=True)
+    c = sub.add_parser("construir", help="Extrae todos los hostnames del corpus")
+    _args_construir(c)
+    c.add_argument("--hosts", type=str, default="darktxt_hosts.bin", help="Archivo del almacén")
+    q = sub.add_parser("consultar", help="Líneas con hosts bajo cada sufijo (*.example.com)")
+    q.add_argument("--hosts", type=str, default="darktxt_hosts.bin", help="Archivo del almacén")
+    _args_consultar(q)
+    q.add_argument("--solo-hosts", action="store_true",
+                   help="Sólo listar los hostnames encontrados y cuántas líneas tiene cada uno")
+    args = ap.parse_args(argv)
+
+    ruta = Path(args.hosts).expanduser()
+    if args.accion == "construir":
+        db_root = Path(args.db).expanduser()
+        extensiones = [e.strip().lstrip(".") for e in args.ext.split(",")] if args.ext else DEF_EXTS
+        jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+        t0 = time.monotonic()
+        stats = construir_hosts(ruta, db_root, extensiones, jobs, not args.no_ignore,
+                                args.hilos_listado, not args.no_progress, max(args.mem_mb, 1) * 1024 * 1024)
+        print(f"\n✅ Hosts guardados en {ruta}: {stats['archivos']} archivos, {stats['hosts']} hostnames, "
+              f"{stats['refs']} referencias en {time.monotonic() - t0:.1f}s.")
+        if stats["ignorados"]:
+            print(f"   Ignorados (temporales/sistema): {stats['ignorados']}")
+        return
+
+    if not ruta.exists():
+        print(f"[X] No existe {ruta}. Créalo con: python3 main.py hosts construir --db ...")
+        sys.exit(1)
+    lista_path = Path(args.dominios).expanduser()
+    terminos = leer_dominios(lista_path) if lista_path.exists() else [args.dominios.lower()]
+    sufijos = list(dict.fromkeys(s for s in map(_normalizar_sufijo, terminos) if s))
+    if not sufijos:
+        print("[X] No hay sufijos que consultar.")
+        sys.exit(1)
+
+    almacen = AlmacenHosts(ruta)
+    try:
+        if args.solo_hosts:
+            for s in sufijos:
+                lo, hi = almacen.rango_sufijo(s)
+                print(f"# {s}: {hi - lo} host(s)")
+                for i in range(lo, hi):
+                    print(f"{almacen.host(i)}\t{sum(1 for _ in almacen.refs(i))}")
+            return
+
+        pm_map = cargar_pm_map(Path(args.pm_csv).expanduser()) if args.pm_csv else {}
+        out_dir = (Path(args.out).expanduser() if args.out else Path.cwd()) / "Export"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        escritor = EscritorResultados(out_dir, pm_map, not args.no_infer_pm, layout=args.layout)
+        t0 = time.monotonic()
+        stats = consultar_hosts(almacen, sufijos, escritor)
+        escritor.cerrar(sufijos, args.crear_vacios)
+    finally:
+        almacen.cerrar()
+
+    total_hits = sum(escritor.conteo.values())
+    con_hits = sum(1 for v in escritor.conteo.values() if v)
+    print(f"\n✅ Completado. {con_hits}/{len(sufijos)} sufijos con coincidencias. Total líneas: {total_hits} "
+          f"({stats['hosts']} hostnames, {time.monotonic() - t0:.1f}s).")
+    if stats["cambiados"]:
+        print(f"[!] {stats['cambiados']} archivo(s) cambiaron desde la extracción y se omitieron.")
+    print(f"📂 Archivos guardados en: {out_dir}")
+
+def ejecuciones_vigentes(con: sqlite3.Connection) -> List[int]:
+    """
+    Ejecuciones terminadas que forman los resultados actuales: el último escaneo
+    completo y los incrementales posteriores (lo mismo que queda en Export/ en modo texto).
+    """
+    desde = con.execute("SELECT max(id) FROM ejecuciones WHERE incremental = 0 AND fin IS NOT NULL").fetchone()[0]
+    return [i for (i,) in con.execute("SELECT id FROM ejecuciones WHERE fin IS NOT NULL AND id >= ? ORDER BY id",
+                                      (desde or 0,))]
+
+def consultar_resultados(con: sqlite3.Connection, dominio: str, ejecuciones: List[int]) -> Iterator[Tuple[str, str]]:
+    """(archivo de origen, línea) de un dominio en esas ejecuciones, en el orden en que se encontraron."""
+    fila = con.execute("SELECT id FROM dominios WHERE dominio = ?", (dominio,)).fetchone()
+    if fila is None or not ejecuciones:
+        return
+    q = (f"SELECT a.ruta, h.linea FROM hits h JOIN archivos a ON a.id = h.archivo "
+         f"WHERE h.dominio = ? AND h.ejecucion IN ({','.join('?' * len(ejecuciones))}) "
+         f"ORDER BY h.ejecucion, h.rowid")
+    yield from con.execute(q, [fila[0], *ejecuciones])
+
+def main_resultados(argv: List[str]) -> None:
+    """python3 main.py resultados --sqlite Export/resultados.sqlite --dominios ..."""
+    ap = argparse.ArgumentParser(prog="main.py resultados",
+                                 description="Consulta los resultados guardados con --out-format sqlite")
+    ap.add_argument("--sqlite", type=str, default=str(Path("Export") / NOMBRE_RESULTADOS_SQLITE),
+                    help=f"Base de resultados (por defecto: Export/{NOMBRE_RESULTADOS_SQLITE})")
+    ap.add_argument("--dominios", type=str, help="Archivo de dominios (uno por línea) o término único")
+    ap.add_argument("--ejecucion", type=int, action="append",
+                    help="Sólo esta ejecución (repetible). Por defecto: el último escaneo completo y sus incrementales")
+    ap.add_argument("--todas", action="store_true", help="Todas las ejecuciones terminadas")
+    ap.add_argument("--resumen", action="store_true", help="Sólo dominio, nº de líneas y PM (sin --dominios: todos)")
+    ap.add_argument("--con-archivo", action="store_true", help="Anteponer el archivo de origen a cada línea (separado por TAB)")
+    ap.add_argument("--ejecuciones", action="store_true", help="Listar las ejecuciones guardadas")
+    args = ap.parse_args(argv)
+
+    ruta = Path(args.sqlite).expanduser()
+    if not ruta.exists():
+        print(f"[X] No existe {ruta}. Se crea escaneando con --out-format sqlite.")
+        sys.exit(1)
+    con = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+    try:
+        if args.ejecuciones:
+            for i, ini, fin, db, inc in con.execute("SELECT id, inicio, fin, db, incremental FROM ejecuciones ORDER BY id"):
+                estado = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(fin)) if fin else "sin terminar"
+                print(f"{i}	{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(ini))}	{estado}	"
+                      f"{'incremental' if inc else 'completo'}	{db}")
+            return
+
+        if args.ejecucion:
+            ejecuciones = args.ejecucion
+        elif args.todas:
+            ejecuciones = [i for (i,) in con.execute("SELECT id FROM ejecuciones WHERE fin IS NOT NULL ORDER BY id")]
+        else:
+            ejecuciones = ejecuciones_vigentes(con)
+
+        dominios: List[str] = []
+        if args.dominios:
+            lista_path = Path(args.dominios).expanduser()
+            dominios = leer_dominios(lista_path) if lista_path.exists() else [args.dominios.lower()]
+        elif not args.resumen:
+            print("[X] Indica --dominios (o usa --resumen para ver todos).")
+            sys.exit(1)
+
+        if args.resumen:
+            # por dominio: líneas sumadas y el PM de la ejecución más reciente que lo tenga
+            marcas = ",".join("?" * len(ejecuciones))
+            q = (f"SELECT d.dominio, sum(r.hits), "
+                 f"(SELECT r2.pm FROM resumen r2 WHERE r2.dominio = r.dominio AND r2.pm IS NOT NULL "
+                 f" AND r2.ejecucion IN ({marcas}) ORDER BY r2.ejecucion DESC LIMIT 1) "
+                 f"FROM resumen r JOIN dominios d ON d.id = r.dominio "
+                 f"WHERE r.ejecucion IN ({marcas}) GROUP BY r.dominio ORDER BY d.dominio")
+            filtro = set(dominios)
+            for d, n, pm in con.execute(q, [*ejecuciones, *ejecuciones]):
+                if not filtro or d in filtro:
+                    print(f"{d}\t{n}\t{pm or ''}")
+            return
+
+        for d in dominios:
+            for archivo, line in consultar_resultados(con, d, ejecuciones):
+                print(f"{archivo}\t{line}" if args.con_archivo else line)
+    except BrokenPipeError:
+        # salida cortada por `head` & co.
+        sys.stderr.close()
+    finally:
+        con.close()
 
 def _normaliza_path_input(raw: str) -> Path:
     s = raw.strip().strip('"').strip("'")
@@ -457,8 +3320,73 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--pm-csv", type=str, help="CSV (dominio,pm o dominio,url,pm) para etiquetar a quién pertenecen los leaks")
     ap.add_argument("--no-infer-pm", action="store_true",
                     help="No inferir PM desde hostnames reales en líneas url:user:pass")
+    ap.add_argument("--motor", choices=["texto", "mmap"], default="texto",
+                    help="Motor de búsqueda: 'texto' (decodifica línea a línea) o 'mmap' "
+                         "(bytes mapeados en memoria, plegado ASCII; más rápido)")
+    ap.add_argument("--cache-dir", type=str, default=str(Path.home() / ".cache" / "darktxt"),
+                    help="Carpeta del cache de automatons compilados (por defecto: ~/.cache/darktxt)")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="No leer ni guardar el automaton compilado en disco")
+    ap.add_argument("--cache-mb", type=int, default=1024,
+                    help="Tamaño máximo (MB) del cache de automatons; se borran los menos usados")
+    ap.add_argument("--buffer-mb", type=int, default=64,
+                    help="Memoria máxima (MB) de hits pendientes de escribir antes de volcarlos a disco")
+    ap.add_argument("--max-abiertos", type=int, default=256,
+                    help="Máximo de archivos de resultados abiertos a la vez")
+    ap.add_argument("--dedup", choices=["no", "dominio", "global"], default="no",
+                    help="Descartar líneas repetidas: por dominio, o globalmente (cada línea sólo en el "
+                         "primer dominio que la tuvo)")
+    ap.add_argument("--dedup-modo", choices=["exacto", "bloom"], default="exacto",
+                    help="'exacto' (hashes con volcado a disco) o 'bloom' (probabilístico, memoria fija)")
+    ap.add_argument("--dedup-mb", type=int, default=256,
+                    help="Memoria máxima (MB) para el filtro de duplicados")
+    ap.add_argument("--tmp-dir", type=str,
+                    help="Carpeta para los temporales (spill, dedup). Por defecto TMPDIR si está definido, "
+                         "si no la carpeta de salida")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Escanear sólo archivos nuevos o modificados desde la última ejecución "
+                         "(manifiesto en la carpeta Export) y añadir sus hits a los resultados existentes")
+    ap.add_argument("--checkpoint-seg", type=int, default=120,
+                    help="Cada cuántos segundos guardar un checkpoint del escaneo (0 = nunca)")
+    ap.add_argument("--resume", action="store_true",
+                    help="Continuar desde el último checkpoint sin re-escanear lo ya terminado")
+    ap.add_argument("--hilos-listado", type=int, default=8,
+                    help="Hilos que leen directorios en paralelo mientras se escanea")
+    ap.add_argument("--lote-max-mb", type=int, default=256,
+                    help="Tope de MB por lote de archivos enviado a un worker (los lotes se "
+                         "arman por bytes y se reparten del más grande al más pequeño)")
+    ap.add_argument("--reporte", type=str,
+                    help="Guardar un JSON con estadísticas por archivo y por worker (bytes, líneas, hits, "
+                         "errores de decodificación, tiempos) y los archivos más lentos")
+    ap.add_argument("--metrics-file", type=str,
+                    help="Archivo .prom con métricas en formato Prometheus (textfile collector), "
+                         "reescrito cada --metrics-seg segundos")
+    ap.add_argument("--metrics-port", type=int,
+                    help="Servir las métricas en http://127.0.0.1:<puerto>/metrics mientras dura el escaneo")
+    ap.add_argument("--metrics-seg", type=float, default=15,
+                    help="Cada cuántos segundos refrescar las métricas (por defecto 15)")
+    ap.add_argument("--layout", choices=LAYOUTS, default="plano",
+                    help="'plano': Export/<dominio>.txt; 'hash': Export/ab/cd/<dominio>.txt repartidos "
+                         "por hash (para listas de millones de dominios)")
+    ap.add_argument("--out-format", choices=["txt", "sqlite"], default="txt",
+                    help="'txt': un Export/<dominio>.txt por dominio; 'sqlite': todos los hits en "
+                         f"Export/{NOMBRE_RESULTADOS_SQLITE} (consultable con: main.py resultados)")
+    ap.add_argument("--rango-mb", type=int, default=256,
+                    help="Archivos mayores se parten en rangos de este tamaño (MB) que se "
+                         "escanean en paralelo (0 = no partir)")
     return ap.parse_args()
 
+def _mostrar_volumen(volumen: Dict[str, List[int]], segundos: float) -> None:
+    """Throughput por separado para dumps planos y comprimidos (en disco y descomprimido)."""
+    mb = 1024 * 1024
+    disco, datos = volumen["plano"]
+    if disco:
+        print(f"📊 Planos: {disco / mb:.1f} MB en {segundos:.1f}s ({disco / mb / segundos:.1f} MB/s)")
+    disco, datos = volumen["comprimido"]
+    if disco:
+        print(f"📊 Comprimidos: {disco / mb:.1f} MB en disco ({disco / mb / segundos:.1f} MB/s) → "
+              f"{datos / mb:.1f} MB descomprimidos ({datos / mb / segundos:.1f} MB/s)")
+
 # --- main  aqui va todo---
 def main():
     mostrar_banner()
@@ -572,47 +3500,294 @@ def main():
 
     infer_pm_from_urls = not args.no_infer_pm
 
+    # El mapa se compila una vez; los workers infieren el PM de las líneas de los
+    # dominios que no tienen PM propio, así el padre no re-lee los hits
+    arbol_pm = ArbolPM(pm_map)
+    pm_inferir = None
+    if infer_pm_from_urls and len(arbol_pm):
+        pm_inferir = {d for d in dominios if arbol_pm.buscar(d) is None}
+
     print(f"\n→ {len(dominios)} término(s) cargado(s).")
-    print("→ Listando archivos...")
-    archivos = listar_archivos(db_root, extensiones, ignore_trash=not args.no_ignore)
-    print(f"   {len(archivos)} archivos para analizar.\n")
 
     # Nº de procesos
     jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
-    print(f"→ Escaneando con {jobs} proceso(s)...")
 
-    # Agregador de resultados
-    agg: Dict[str, List[str]] = {d: [] for d in dominios}
+    # Incremental: sólo lo nuevo o modificado desde la última ejecución con la misma lista
+    manifiesto = None
+    if args.incremental:
+        # cambiar de layout invalida el manifiesto: los archivos anteriores no estarían donde se buscan
+        clave_manifiesto = hash_dominios(dominios, args.motor)
+        if args.layout != "plano":
+            clave_manifiesto += ":" + args.layout
+        manifiesto = ManifiestoEscaneo(out_dir / NOMBRE_MANIFIESTO, clave_manifiesto)
+        manifiesto.cargar()
+        if not manifiesto.valido:
+            print("   Incremental: sin manifiesto previo para esta lista de dominios; se escanea todo.")
+    anexar = manifiesto is not None and manifiesto.valido
+
+    # Tareas: archivos enteros o rangos de bytes de los archivos grandes
+    tam_rango = max(args.rango_mb, 0) * 1024 * 1024
+
+    # Escritor en streaming: los hits van a disco a medida que llegan
+    if args.out_format == "sqlite":
+        escritor = EscritorSQLite(
+            out_dir / NOMBRE_RESULTADOS_SQLITE, arbol_pm, infer_pm_from_urls,
+            buffer_max=max(args.buffer_mb, 1) * 1024 * 1024,
+            incremental=anexar,
+            db=str(db_root.resolve()),
+            pm_en_workers=True,
+        )
+    else:
+        escritor = EscritorResultados(
+            out_dir, arbol_pm, infer_pm_from_urls,
+            buffer_max=max(args.buffer_mb, 1) * 1024 * 1024,
+            max_abiertos=limite_abiertos(args.max_abiertos),
+            anexar=anexar,
+            pm_en_workers=True,
+            layout=args.layout,
+        )
 
     # Barra de progreso
     use_pbar = _HAS_TQDM and (not args.no_progress)
-    pbar = tqdm(total=len(archivos), unit="file", desc="Escaneando", smoothing=0.1) if use_pbar else None
+    pbar = tqdm(total=0, unit="B", unit_scale=True, unit_divisor=1024, desc="Escaneando", smoothing=0.1) if use_pbar else None
+
+    # Automaton: se construye una sola vez en el padre y se comparte con los workers
+    cache_dir = None if args.no_cache else Path(args.cache_dir).expanduser()
+    automaton, automaton_path = obtener_automaton(dominios, args.motor, cache_dir, max(args.cache_mb, 1) * 1024 * 1024)
+    # los spills pueden ocupar tanto como la salida: por defecto junto a ella y no en /tmp (a menudo tmpfs)
+    if args.tmp_dir:
+        tmp_base = Path(args.tmp_dir).expanduser()
+        tmp_base.mkdir(parents=True, exist_ok=True)
+    else:
+        tmp_base = None if os.environ.get("TMPDIR") else base_dir
+    tmp_dir = crear_tmp_escaneo(tmp_base, ".darktxt_tmp_" if tmp_base == base_dir else "darktxt_")
+
+    # Dedup opcional de líneas
+    dedup = None if args.dedup == "no" else args.dedup
+    filtro = crear_filtro_duplicados(args.dedup_modo, max(args.dedup_mb, 1) * 1024 * 1024, tmp_dir) if dedup else None
+    duplicados = 0
+    if dedup and args.motor == "mmap":
+        print("ℹ️  Con --dedup los hits viajan como texto por el spill (sin referencias): el dedup en los workers necesita las líneas.")
+
+    # Checkpoint / reanudación
+    clave_checkpoint = hashlib.sha256("|".join([
+        hash_dominios(dominios, args.motor), str(db_root.resolve()), ",".join(extensiones),
+        str(tam_rango), str(args.incremental), str(dedup), args.out_format, args.layout,
+    ]).encode("utf-8")).hexdigest()
+    punto = PuntoControl(out_dir, clave_checkpoint)
+    hechas: List[Tarea] = []
+    ya: set = set()
+    # por archivo, para el manifiesto: [byte hasta el que se leyó, hubo errores de lectura]
+    lecturas: Dict[str, List[object]] = {}
+    dedup_hasta = 0
+    if args.resume:
+        estado = punto.cargar()
+        if estado:
+            escritor.restaurar(estado["escritor"], punto.leer_diario())
+            hechas = [tuple(t) for t in estado["hechas"]]
+            duplicados = estado.get("duplicados", 0)
+            lecturas = estado.get("lecturas", {})
+            dedup_hasta = estado.get("dedup_hasta", 0)
+            ya = set(hechas)
+            print(f"→ Reanudando: {len(ya)} tarea(s) ya hechas.")
+        else:
+            print("→ No hay checkpoint que reanudar; se empieza de cero.")
+    if not hechas:
+        punto.limpiar()
+    escritor.diario = punto.ruta_diario.open("a", encoding="utf-8")
+    if filtro:
+        # sin esto, tras --resume se volverían a escribir las líneas ya escritas antes del corte
+        punto.abrir_filtro(filtro, dedup_hasta)
+    ultimo_checkpoint = time.monotonic()
+
+    # Volumen procesado: [bytes en disco, bytes descomprimidos] de comprimidos y planos
+    volumen = {"comprimido": [0, 0], "plano": [0, 0]}
+    t_inicio = time.monotonic()
+
+    # El listado alimenta al pool a medida que descubre archivos
+    contadores: Dict[str, int] = {}
+    planificados: List[str] = []   # archivos escaneados (total o parcialmente) en esta ejecución
+    n_tareas = [0]
+    bytes_planificados = [0]
+    listado_terminado = [False]
+    informe = InformeEscaneo()
+    ruta_reporte = Path(args.reporte).expanduser() if args.reporte else None
+
+    # Métricas opcionales para monitoreo (se refrescan desde el bucle principal)
+    exportador = None
+    if args.metrics_file or args.metrics_port:
+        exportador = ExportadorMetricas(Path(args.metrics_file).expanduser() if args.metrics_file else None,
+                                        args.metrics_port)
+    ultima_metrica = [time.monotonic(), 0]  # [momento, hits] de la última publicación
+
+    def publicar_metricas(dups: int) -> None:
+        ahora = time.monotonic()
+        hits_s = (informe.totales["hits"] - ultima_metrica[1]) / max(ahora - ultima_metrica[0], 1e-9)
+        exportador.publicar(metricas_prometheus(
+            informe, n_tareas[0], bytes_planificados[0], listado_terminado[0], dups, hits_s))
+        ultima_metrica[:] = [ahora, informe.totales["hits"]]
+
+    if exportador:
+        publicar_metricas(duplicados)
+        if args.metrics_port:
+            print(f"→ Métricas en http://127.0.0.1:{args.metrics_port}/metrics")
+
+    def generar_tareas() -> Iterator[Tuple[Tarea, int]]:
+        for path, st in recorrer_archivos(db_root, extensiones, not args.no_ignore,
+                                          args.hilos_listado, contadores):
+            desde = 0
+            if manifiesto is not None:
+                desde = manifiesto.pendiente(path, st)
+                if desde is None:
+                    continue
+            planificados.append(path)
+            for t in dividir_en_rangos(path, tam_rango, desde, st.st_size):
+                if t in ya:
+                    continue
+                n_tareas[0] += 1
+                bytes_planificados[0] += (st.st_size if t[2] is None else t[2]) - t[1]
+                yield t, peso_tarea(t, st.st_size)
+        listado_terminado[0] = True
 
-    # Lanzar multiprocessing
+    print(f"→ Listando y escaneando con {jobs} proceso(s) [motor: {args.motor}]...")
+
+    # Lanzar multiprocessing (los hits llegan por archivos de spill en tmp_dir)
+    spill = LectorSpill(dominios)
+    reescanear: List[Tarea] = []  # tareas cuyas referencias ya no se pudieron resolver
     try:
-        with mp.Pool(processes=jobs, initializer=_init_worker, initargs=(dominios,)) as pool:
-            for result in pool.imap_unordered(_process_file, archivos, chunksize=10):
-                for d, line in result:
-                    agg[d].append(line)
-                if pbar:
-                    pbar.update(1)
+        ctx, initargs = _preparar_pool(dominios, args.motor, automaton, tmp_dir, automaton_path, dedup,
+                                       arbol_pm if pm_inferir else None, pm_inferir)
+        with ctx.Pool(processes=jobs, initializer=_init_worker, initargs=initargs) as pool, \
+                _InterrupcionDiferida() as intr:
+            lotes = planificar_lotes(generar_tareas(), jobs, max(args.lote_max_mb, 1) * 1024 * 1024)
+
+            def resultados_pool() -> Iterator[List[ResumenTarea]]:
+                yield from pool.imap_unordered(_procesar_lote, lotes, chunksize=1)
+                if reescanear:
+                    # el archivo cambió o desapareció entre el escaneo y la escritura: otra vez, con texto
+                    print(f"\n→ Reescaneando {len(reescanear)} tarea(s) con el texto de las líneas...")
+                    otra_vez = [[t] for t in reescanear]
+                    reescanear.clear()
+                    yield from pool.imap_unordered(functools.partial(_procesar_lote, refs=False),
+                                                   otra_vez, chunksize=1)
+
+            for resultados in resultados_pool():
+                intr.critica = True
+                avance = 0
+                for tarea, ref, stats, pms in resultados:
+                    try:
+                        for d, bloque, n in spill.bloques(ref, stats):
+                            pm_d = pms.get(d)
+                            if not filtro:
+                                escritor.agregar_bloque(d, bloque, n, pm_d[0][1] if pm_d else None, tarea[0])
+                                continue
+                            # con dedup hay que mirar línea a línea
+                            pm_lineas = dict(pm_d) if pm_d else {}
+                            for j, line in enumerate(bloque.split("\n")):
+                                if filtro.visto(clave_dedup(d, line, dedup)):
+                                    continue
+                                escritor.agregar(d, line, pm_lineas.get(j), tarea[0])
+                    except ReferenciasObsoletas as e:
+                        # no se entregó nada de la tarea: no cuenta como hecha
+                        sys.stderr.write(f"[!] {e}; se reescanea {tarea[0]}\n")
+                        reescanear.append(tarea)
+                        continue
+                    duplicados += stats["duplicados"]
+                    v = volumen["comprimido" if stats["comprimido"] else "plano"]
+                    v[0] += stats["bytes_disco"]
+                    v[1] += stats["bytes_datos"]
+                    avance += stats["bytes_disco"]
+                    if manifiesto is not None:
+                        lect = lecturas.setdefault(tarea[0], [None, 0])
+                        if stats.get("leido_hasta") is not None:
+                            lect[0] = max(lect[0] or 0, stats["leido_hasta"])
+                        lect[1] = lect[1] or stats["errores_lectura"]
+                    informe.registrar(tarea, stats)  # después: las referencias suman sus errores al leerse
+                    hechas.append(tarea)
+                if pbar is not None:
+                    pbar.total = bytes_planificados[0]
+                    pbar.update(avance)
+                    pbar.set_postfix_str(f"{len(hechas)}/{n_tareas[0]} tareas", refresh=False)
+                if exportador and time.monotonic() - ultima_metrica[0] >= args.metrics_seg:
+                    publicar_metricas(duplicados + (filtro.duplicados if filtro else 0))
+                if args.checkpoint_seg > 0 and time.monotonic() - ultimo_checkpoint >= args.checkpoint_seg:
+                    punto.guardar(hechas, escritor, {"duplicados": duplicados + (filtro.duplicados if filtro else 0),
+                                                     "lecturas": lecturas}, filtro)
+                    if ruta_reporte:
+                        informe.guardar(ruta_reporte, bytes_planificados[0], listado_terminado[0])
+                    ultimo_checkpoint = time.monotonic()
+                intr.salir_critica()
+    except KeyboardInterrupt:
+        # lo recibido hasta aquí queda a salvo para --resume
+        punto.guardar(hechas, escritor, {"duplicados": duplicados + (filtro.duplicados if filtro else 0),
+                                         "lecturas": lecturas}, filtro)
+        print(f"\n[!] Checkpoint guardado ({len(hechas)} tareas). Continúa con --resume.")
+        raise
     finally:
-        if pbar:
+        if pbar is not None:
             pbar.close()
-
-    # Guardar
+        if filtro:
+            duplicados += filtro.duplicados
+            filtro.cerrar()
+        spill.cerrar()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        gc.unfreeze()  # el pool ya terminó: lo congelado en _preparar_pool vuelve al GC
+
+    t_escaneo = max(time.monotonic() - t_inicio, 1e-9)
+    print(f"   {len(planificados)} archivo(s) analizados en {n_tareas[0]} tarea(s) "
+          f"(ignorados {contadores.get('ignorados', 0)} temporales/sistema).")
+    if contadores.get("sin_zstd"):
+        print(f"   (Omitidos {contadores['sin_zstd']} .zst: falta el paquete 'zstandard')")
+
+    # Guardar lo pendiente
     print("→ Guardando resultados...")
-    escribir_resultados(agg, out_dir, crear_vacios, pm_map, infer_pm_from_urls)
-
-    total_hits = sum(len(v) for v in agg.values())
-    con_hits = sum(1 for v in agg.values() if v)
+    escritor.cerrar(dominios, crear_vacios)
+    escritor.diario.close()
+    punto.limpiar()
+    if manifiesto is not None:
+        con_errores = 0
+        for a in planificados:
+            hasta, error = lecturas.get(a, (None, 0))
+            if error:
+                con_errores += 1  # sin registrar: se vuelve a intentar en la próxima ejecución
+                continue
+            manifiesto.registrar(a, hasta)
+        manifiesto.podar()
+        manifiesto.guardar()
+        if con_errores:
+            print(f"   Incremental: {con_errores} archivo(s) con errores de lectura quedan pendientes.")
+
+    total_hits = sum(escritor.conteo.values())
+    con_hits = sum(1 for v in escritor.conteo.values() if v)
     print(f"\n✅ Completado. {con_hits}/{len(dominios)} términos con coincidencias. Total líneas: {total_hits}.")
-    print(f"📂 Archivos guardados en: {out_dir}")
+    _mostrar_volumen(volumen, t_escaneo)
+    if dedup:
+        print(f"♻️  Duplicados descartados ({dedup}, {args.dedup_modo}): {duplicados}")
+    if informe.totales["errores_decod"]:
+        print(f"⚠️  Secuencias UTF-8 inválidas descartadas: {informe.totales['errores_decod']}")
+    if ruta_reporte:
+        informe.guardar(ruta_reporte, bytes_planificados[0], listado_terminado[0])
+        print(f"🧾 Reporte de la ejecución: {ruta_reporte}")
+    if exportador:
+        publicar_metricas(duplicados)
+        exportador.cerrar()
+    if args.out_format == "sqlite":
+        print(f"🗄️  Resultados en: {escritor.ruta} (ejecución {escritor.ejecucion}). "
+              f"Consulta: python3 main.py resultados --sqlite {escritor.ruta} --dominios ...")
+    else:
+        print(f"📂 Archivos guardados en: {out_dir}")
 
 if __name__ == "__main__":
     try:
         mp.freeze_support()
-        main()
+        if len(sys.argv) > 1 and sys.argv[1] == "indice":
+            main_indice(sys.argv[2:])
+        elif len(sys.argv) > 1 and sys.argv[1] == "hosts":
+            main_hosts(sys.argv[2:])
+        elif len(sys.argv) > 1 and sys.argv[1] == "resultados":
+            main_resultados(sys.argv[2:])
+        else:
+            main()
     except KeyboardInterrupt:
         print("\n[!] Proceso interrumpido.")
         print("\n[!] Proceso interrumpido.")
\ No newline at end of file
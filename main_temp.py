@@ -9,9 +9,19 @@ from typing import Dict, List, Tuple, Optional
 import multiprocessing as mp
 import unicodedata
 import csv
+import io
 import re
+import random
+import shutil
 import smtplib
 import ssl
+import struct
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
 from email.message import EmailMessage
 from urllib.parse import urlparse
@@ -448,20 +458,15 @@ def build_ssl_context(ca_file: Optional[str] = None, skip_verify: bool = False)
         print("[!] Advertencia: verificación TLS desactivada (SMTP_SKIP_VERIFY=true)")
     return ctx
 
-def send_leak_email(cfg: EmailConfig, to_addr: str, subject: str, body: str, attachments: List[Path] = None) -> bool:
-    """
-    Envía email soportando:
-      - SMTP_TLS_MODE=starttls (por defecto) → típico en puerto 587 (o 25 STARTTLS si el server lo soporta)
-      - SMTP_TLS_MODE=ssl                    → SSL implícito (465)
-      - SMTP_TLS_MODE=none                   → sin TLS (25)  **no recomendado para producción**
-    Soporta:
-      - SMTP_CA_FILE  → ruta a PEM de cadena/CA
-      - SMTP_SKIP_VERIFY=true → desactiva verificación TLS (solo pruebas)
-    """
+def _smtp_opciones() -> Tuple[str, ssl.SSLContext]:
+    """(SMTP_TLS_MODE, contexto SSL) leídos del entorno."""
     tls_mode = (os.environ.get("SMTP_TLS_MODE", "starttls") or "starttls").lower()
     ca_file = os.environ.get("SMTP_CA_FILE") or None
     skip_verify = (os.environ.get("SMTP_SKIP_VERIFY", "false").strip().lower() in ("1","true","yes","y","si","sí"))
+    return tls_mode, build_ssl_context(ca_file, skip_verify)
 
+def build_leak_message(cfg: EmailConfig, to_addr: str, subject: str, body: str,
+                       attachments: List[Path] = None) -> EmailMessage:
     msg = EmailMessage()
     msg["From"] = cfg.sender
     msg["To"] = to_addr
@@ -474,39 +479,360 @@ def send_leak_email(cfg: EmailConfig, to_addr: str, subject: str, body: str, att
             msg.add_attachment(data, maintype="text", subtype="plain", filename=ap.name)
         except Exception as e:
             print(f"[!] No se pudo adjuntar {ap}: {e}")
+    return msg
+
+class EnvioIncierto(smtplib.SMTPException):
+    """La conexión se cortó después de mandar DATA: el servidor pudo haber aceptado el mensaje."""
+
+class _MarcaData:
+    """Anota en `en_data` si la transacción en curso ya llegó al comando DATA."""
+    en_data = False
 
-    ctx = build_ssl_context(ca_file, skip_verify)
+    def data(self, msg):
+        self.en_data = True
+        return super().data(msg)
 
+class _SMTP(_MarcaData, smtplib.SMTP):
+    pass
+
+class _SMTP_SSL(_MarcaData, smtplib.SMTP_SSL):
+    pass
+
+def smtp_connect(cfg: EmailConfig, tls_mode: str, ctx: ssl.SSLContext) -> smtplib.SMTP:
+    """
+    Abre una conexión SMTP autenticada según SMTP_TLS_MODE.
+    En modo "none" sólo se hace login si el servidor anuncia AUTH (relay interno
+    o servidor SMTP local de pruebas).
+    """
+    if tls_mode == "ssl":
+        # SSL implícito (465)
+        server = _SMTP_SSL(cfg.host, cfg.port, timeout=20, context=ctx)
+    else:
+        # starttls o none
+        server = _SMTP(cfg.host, cfg.port, timeout=20)
     try:
-        if tls_mode == "ssl":
-            # SSL implícito (465)
-            with smtplib.SMTP_SSL(cfg.host, cfg.port, timeout=20, context=ctx) as server:
-                server.login(cfg.user, cfg.password)
-                server.send_message(msg)
-        else:
-            # starttls o none
-            with smtplib.SMTP(cfg.host, cfg.port, timeout=20) as server:
-                server.ehlo()
-                if tls_mode == "starttls":
-                    server.starttls(context=ctx)
-                    server.ehlo()
-                # En modo "none", no TLS: no llamar starttls
-                server.login(cfg.user, cfg.password)
-                server.send_message(msg)
-        return True
+        server.ehlo()
+        if tls_mode == "starttls":
+            server.starttls(context=ctx)
+            server.ehlo()
+        # En modo "none", no TLS: no llamar starttls
+        if tls_mode != "none" or server.has_extn("auth"):
+            server.login(cfg.user, cfg.password)
+    except Exception:
+        server.close()
+        raise
+    return server
 
-    except smtplib.SMTPAuthenticationError as e:
+def _informar_error_smtp(e: Exception) -> None:
+    if isinstance(e, smtplib.SMTPAuthenticationError):
         print(f"[!] Autenticación SMTP fallida: {e}")
-    except smtplib.SMTPResponseException as e:
+    elif isinstance(e, EnvioIncierto):
+        print(f"[!] {e}")
+    elif isinstance(e, smtplib.SMTPResponseException):
         print(f"[!] Servidor SMTP respondió {e.smtp_code} {e.smtp_error}")
-    except ssl.SSLError as e:
+    elif isinstance(e, ssl.SSLError):
         print(f"[!] Error TLS/SSL: {e}")
         print("    Sugerencias: verifica fecha/hora del sistema, usa SMTP_TLS_MODE apropiado,"
               " ajusta SMTP_CA_FILE a la cadena PEM o actualiza certificados del sistema.")
-    except Exception as e:
+    else:
         print(f"[!] Error genérico SMTP: {e}")
 
-    return False
+def _es_transitorio(e: Exception) -> bool:
+    """Fallos que merece la pena reintentar: red caída, desconexión o respuesta 4xx."""
+    if isinstance(e, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in e.recipients.values())
+    if isinstance(e, smtplib.SMTPResponseException):
+        return 400 <= e.smtp_code < 500
+    if isinstance(e, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(e, (smtplib.SMTPException, ssl.SSLError)):
+        return False
+    # resto de OSError: conexión rechazada/reiniciada, timeouts...
+    return isinstance(e, OSError)
+
+class EnviadorSMTP:
+    """
+    Envía muchas notificaciones reutilizando conexiones ya autenticadas:
+      - `conexiones` hilos, cada uno con su propia conexión SMTP (se abre al primer envío
+        y se renueva tras `max_por_conexion` mensajes o si el servidor la corta).
+      - `por_segundo` limita los mensajes/s entre todos los hilos (0 = sin límite).
+      - Los fallos transitorios (4xx, desconexiones, timeouts) se reintentan hasta
+        `reintentos` veces con espera exponencial; los permanentes (5xx, auth) no.
+      - Una desconexión o timeout después de DATA no se reintenta: el servidor pudo haber
+        aceptado el mensaje y reenviarlo lo duplicaría (se devuelve EnvioIncierto).
+    """
+
+    def __init__(self, cfg: EmailConfig, conexiones: int = 4, por_segundo: float = 0.0,
+                 reintentos: int = 3, espera_base: float = 1.0, max_por_conexion: int = 100):
+        self.cfg = cfg
+        self.conexiones = max(conexiones, 1)
+        self.intervalo = 1.0 / por_segundo if por_segundo > 0 else 0.0
+        self.reintentos = max(reintentos, 0)
+        self.espera_base = espera_base
+        self.max_por_conexion = max(max_por_conexion, 1)
+        self.tls_mode, self.ctx = _smtp_opciones()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._siguiente = 0.0               # instante a partir del cual sale el próximo mensaje
+        self._abiertas: List[smtplib.SMTP] = []
+
+    def _esperar_turno(self) -> None:
+        if not self.intervalo:
+            return
+        with self._lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self._siguiente)
+            self._siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+    def _conexion(self) -> smtplib.SMTP:
+        server = getattr(self._local, "server", None)
+        if server is not None and self._local.enviados >= self.max_por_conexion:
+            self._descartar()
+            server = None
+        if server is None:
+            server = smtp_connect(self.cfg, self.tls_mode, self.ctx)
+            self._local.server, self._local.enviados = server, 0
+            with self._lock:
+                self._abiertas.append(server)
+        return server
+
+    def _descartar(self) -> None:
+        server = getattr(self._local, "server", None)
+        if server is None:
+            return
+        self._local.server = None
+        with self._lock:
+            if server in self._abiertas:
+                self._abiertas.remove(server)
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def enviar(self, msg: EmailMessage) -> Optional[Exception]:
+        """Envía un mensaje con reintentos. Devuelve None si salió o el último error."""
+        for intento in range(self.reintentos + 1):
+            self._esperar_turno()
+            server = None
+            try:
+                server = self._conexion()
+                server.en_data = False
+                server.send_message(msg)
+                self._local.enviados += 1
+                return None
+            except Exception as e:
+                # tras un error la conexión puede haber quedado a medias: se abre otra
+                self._descartar()
+                if server is not None and server.en_data and not isinstance(e, smtplib.SMTPResponseException):
+                    # sin respuesta del servidor al mensaje: no se sabe si lo aceptó
+                    incierto = EnvioIncierto(f"La conexión se cortó después de DATA ({e}); "
+                                             f"el mensaje pudo haberse entregado y no se reintenta")
+                    incierto.__cause__ = e
+                    return incierto
+                if not _es_transitorio(e) or intento == self.reintentos:
+                    return e
+                time.sleep(self.espera_base * (2 ** intento) * random.uniform(0.5, 1.5))
+        return None
+
+    def enviar_todos(self, trabajos):
+        """
+        trabajos: iterable de (clave, EmailMessage o callable que lo construye).
+        Genera (clave, error o None) según van terminando.
+        """
+        def _uno(trabajo):
+            clave, msg = trabajo
+            try:
+                msg = msg() if callable(msg) else msg
+            except Exception as e:
+                return clave, e
+            return clave, self.enviar(msg)
+
+        with ThreadPoolExecutor(max_workers=self.conexiones) as ex:
+            futuros = [ex.submit(_uno, t) for t in trabajos]
+            for fut in as_completed(futuros):
+                yield fut.result()
+
+    def cerrar(self) -> None:
+        with self._lock:
+            abiertas, self._abiertas = self._abiertas, []
+        for server in abiertas:
+            try:
+                server.quit()
+            except Exception:
+                server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+# --- modo resumen (un correo por destinatario) ---
+_ZIP_ENTRADA = 30 + 46   # cabecera local + entrada del directorio central (sin contar el nombre)
+_ZIP_FIN = 22            # registro de fin del directorio central
+_ZIP_LOCAL = struct.Struct("<4s5H3L2H")
+_ZIP_CENTRAL = struct.Struct("<4s6H3L5H2L")
+_ZIP_FIN_REG = struct.Struct("<4s4H2LH")
+# sin ZIP64: tamaños y offsets de 32 bits y como mucho 65535 entradas por .zip
+_ZIP_MAX_BYTES = 0xFFFFFFFF - 1
+_ZIP_MAX_ENTRADAS = 0xFFFF
+
+@dataclass
+class AdjuntoComprimido:
+    """Resultados de un dominio ya comprimidos con deflate (en `datos`, un temporal) para el .zip."""
+    dominio: str
+    nombre: str
+    datos: Path
+    crc: int
+    tam: int
+    tam_comp: int
+    fecha: Tuple[int, int]  # (hora, fecha) en formato DOS
+
+def _comprimir_deflate(path: Path, destino: Path) -> Tuple[int, int, int]:
+    """Comprime `path` con deflate (como zipfile) en `destino`. Devuelve (crc32, bytes, bytes comprimidos)."""
+    comp = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+    crc = tam = tam_comp = 0
+    with path.open("rb") as f, destino.open("wb") as out:
+        for bloque in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(bloque, crc)
+            tam += len(bloque)
+            tam_comp += out.write(comp.compress(bloque))
+        tam_comp += out.write(comp.flush())
+    return crc, tam, tam_comp
+
+def _fecha_dos(mtime: float) -> Tuple[int, int]:
+    """(hora, fecha) DOS de un mtime, como las guarda zipfile."""
+    t = time.localtime(mtime)
+    anio = max(t.tm_year, 1980)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((anio - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+def _zip_de_adjuntos(adjuntos: List[AdjuntoComprimido]) -> bytes:
+    """
+    .zip con los adjuntos ya comprimidos, sin volver a pasar deflate (zipfile no admite
+    escribir datos precomprimidos). Ocupa exactamente lo que calculó planificar_resumen.
+    No escribe ZIP64: si algo no cabe en el formato clásico falla con ValueError
+    (planificar_resumen ya reparte las partes para que no pase).
+    """
+    total = _ZIP_FIN + sum(a.tam_comp + _ZIP_ENTRADA + 2 * len(a.nombre.encode("utf-8")) for a in adjuntos)
+    if len(adjuntos) > _ZIP_MAX_ENTRADAS or total > _ZIP_MAX_BYTES or \
+            any(a.tam > _ZIP_MAX_BYTES for a in adjuntos):
+        raise ValueError(f"el .zip ({len(adjuntos)} archivo(s), {total} bytes) no cabe en el formato "
+                         f"sin ZIP64 (4 GiB / 65535 entradas)")
+    buf = io.BytesIO()
+    central = []
+    for a in adjuntos:
+        nombre = a.nombre.encode("utf-8")
+        offset = buf.tell()
+        buf.write(_ZIP_LOCAL.pack(b"PK\x03\x04", 20, 0x800, zipfile.ZIP_DEFLATED, *a.fecha,
+                                  a.crc, a.tam_comp, a.tam, len(nombre), 0))
+        buf.write(nombre)
+        with a.datos.open("rb") as f:
+            shutil.copyfileobj(f, buf, 1024 * 1024)
+        central.append(_ZIP_CENTRAL.pack(b"PK\x01\x02", (3 << 8) | 20, 20, 0x800, zipfile.ZIP_DEFLATED, *a.fecha,
+                                         a.crc, a.tam_comp, a.tam, len(nombre), 0, 0, 0, 0,
+                                         0o100644 << 16, offset) + nombre)
+    inicio = buf.tell()
+    for entrada in central:
+        buf.write(entrada)
+    buf.write(_ZIP_FIN_REG.pack(b"PK\x05\x06", 0, 0, len(central), len(central),
+                                buf.tell() - inicio, inicio, 0))
+    return buf.getvalue()
+
+def _tam_en_correo(n: int) -> int:
+    """Tamaño de un adjunto de n bytes ya codificado en base64 (líneas de 76 + CRLF)."""
+    return -(-n // 57) * 78
+
+def agrupar_por_destinatario(meta: Dict[str, Dict[str, Optional[str]]]) -> Dict[str, List[str]]:
+    """
+    Dominios de `meta` agrupados por correo destino, sin distinguir mayúsculas;
+    cada grupo usa la dirección tal y como apareció la primera vez.
+    """
+    grupos: Dict[str, List[str]] = {}
+    canonico: Dict[str, str] = {}
+    for dominio, info in meta.items():
+        email = info.get("email")
+        if email:
+            email = canonico.setdefault(email.lower(), email)
+            grupos.setdefault(email, []).append(dominio)
+    return grupos
+
+def planificar_resumen(dominios: List[str], meta: Dict[str, Dict[str, Optional[str]]],
+                       max_bytes: int, tmp_dir: Path) -> Tuple[List[List[AdjuntoComprimido]], List[str]]:
+    """
+    Reparte los dominios de un destinatario en partes cuyo .zip, tal y como viaja
+    en el correo, no pase de max_bytes. Un dominio que por sí solo lo supera va en
+    una parte propia (y se avisa). Cada archivo se comprime una sola vez, en tmp_dir:
+    el correo reutiliza esa salida (ver _zip_de_adjuntos).
+    Un archivo de más de 4 GiB (sin comprimir o comprimido) no cabe en el .zip y no se adjunta.
+    Devuelve (partes, dominios cuyo archivo de resultados no se pudo leer o adjuntar).
+    """
+    partes: List[List[AdjuntoComprimido]] = []
+    faltan: List[str] = []
+    actual: List[AdjuntoComprimido] = []
+    tam = _ZIP_FIN
+    for d in dominios:
+        p = Path(meta[d]["path"])
+        fd, destino = tempfile.mkstemp(suffix=".deflate", dir=tmp_dir)
+        os.close(fd)
+        destino = Path(destino)
+        try:
+            mtime = p.stat().st_mtime
+            crc, tam_arch, tam_comp = _comprimir_deflate(p, destino)
+        except OSError as e:
+            print(f"[!] No se pudo leer {p} ({d}): {e}; se indica en el resumen sin adjunto.")
+            destino.unlink(missing_ok=True)
+            faltan.append(d)
+            continue
+        if tam_arch > _ZIP_MAX_BYTES or tam_comp > _ZIP_MAX_BYTES:
+            print(f"[!] {p.name} ({d}) pasa de 4 GiB y no cabe en el .zip; se indica en el resumen sin adjunto.")
+            destino.unlink(missing_ok=True)
+            faltan.append(d)
+            continue
+        adj = AdjuntoComprimido(d, p.name, destino, crc, tam_arch, tam_comp, _fecha_dos(mtime))
+        n = tam_comp + _ZIP_ENTRADA + 2 * len(p.name.encode("utf-8"))
+        if actual and (_tam_en_correo(tam + n) > max_bytes or tam + n > _ZIP_MAX_BYTES
+                       or len(actual) >= _ZIP_MAX_ENTRADAS):
+            partes.append(actual)
+            actual, tam = [], _ZIP_FIN
+        if not actual and _tam_en_correo(tam + n) > max_bytes:
+            print(f"[!] {p.name} comprimido ya supera el límite por correo; se envía solo.")
+        actual.append(adj)
+        tam += n
+    if actual or faltan:
+        partes.append(actual)
+    return partes, faltan
+
+def build_digest_message(cfg: EmailConfig, to_addr: str, adjuntos: List[AdjuntoComprimido],
+                         meta: Dict[str, Dict[str, Optional[str]]],
+                         parte: int = 1, total: int = 1, faltan: Optional[List[str]] = None) -> EmailMessage:
+    """
+    Un correo con el resumen de varios dominios y sus resultados en un único .zip.
+    `faltan` son dominios con coincidencias cuyo archivo no se pudo adjuntar (van en el texto).
+    """
+    sufijo = f" (parte {parte}/{total})" if total > 1 else ""
+    faltan = faltan or []
+    dominios = [a.dominio for a in adjuntos]
+    listado = "\n".join(f"  - {d} (PM: {meta[d].get('pm') or '(desconocido)'})" for d in dominios + faltan)
+    n = len(dominios) + len(faltan)
+    body = (
+        f"Hola,\n\n"
+        f"Se han encontrado posibles coincidencias para {n} término(s)/dominio(s):\n"
+        f"{listado}\n\n"
+        + ("Adjunto un .zip con el detalle de líneas encontradas de cada uno.\n" if adjuntos else "")
+        + (f"No se pudo adjuntar el detalle de: {', '.join(faltan)} (archivo de resultados no disponible "
+           f"o demasiado grande).\n"
+           if faltan else "")
+        + (f"Este es el correo {parte} de {total}.\n" if total > 1 else "")
+        + "\n— Enviado automáticamente por DarkTxt-finder\n"
+    )
+    msg = build_leak_message(cfg, to_addr, f"[Leak] Resumen de resultados: {n} dominio(s){sufijo}", body)
+
+    if adjuntos:
+        nombre = f"darktxt-leaks-{parte}de{total}.zip" if total > 1 else "darktxt-leaks.zip"
+        msg.add_attachment(_zip_de_adjuntos(adjuntos), maintype="application", subtype="zip", filename=nombre)
+    return msg
 
 # --- CLI ---
 def parse_args() -> argparse.Namespace:
@@ -529,6 +855,16 @@ def parse_args() -> argparse.Namespace:
     ap.add_argument("--env-file", type=str, help="Ruta de un .env externo con credenciales SMTP (opcional)")
     ap.add_argument("--auto-notify", action="store_true",
                     help="No preguntar y enviar correo automáticamente si hay destinatario y SMTP configurado")
+    ap.add_argument("--smtp-conexiones", type=int, default=4,
+                    help="Conexiones SMTP simultáneas (reutilizadas entre mensajes). Por defecto: 4")
+    ap.add_argument("--smtp-rate", type=float, default=0.0,
+                    help="Máximo de mensajes por segundo entre todas las conexiones (0 = sin límite)")
+    ap.add_argument("--smtp-reintentos", type=int, default=3,
+                    help="Reintentos por mensaje ante fallos transitorios (4xx, desconexión, timeout). Por defecto: 3")
+    ap.add_argument("--digest", action="store_true",
+                    help="Un correo por destinatario con todos sus dominios en un único .zip (en vez de uno por dominio)")
+    ap.add_argument("--digest-max-mb", type=float, default=10.0,
+                    help="Tamaño máximo del .zip por correo en modo --digest; si se supera se reparte en varios. Por defecto: 10")
     return ap.parse_args()
 
 def _ask_yes(prompt: str, default: bool = False) -> bool:
@@ -659,34 +995,71 @@ def main():
             return
 
     print("→ Enviando notificaciones de leaks por correo...")
+
+    def _mensaje(dominio: str, info: Dict[str, Optional[str]]):
+        # el mensaje (con su adjunto) se construye en el hilo que lo envía
+        def construir() -> EmailMessage:
+            attachment = Path(info["path"])
+            pm_info = info.get("pm") or "(desconocido)"
+            subject = f"[Leak] Resultados para {dominio}"
+            body = (
+                f"Hola,\n\n"
+                f"Se han encontrado posibles coincidencias para el término/dominio: {dominio}\n"
+                f"PM asignado: {pm_info}\n\n"
+                f"Adjunto el archivo con el detalle de líneas encontradas.\n\n"
+                f"— Enviado automáticamente por DarkTxt-finder\n"
+            )
+            return build_leak_message(
+                smtp_cfg,
+                to_addr=info["email"],
+                subject=subject,
+                body=body,
+                attachments=[attachment] if attachment.exists() else []
+            )
+        return construir
+
+    def _resumen(to_addr: str, adjuntos: List[AdjuntoComprimido], parte: int, total: int, faltan: List[str]):
+        def construir() -> EmailMessage:
+            try:
+                return build_digest_message(smtp_cfg, to_addr, adjuntos, dominios_con_dest, parte, total, faltan)
+            finally:
+                for a in adjuntos:
+                    a.datos.unlink(missing_ok=True)
+        return construir
+
+    # trabajos: (descripción para el log, mensaje a construir)
+    tmp_dir = None
+    if args.digest:
+        max_bytes = max(int(args.digest_max_mb * 1024 * 1024), 1)
+        # los adjuntos se comprimen al planificar y el correo reutiliza esa salida
+        tmp_dir = Path(tempfile.mkdtemp(prefix="darktxt_resumen_"))
+        trabajos = []
+        for to_addr, doms in agrupar_por_destinatario(dominios_con_dest).items():
+            partes, faltan = planificar_resumen(doms, dominios_con_dest, max_bytes, tmp_dir)
+            for i, parte in enumerate(partes, start=1):
+                n = len(parte) + (len(faltan) if i == 1 else 0)
+                desc = f"{to_addr} ({n} dominio(s)" + (f", parte {i}/{len(partes)})" if len(partes) > 1 else ")")
+                trabajos.append((desc, _resumen(to_addr, parte, i, len(partes), faltan if i == 1 else [])))
+        print(f"   {len(dominios_con_dest)} dominio(s) agrupados en {len(trabajos)} correo(s).")
+    else:
+        trabajos = [(f"{info['email']} ({dominio})", _mensaje(dominio, info))
+                    for dominio, info in dominios_con_dest.items() if info["email"]]
     enviados, fallidos = 0, 0
-    for dominio, info in dominios_con_dest.items():
-        to_addr = info["email"]
-        if not to_addr:  # redundante, pero seguro
-            continue
-        attachment = Path(info["path"])
-        pm_info = info.get("pm") or "(desconocido)"
-        subject = f"[Leak] Resultados para {dominio}"
-        body = (
-            f"Hola,\n\n"
-            f"Se han encontrado posibles coincidencias para el término/dominio: {dominio}\n"
-            f"PM asignado: {pm_info}\n\n"
-            f"Adjunto el archivo con el detalle de líneas encontradas.\n\n"
-            f"— Enviado automáticamente por DarkTxt-finder\n"
-        )
-        ok = send_leak_email(
-            smtp_cfg,
-            to_addr=to_addr,
-            subject=subject,
-            body=body,
-            attachments=[attachment] if attachment.exists() else []
-        )
-        if ok:
-            enviados += 1
-            print(f"   ✔ Enviado a {to_addr} ({dominio})")
-        else:
-            fallidos += 1
-            print(f"   ✖ Falló envío a {to_addr} ({dominio})")
+    enviador = EnviadorSMTP(smtp_cfg, conexiones=args.smtp_conexiones,
+                            por_segundo=args.smtp_rate, reintentos=args.smtp_reintentos)
+    try:
+        with enviador:
+            for desc, error in enviador.enviar_todos(trabajos):
+                if error is None:
+                    enviados += 1
+                    print(f"   ✔ Enviado a {desc}")
+                else:
+                    fallidos += 1
+                    _informar_error_smtp(error)
+                    print(f"   ✖ Falló envío a {desc}")
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
     print(f"→ Notificaciones completadas. Éxitos: {enviados}, Fallos: {fallidos}")
 